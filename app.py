@@ -1,9 +1,99 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
 from thyroid_detection.pipline.prediction_pipeline import ThyroidClassifier, ThyroidData
 from thyroid_detection.exception import ThyroidException
+from thyroid_detection.constants import (INVALID_ROWS_HEADER, MODEL_TIER_HEADER, MODEL_VERSION_HEADER,
+                                         MODEL_VERSION_QUERY_PARAM, REQUEST_DEADLINE_HEADER)
+from thyroid_detection.entity.config_entity import ThyroidPredictorConfig
+from thyroid_detection.serving.admission import AdmissionController, RequestShed, parse_deadline_ms
+from thyroid_detection.serving.batch_io import (NDJSON_MEDIA_TYPE, UnsupportedBatchFormat, encode_batch_predictions,
+                                                iter_ndjson_predictions, negotiate_batch_response, parse_batch_body)
+from thyroid_detection.serving.metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY, render_metrics, stage_timer
+from thyroid_detection.serving.model_tiers import register_queue_depth_source
+from thyroid_detection.serving.model_pool import ModelVersionNotFound
+from thyroid_detection.serving.profiler import (COLLAPSED_FORMAT, ProfilerBusy, ProfileRequest, is_authorized,
+                                                profiling_enabled, run_profile)
+from thyroid_detection.serving.validation import InputValidationError
+from thyroid_detection.serving.warmup import ModelWarmup
 
 app = Flask(__name__)
 
+# Prefetch and warm the model in the background as soon as the app is created
+model_warmup = ModelWarmup()
+model_warmup.start()
+
+# Bounds concurrent and queued predictions, overflow is answered with 503 + Retry-After
+admission = AdmissionController()
+# Requests waiting for a slot route traffic to the fallback model when they pile up
+register_queue_depth_source(lambda: admission.queue_depth)
+
+def admit_request():
+    return admission.reserve(parse_deadline_ms(request.headers.get(REQUEST_DEADLINE_HEADER)))
+
+def shed_response(e: RequestShed):
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
+
+def invalid_input_response(e: InputValidationError):
+    return jsonify({"error": str(e), "errors": e.errors}), 422
+
+def request_classifier():
+    # A model version pinned by header or query parameter is served from the model pool
+    model_version = request.headers.get(MODEL_VERSION_HEADER) or request.args.get(MODEL_VERSION_QUERY_PARAM)
+    return ThyroidClassifier(ThyroidPredictorConfig(model_version=model_version or None))
+
+@app.before_request
+def start_request_metrics():
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.request_tracker = REGISTRY.track_request(endpoint).__enter__()
+
+@app.teardown_request
+def stop_request_metrics(exception=None):
+    request_tracker = g.pop('request_tracker', None)
+    if request_tracker is not None:
+        request_tracker.__exit__(None, None, None)
+
+@app.route('/healthz')
+def healthz():
+    return jsonify({"status": "alive"})
+
+@app.route('/readyz')
+def readyz():
+    return jsonify(model_warmup.status()), 200 if model_warmup.is_ready else 503
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.route('/drift')
+def drift():
+    # Compares the inputs predicted by this worker with the training inputs of the current model
+    if not model_warmup.is_ready:
+        return jsonify({"error": "Model is not loaded yet"}), 503
+    try:
+        return jsonify(ThyroidClassifier().drift_report())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/debug/profile')
+def debug_profile():
+    # Samples this worker process only; disabled unless DEBUG_PROFILE_TOKEN is set
+    if not profiling_enabled():
+        return jsonify({"error": "Not found"}), 404
+    if not is_authorized(request.headers.get('Authorization')):
+        return jsonify({"error": "Unauthorized"}), 401, {"WWW-Authenticate": "Bearer"}
+    try:
+        profile_request = ProfileRequest.from_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        result = run_profile(profile_request)
+    except ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if profile_request.format == COLLAPSED_FORMAT:
+        return Response(result["collapsed"], mimetype="text/plain")
+    return jsonify(result)
+
 @app.route('/')
 def home():
     return render_template('index.html')
@@ -11,44 +101,41 @@ def home():
 @app.route('/predict', methods=['POST'])
 def predict():
     try:
-        # Extracting input values from the form
-        data = request.form.to_dict()
-        
-        # Creating an instance of ThyroidData with the extracted form data
-        thyroid_data = ThyroidData(
-            sex=data.get('sex'),
-            on_thyroxine=data.get('on_thyroxine'),
-            query_on_thyroxine=data.get('query_on_thyroxine'),
-            on_antithyroid_medication=data.get('on_antithyroid_medication'),
-            sick=data.get('sick'),
-            pregnant=data.get('pregnant'),
-            I131_treatment=data.get('I131_treatment'),
-            tumor=data.get('tumor'),
-            hypopituitary=data.get('hypopituitary'),
-            psych=data.get('psych'),
-            age=int(data.get('age')),
-            TSH=float(data.get('TSH')),
-            T3=float(data.get('T3')),
-            TT4=float(data.get('TT4')),
-            T4U=float(data.get('T4U')),
-            FTI=float(data.get('FTI'))
-        )
-
-        # Converting input data to DataFrame
-        input_dataframe = thyroid_data.get_thyroid_input_data_frame()
-
-        # Creating an instance of the ThyroidClassifier
-        classifier = ThyroidClassifier()
-
-        # Making the prediction
-        prediction = classifier.predict(input_dataframe)
+        with admit_request():
+            # Extracting input values from the form
+            with stage_timer("parse_form"):
+                data = request.form.to_dict()
+
+            # Creating an instance of ThyroidData with the extracted form data, checked against the schema
+            with stage_timer("build_thyroid_data"):
+                thyroid_data = ThyroidData.from_dict(data)
+
+            # Converting input data to DataFrame
+            with stage_timer("build_dataframe"):
+                input_dataframe = thyroid_data.get_thyroid_input_data_frame()
+
+            # Creating an instance of the ThyroidClassifier
+            classifier = request_classifier()
+
+            # Making the prediction, with the model tier (primary or fallback) that served it
+            labels, model_tier = classifier.predict_labels_with_tier(input_dataframe)
 
         # Preparing the response
         response = {
-            'prediction': prediction,  # Mapped prediction result
+            'prediction': labels.tolist(),  # Mapped prediction result
+            'model_tier': model_tier,
             'input_data': data
         }
-        return jsonify(response)
+        return jsonify(response), 200, {MODEL_TIER_HEADER: model_tier}
+
+    except RequestShed as e:
+        return shed_response(e)
+
+    except InputValidationError as e:
+        return invalid_input_response(e)
+
+    except ModelVersionNotFound as e:
+        return jsonify({"error": str(e)}), 404
 
     except ThyroidException as e:
         return jsonify({"error": str(e)}), 500
@@ -56,5 +143,57 @@ def predict():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    try:
+        with stage_timer("parse_body"):
+            records = parse_batch_body(request.get_data(), request.mimetype)
+    except UnsupportedBatchFormat as e:
+        return jsonify({"error": str(e)}), 415
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        # Binary requests are answered in the same format unless Accept asks for another one;
+        # negotiated before admission so an unservable Accept costs no slot and no prediction
+        response_type = negotiate_batch_response(request.mimetype, request.headers.get('Accept'))
+    except UnsupportedBatchFormat as e:
+        return jsonify({"error": str(e)}), 406
+    try:
+        with stage_timer("validate_input"):
+            batch = ThyroidData.validate_batch(records)
+    except InputValidationError as e:
+        return invalid_input_response(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    if batch.errors and batch.invalid_count == len(batch.dataframe):
+        return jsonify({"error": "No valid rows in batch input", "errors": batch.errors}), 422
+
+    try:
+        # Only the valid rows are predicted, invalid rows are answered with their errors
+        with admit_request():
+            classifier = request_classifier()
+            # Bulk batches always get the primary model, the fallback is for interactive overload
+            labels, model_tier = classifier.predict_labels_with_tier(batch.valid_rows(), allow_fallback=False)
+        labels = batch.expand(labels)
+        headers = {MODEL_TIER_HEADER: model_tier, INVALID_ROWS_HEADER: str(batch.invalid_count)}
+        if response_type != NDJSON_MEDIA_TYPE:
+            with stage_timer("encode_response"):
+                body = encode_batch_predictions(labels, response_type, batch.errors)
+            return Response(body, mimetype=response_type, headers=headers)
+        return Response(stream_with_context(iter_ndjson_predictions(labels, errors=batch.errors)),
+                        mimetype=NDJSON_MEDIA_TYPE, headers=headers)
+
+    except RequestShed as e:
+        return shed_response(e)
+
+    except UnsupportedBatchFormat as e:
+        return jsonify({"error": str(e)}), 406
+
+    except ModelVersionNotFound as e:
+        return jsonify({"error": str(e)}), 404
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     app.run(debug=True)
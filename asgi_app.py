@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.templating import Jinja2Templates
+
+from thyroid_detection.pipline.prediction_pipeline import ThyroidClassifier, ThyroidData
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.serving.batch_io import (NDJSON_MEDIA_TYPE, UnsupportedBatchFormat, encode_batch_predictions,
+                                                iter_ndjson_predictions, negotiate_batch_response, parse_batch_body)
+from thyroid_detection.serving.metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY, render_metrics, stage_timer
+from thyroid_detection.serving.validation import InputValidationError
+from thyroid_detection.serving.warmup import ModelWarmup
+from thyroid_detection.serving.admission import AdmissionController, RequestShed, parse_deadline_ms
+from thyroid_detection.serving.model_tiers import register_queue_depth_source
+from thyroid_detection.serving.model_pool import ModelVersionNotFound
+from thyroid_detection.serving.profiler import (COLLAPSED_FORMAT, ProfilerBusy, ProfileRequest, is_authorized,
+                                                profiling_enabled, run_profile)
+from thyroid_detection.entity.config_entity import ThyroidPredictorConfig
+from thyroid_detection.constants import (APP_HOST, APP_PORT, APP_WORKERS, APP_HOST_ENV_KEY, APP_PORT_ENV_KEY,
+                                         APP_WORKERS_ENV_KEY, INFERENCE_POOL_SIZE_ENV_KEY, INVALID_ROWS_HEADER,
+                                         MODEL_TIER_HEADER, MODEL_VERSION_HEADER, MODEL_VERSION_QUERY_PARAM,
+                                         REQUEST_DEADLINE_HEADER)
+
+# Bounded pool running the CPU-bound model calls so the event loop never blocks on them
+inference_pool_size = int(os.getenv(INFERENCE_POOL_SIZE_ENV_KEY, os.cpu_count() or 1))
+inference_executor = ThreadPoolExecutor(max_workers=inference_pool_size, thread_name_prefix="inference")
+
+# Bounds the predictions queued on the pool, overflow is answered with 503 + Retry-After
+admission = AdmissionController(max_in_flight=inference_pool_size)
+# Predictions waiting for a pool thread route traffic to the fallback model when they pile up
+register_queue_depth_source(lambda: admission.queue_depth)
+
+model_warmup = ModelWarmup()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Started per worker process, after any pre-fork, so no thread is inherited across fork()
+    model_warmup.start()
+    yield
+    model_warmup.stop()
+
+
+app = FastAPI(title="Thyroid Detection", lifespan=lifespan)
+templates = Jinja2Templates(directory="templates")
+
+
+async def run_inference(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, func, *args)
+
+
+async def run_admitted(request: Request, func, *args):
+    # Admission is decided on the event loop without blocking, the deadline is checked again
+    # when a pool thread picks the request up
+    ticket = admission.reserve(parse_deadline_ms(request.headers.get(REQUEST_DEADLINE_HEADER)))
+    try:
+        return await run_inference(ticket.run, func, *args)
+    except BaseException:
+        # Cancelled before a pool thread took the slot (shutdown, timeout wrapper) or never
+        # submitted (executor shut down): its queue slot is given back here. A no-op when the
+        # job ran and already released it
+        ticket.cancel()
+        raise
+
+
+def shed_response(e: RequestShed) -> JSONResponse:
+    return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
+
+
+def invalid_input_response(e: InputValidationError) -> JSONResponse:
+    return JSONResponse({"error": str(e), "errors": e.errors}, status_code=422)
+
+
+def predictor_config(request: Request) -> ThyroidPredictorConfig:
+    # A model version pinned by header or query parameter is served from the model pool
+    model_version = request.headers.get(MODEL_VERSION_HEADER) or request.query_params.get(MODEL_VERSION_QUERY_PARAM)
+    return ThyroidPredictorConfig(model_version=model_version or None)
+
+
+def predict_record(data: dict, config: ThyroidPredictorConfig) -> dict:
+    with stage_timer("build_thyroid_data"):
+        thyroid_data = ThyroidData.from_dict(data)
+    with stage_timer("build_dataframe"):
+        input_dataframe = thyroid_data.get_thyroid_input_data_frame()
+    labels, model_tier = ThyroidClassifier(config).predict_labels_with_tier(input_dataframe)
+    return {'prediction': labels.tolist(), 'model_tier': model_tier, 'input_data': data}
+
+
+def tiered_response(result: dict) -> JSONResponse:
+    return JSONResponse(result, headers={MODEL_TIER_HEADER: result['model_tier']})
+
+
+def validate_batch(records):
+    with stage_timer("validate_input"):
+        return ThyroidData.validate_batch(records)
+
+
+def encode_response(labels, media_type: str, errors) -> bytes:
+    with stage_timer("encode_response"):
+        return encode_batch_predictions(labels, media_type, errors)
+
+
+@app.middleware('http')
+async def track_request_metrics(request: Request, call_next):
+    # Unknown paths share one label so that scans cannot blow up the number of series
+    path = request.url.path
+    endpoint = path if any(getattr(route, 'path', None) == path for route in app.routes) else 'unmatched'
+    with REGISTRY.track_request(endpoint):
+        return await call_next(request)
+
+
+@app.get('/healthz')
+async def healthz():
+    return JSONResponse({"status": "alive"})
+
+
+@app.get('/readyz')
+async def readyz():
+    return JSONResponse(model_warmup.status(), status_code=200 if model_warmup.is_ready else 503)
+
+
+@app.get('/metrics')
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.get('/drift')
+async def drift():
+    # Compares the inputs predicted by this worker with the training inputs of the current model
+    if not model_warmup.is_ready:
+        return JSONResponse({"error": "Model is not loaded yet"}, status_code=503)
+    try:
+        return JSONResponse(await run_inference(ThyroidClassifier().drift_report))
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get('/debug/profile')
+async def debug_profile(request: Request):
+    # Samples this worker process only; disabled unless DEBUG_PROFILE_TOKEN is set
+    if not profiling_enabled():
+        return JSONResponse({"error": "Not found"}, status_code=404)
+    if not is_authorized(request.headers.get('authorization')):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401, headers={"WWW-Authenticate": "Bearer"})
+    try:
+        profile_request = ProfileRequest.from_query(request.query_params)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        # Sampled from a thread of its own so that neither the event loop nor an inference thread is held
+        result = await asyncio.to_thread(run_profile, profile_request)
+    except ProfilerBusy as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    if profile_request.format == COLLAPSED_FORMAT:
+        return PlainTextResponse(result["collapsed"])
+    return JSONResponse(result)
+
+
+@app.get('/')
+async def home(request: Request):
+    return templates.TemplateResponse(request, 'index.html')
+
+
+@app.post('/predict')
+async def predict(request: Request):
+    try:
+        with stage_timer("parse_form"):
+            data = dict(await request.form())
+        return tiered_response(await run_admitted(request, predict_record, data, predictor_config(request)))
+
+    except RequestShed as e:
+        return shed_response(e)
+
+    except InputValidationError as e:
+        return invalid_input_response(e)
+
+    except ModelVersionNotFound as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+
+    except ThyroidException as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.post('/predict/json')
+async def predict_json(request: Request):
+    try:
+        with stage_timer("parse_json"):
+            data = await request.json()
+        return tiered_response(await run_admitted(request, predict_record, data, predictor_config(request)))
+
+    except RequestShed as e:
+        return shed_response(e)
+
+    except InputValidationError as e:
+        return invalid_input_response(e)
+
+    except ModelVersionNotFound as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+
+    except ThyroidException as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.post('/predict/batch')
+async def predict_batch(request: Request):
+    try:
+        media_type = request.headers.get('content-type', '').split(';')[0].strip()
+        body = await request.body()
+        with stage_timer("parse_body"):
+            records = parse_batch_body(body, media_type)
+    except UnsupportedBatchFormat as e:
+        return JSONResponse({"error": str(e)}, status_code=415)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        # Binary requests are answered in the same format unless Accept asks for another one;
+        # negotiated before admission so an unservable Accept costs no slot and no prediction
+        response_type = negotiate_batch_response(media_type, request.headers.get('accept'))
+    except UnsupportedBatchFormat as e:
+        return JSONResponse({"error": str(e)}, status_code=406)
+    try:
+        batch = await run_inference(validate_batch, records)
+    except InputValidationError as e:
+        return invalid_input_response(e)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if batch.errors and batch.invalid_count == len(batch.dataframe):
+        return JSONResponse({"error": "No valid rows in batch input", "errors": batch.errors}, status_code=422)
+
+    try:
+        # Only the valid rows are predicted, invalid rows are answered with their errors
+        classifier = ThyroidClassifier(predictor_config(request))
+        # Bulk batches always get the primary model (allow_fallback=False), the fallback is for interactive overload
+        labels, model_tier = await run_admitted(request, classifier.predict_labels_with_tier, batch.valid_rows(), False)
+        labels = batch.expand(labels)
+        headers = {MODEL_TIER_HEADER: model_tier, INVALID_ROWS_HEADER: str(batch.invalid_count)}
+        if response_type != NDJSON_MEDIA_TYPE:
+            body = await run_inference(encode_response, labels, response_type, batch.errors)
+            return Response(body, media_type=response_type, headers=headers)
+        return StreamingResponse(iter_ndjson_predictions(labels, errors=batch.errors), media_type=NDJSON_MEDIA_TYPE,
+                                 headers=headers)
+
+    except RequestShed as e:
+        return shed_response(e)
+
+    except UnsupportedBatchFormat as e:
+        return JSONResponse({"error": str(e)}, status_code=406)
+
+    except ModelVersionNotFound as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve thyroid predictions over ASGI with uvicorn")
+    parser.add_argument('--host', default=os.getenv(APP_HOST_ENV_KEY, APP_HOST))
+    parser.add_argument('--port', type=int, default=int(os.getenv(APP_PORT_ENV_KEY, APP_PORT)))
+    parser.add_argument('--workers', type=int, default=int(os.getenv(APP_WORKERS_ENV_KEY, APP_WORKERS)))
+    parser.add_argument('--inference-pool-size', type=int, default=inference_pool_size)
+    args = parser.parse_args()
+
+    # Worker processes import this module afresh, so the pool size is handed over through the environment
+    os.environ[INFERENCE_POOL_SIZE_ENV_KEY] = str(args.inference_pool_size)
+    uvicorn.run('asgi_app:app', host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+PredictionAuditLog against an in-memory stand-in for the prediction_audit collection.
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from thyroid_detection.serving.audit_log import DUPLICATE_KEY_ERROR_CODE, PredictionAuditLog
+
+
+class MemoryCollection:
+    """
+    insert_many(ordered=False) of pymongo: every new _id is inserted, duplicates are reported
+    together in one BulkWriteError
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.down = False
+        self.release = threading.Event()
+        self.release.set()
+        self._lock = threading.Lock()
+
+    def insert_many(self, documents, ordered=True):
+        self.release.wait()
+        if self.down:
+            raise AutoReconnect("connection refused")
+        write_errors = []
+        with self._lock:
+            for index, document in enumerate(documents):
+                if document["_id"] in self.documents:
+                    write_errors.append({"index": index, "code": DUPLICATE_KEY_ERROR_CODE})
+                else:
+                    self.documents[document["_id"]] = document
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors, "writeConcernErrors": [],
+                                  "nInserted": len(documents) - len(write_errors)})
+
+
+def frame(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({"age": np.arange(rows, dtype=np.float64), "sex": ["F"] * rows})
+
+
+def record(audit_log: PredictionAuditLog, rows: int) -> None:
+    audit_log.record(frame(rows), np.array(["negative"] * rows, dtype=object), "model.pkl", '"etag"', "primary", 0.01)
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def spilled_rows(spill_dir) -> int:
+    if not os.path.isdir(spill_dir):
+        return 0
+    return sum(sum(1 for _ in open(os.path.join(spill_dir, name))) for name in os.listdir(spill_dir))
+
+
+@pytest.fixture
+def collection():
+    return MemoryCollection()
+
+
+def make_audit_log(collection, spill_dir, **kwargs) -> PredictionAuditLog:
+    kwargs.setdefault("flush_rows", 1000)
+    kwargs.setdefault("flush_interval_seconds", 60.0)
+    return PredictionAuditLog(collection_factory=lambda: collection, spill_dir=str(spill_dir), **kwargs)
+
+
+def test_flush_on_size(collection, tmp_path):
+    audit_log = make_audit_log(collection, tmp_path, flush_rows=10)
+    record(audit_log, 4)
+    time.sleep(0.1)
+    assert not collection.documents
+    record(audit_log, 6)
+    assert wait_for(lambda: len(collection.documents) == 10)
+    audit_log.close()
+
+
+def test_flush_on_time(collection, tmp_path):
+    audit_log = make_audit_log(collection, tmp_path, flush_interval_seconds=0.1)
+    record(audit_log, 3)
+    assert wait_for(lambda: len(collection.documents) == 3, timeout=2.0)
+    document = next(iter(collection.documents.values()))
+    assert document["prediction"] == "negative" and document["batch_size"] == 3 and document["input"]["sex"] == "F"
+    audit_log.close()
+
+
+def test_backpressure_spills_rows(collection, tmp_path):
+    audit_log = make_audit_log(collection, tmp_path, flush_rows=5, max_buffered_rows=5, enqueue_timeout_ms=20)
+    collection.release.clear()
+    # Taken by the flush thread, which is stuck in insert_many, so the rows stay buffered
+    record(audit_log, 5)
+    assert wait_for(lambda: not audit_log._buffer)
+
+    start = time.monotonic()
+    record(audit_log, 3)
+    assert time.monotonic() - start < 1.0
+    assert spilled_rows(tmp_path) == 3
+
+    # Once MongoDB keeps up again the spilled rows are replayed after the next insert
+    collection.release.set()
+    audit_log.close()
+    assert len(collection.documents) == 8
+    assert os.listdir(tmp_path) == []
+    assert audit_log.buffered_rows == 0
+
+
+def test_spill_files_are_replayed_once(collection, tmp_path):
+    audit_log = make_audit_log(collection, tmp_path, retry_interval_seconds=0.0)
+    collection.down = True
+    record(audit_log, 4)
+    audit_log.flush()
+    assert spilled_rows(tmp_path) == 4 and not collection.documents
+
+    # Half of the spilled rows made it into MongoDB before the failure was reported
+    collection.down = False
+    spill_file = os.path.join(tmp_path, os.listdir(tmp_path)[0])
+    with open(spill_file) as lines:
+        spilled_ids = [json.loads(line)["_id"] for line in lines]
+    for document_id in spilled_ids[:2]:
+        collection.documents[document_id] = {"_id": document_id}
+
+    record(audit_log, 2)
+    audit_log.flush()
+    assert len(collection.documents) == 6
+    assert set(spilled_ids) <= set(collection.documents)
+    assert os.listdir(tmp_path) == []
+    audit_log.close()
+
+
+def test_close_drains_the_buffer(collection, tmp_path):
+    audit_log = make_audit_log(collection, tmp_path)
+    for _ in range(5):
+        record(audit_log, 7)
+    assert not collection.documents
+    audit_log.close()
+    assert len(collection.documents) == 35
+    assert not audit_log._thread.is_alive()
+    assert audit_log.buffered_rows == 0
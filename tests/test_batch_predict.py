@@ -0,0 +1,127 @@
+"""
+run_batch_prediction with a small model fitted here: worker errors reach the caller, and a run
+resumed after a crash writes the same output as an uninterrupted one.
+"""
+import os
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.tree import DecisionTreeClassifier
+
+from thyroid_detection.components.data_transformation import DataTransformation
+from thyroid_detection.entity.config_entity import BatchPredictionConfig
+from thyroid_detection.entity.estimator import thyroidModel
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.pipline.batch_predict import run_batch_prediction
+from thyroid_detection.utils.main_utils import save_object
+
+FLAGS = ["on_thyroxine", "query_on_thyroxine", "on_antithyroid_medication", "sick", "pregnant",
+         "I131_treatment", "tumor", "hypopituitary", "psych"]
+# Lab value of the row on which CrashingModel fails, valid for the input validation
+CRASH_TSH = 999.0
+ROWS = 400
+CRASH_ROW = 260
+
+pytestmark = pytest.mark.filterwarnings("ignore:Found unknown categories:UserWarning")
+
+
+class CrashingModel(thyroidModel):
+    """
+    Fails like a broken model would, inside a worker, on the chunk holding the CRASH_TSH row
+    """
+
+    def predict(self, dataframe):
+        try:
+            if (dataframe["TSH"] == CRASH_TSH).any():
+                raise RuntimeError("model crashed on a chunk")
+            return super().predict(dataframe)
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+
+def make_frame(n_rows: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        "age": rng.integers(1, 95, n_rows).astype(np.float64),
+        "TSH": rng.lognormal(0.5, 1.2, n_rows).round(2),
+        "T3": rng.normal(2.0, 0.6, n_rows).clip(0.1).round(2),
+        "TT4": rng.normal(108.0, 30.0, n_rows).clip(1).round(1),
+        "T4U": rng.normal(1.0, 0.2, n_rows).clip(0.1).round(2),
+        "FTI": rng.normal(110.0, 30.0, n_rows).clip(1).round(1),
+        "sex": rng.choice(["F", "M"], n_rows).astype(object),
+    })
+    for name in FLAGS:
+        frame[name] = rng.choice(["f", "t"], n_rows, p=[0.8, 0.2]).astype(object)
+    return frame
+
+
+@pytest.fixture(scope="module")
+def model_files(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("models")
+    train = make_frame(300, seed=0)
+    pipeline = DataTransformation.get_data_transformer_object().fit(train)
+    target = np.where(train["TSH"] > 6, 2, 0) + (train["sex"] == "M")
+    classifier = DecisionTreeClassifier(max_depth=4, random_state=0).fit(pipeline.transform(train), target)
+
+    model_file_path, crashing_file_path = str(directory / "model.pkl"), str(directory / "crashing_model.pkl")
+    save_object(model_file_path, thyroidModel(pipeline, classifier))
+    save_object(crashing_file_path, CrashingModel(pipeline, classifier))
+    return model_file_path, crashing_file_path
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    frame = make_frame(ROWS, seed=1)
+    frame.loc[CRASH_ROW, "TSH"] = CRASH_TSH
+    # A few rows failing the input validation
+    frame.loc[[3, 170, 333], "age"] = 150
+    path = str(tmp_path / "input.csv")
+    frame.to_csv(path, index=False)
+    return path
+
+
+def config(model_file_path: str) -> BatchPredictionConfig:
+    return BatchPredictionConfig(model_file_path=model_file_path, chunk_size=50, workers=2,
+                                 max_pending_chunks_per_worker=2)
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, "rb") as file_obj:
+        return file_obj.read()
+
+
+def test_thyroid_exception_is_picklable():
+    try:
+        try:
+            raise ValueError("bad chunk")
+        except ValueError as e:
+            raise ThyroidException(e, sys) from e
+    except ThyroidException as e:
+        error = e
+    restored = pickle.loads(pickle.dumps(error))
+    assert type(restored) is ThyroidException
+    assert str(restored) == str(error) and "bad chunk" in str(restored)
+
+
+def test_resume_after_a_crash_matches_a_full_run(model_files, input_file, tmp_path):
+    model_file_path, crashing_file_path = model_files
+    expected_path, output_path = str(tmp_path / "expected.csv"), str(tmp_path / "predictions.csv")
+    report = run_batch_prediction(input_file, expected_path, config(model_file_path))
+    assert report["rows"] == ROWS and report["invalid_rows"] == 3
+
+    # The error of the worker reaches the caller, not a BrokenProcessPool
+    with pytest.raises(ThyroidException, match="model crashed on a chunk"):
+        run_batch_prediction(input_file, output_path, config(crashing_file_path))
+    checkpoint_path = output_path + BatchPredictionConfig.checkpoint_suffix
+    assert os.path.exists(checkpoint_path)
+    crashed_output = read_bytes(output_path)
+    assert 0 < len(crashed_output) < len(read_bytes(expected_path))
+
+    report = run_batch_prediction(input_file, output_path, config(model_file_path), resume=True)
+    assert report["resumed_from_row"] == CRASH_ROW - CRASH_ROW % 50
+    assert report["rows"] == ROWS and report["invalid_rows"] == 3
+    assert read_bytes(output_path) == read_bytes(expected_path)
+    assert not os.path.exists(checkpoint_path)
@@ -0,0 +1,165 @@
+"""
+CollectionBatchPredictor against an in-memory stand-in for the MongoDB client.
+"""
+import collections
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from thyroid_detection.entity.config_entity import CollectionPredictionConfig
+from thyroid_detection.pipline.collection_predict import CollectionBatchPredictor
+
+FLAGS = ["on_thyroxine", "query_on_thyroxine", "on_antithyroid_medication", "sick", "pregnant",
+         "I131_treatment", "tumor", "hypopituitary", "psych"]
+ROWS = 230
+# Positions of the documents failing the input validation
+INVALID_ROWS = {7: {"age": "must be between 0 and 130"}, 120: {"sex": "must be one of F, M"}}
+
+
+class MemoryCursor:
+    def __init__(self, documents):
+        self.documents = documents
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    def close(self):
+        self.closed = True
+
+
+class MemoryCollection:
+    """
+    The find and bulk_write(ReplaceOne(upsert=True)) calls of pymongo used by the predictor
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.cursors = []
+        self._lock = threading.Lock()
+
+    def insert_many(self, documents):
+        for document in documents:
+            self.documents[document["_id"]] = dict(document)
+
+    def find(self, query=None, projection=None, sort=None, batch_size=None):
+        documents = [document for _, document in sorted(self.documents.items())
+                     if all(document.get(name) == value for name, value in (query or {}).items())]
+        if projection is not None:
+            documents = [{name: value for name, value in document.items() if name == "_id" or name in projection}
+                         for document in documents]
+        cursor = MemoryCursor(documents)
+        self.cursors.append(cursor)
+        return cursor
+
+    def bulk_write(self, operations, ordered=True, session=None):
+        upserted = modified = 0
+        with self._lock:
+            for operation in operations:
+                document_id = operation._filter["_id"]
+                replacement = dict(operation._doc, _id=document_id)
+                if document_id not in self.documents:
+                    upserted += 1
+                elif self.documents[document_id] != replacement:
+                    modified += 1
+                self.documents[document_id] = replacement
+        return SimpleNamespace(upserted_count=upserted, modified_count=modified)
+
+
+class ThresholdModel:
+    """
+    Predicts primary_hypothyroid (2) above a TSH threshold and negative (0) otherwise
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.predicted_rows = 0
+
+    def predict(self, dataframe):
+        self.predicted_rows += len(dataframe)
+        return np.where(dataframe["TSH"].to_numpy(dtype=np.float64) > self.threshold, 2, 0)
+
+
+def make_documents():
+    rng = np.random.default_rng(0)
+    documents = []
+    for position in range(ROWS):
+        document = {"_id": 1000 + position, "age": int(rng.integers(1, 95)), "sex": str(rng.choice(["F", "M"])),
+                    "TSH": round(float(rng.lognormal(0.5, 1.2)), 2), "T3": 2.1, "TT4": 110.0, "T4U": 1.0,
+                    "FTI": 105.0, "referral_source": "other"}
+        document.update({name: "f" for name in FLAGS})
+        documents.append(document)
+    # Missing values as stored by the data ingestion, and invalid documents
+    documents[3].update(T3="na", sex="na")
+    documents[7]["age"] = 455
+    documents[120]["sex"] = "X"
+    return documents
+
+
+@pytest.fixture
+def client():
+    client = collections.defaultdict(lambda: collections.defaultdict(MemoryCollection))
+    config = CollectionPredictionConfig()
+    client[config.database_name][config.collection_name].insert_many(make_documents())
+    return client
+
+
+def make_predictor(client, threshold: float, version: str) -> CollectionBatchPredictor:
+    predictor = CollectionBatchPredictor(CollectionPredictionConfig(batch_size=50, max_batches_in_flight=3),
+                                         client=client)
+    predictor.model, predictor.model_path, predictor.model_version = ThresholdModel(threshold), "model.pkl", version
+    return predictor
+
+
+def predictions(client) -> dict:
+    config = CollectionPredictionConfig()
+    return client[config.database_name][config.predictions_collection_name].documents
+
+
+def expected_label(document: dict, threshold: float) -> str:
+    return "primary_hypothyroid" if document["TSH"] > threshold else "negative"
+
+
+def test_predictions_are_upserted_by_id(client):
+    predictor = make_predictor(client, threshold=6.0, version='"v1"')
+    report = predictor.initiate_collection_prediction()
+    assert (report["rows"], report["invalid_rows"], report["upserted"], report["modified"]) == (ROWS, 2, ROWS, 0)
+    assert predictor.model.predicted_rows == ROWS - 2
+    assert predictor.collection.cursors[-1].closed
+
+    documents = make_documents()
+    scored = predictions(client)
+    assert sorted(scored) == [document["_id"] for document in documents]
+    for position, document in enumerate(documents):
+        prediction = scored[document["_id"]]
+        assert prediction["model_version"] == '"v1"' and prediction["model_path"] == "model.pkl"
+        if position in INVALID_ROWS:
+            assert prediction["prediction"] is None
+            assert prediction["errors"] == INVALID_ROWS[position]
+        else:
+            assert prediction["prediction"] == expected_label(document, 6.0)
+            assert prediction["errors"] is None
+
+
+def test_rerun_rescores_in_place(client):
+    make_predictor(client, threshold=6.0, version='"v1"').initiate_collection_prediction()
+    report = make_predictor(client, threshold=2.0, version='"v2"').initiate_collection_prediction()
+    # Every prediction document is replaced (scored_at changes), none is added
+    assert (report["rows"], report["upserted"], report["modified"]) == (ROWS, 0, ROWS)
+
+    scored = predictions(client)
+    assert len(scored) == ROWS
+    for position, document in enumerate(make_documents()):
+        prediction = scored[document["_id"]]
+        assert prediction["model_version"] == '"v2"'
+        if position not in INVALID_ROWS:
+            assert prediction["prediction"] == expected_label(document, 2.0)
+
+
+def test_query_scores_a_subset(client):
+    predictor = make_predictor(client, threshold=6.0, version='"v1"')
+    report = predictor.initiate_collection_prediction(query={"sex": "M"})
+    males = [document for document in make_documents() if document["sex"] == "M"]
+    assert report["rows"] == len(males) == len(predictions(client))
@@ -0,0 +1,126 @@
+"""
+The compiled encoder must reproduce the fitted sklearn preprocessing pipeline bit for bit,
+including on the serving-only inputs a training run never sees.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from thyroid_detection.components.data_transformation import DataTransformation
+from thyroid_detection.entity.compiled_encoder import CompiledFeatureEncoder
+from thyroid_detection.serving.batch_io import columnar_to_dataframe
+from thyroid_detection.serving.validation import InputValidator
+
+# Input columns of the pipeline built by DataTransformation.get_data_transformer_object
+NUMERICAL = ["age", "TSH", "T3", "TT4", "T4U", "FTI"]
+CATEGORICAL = ["sex", "on_thyroxine", "query_on_thyroxine", "on_antithyroid_medication", "sick",
+               "pregnant", "I131_treatment", "tumor", "hypopituitary", "psych"]
+SCHEMA_FILE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "schema.yaml")
+
+# Unseen categories are encoded as all zeros, as the tests expect
+pytestmark = pytest.mark.filterwarnings("ignore:Found unknown categories:UserWarning")
+
+
+def make_frame(n_rows: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        "age": rng.integers(1, 95, n_rows).astype(np.float64),
+        "TSH": rng.lognormal(0.5, 1.2, n_rows),
+        "T3": rng.normal(2.0, 0.6, n_rows),
+        "TT4": rng.normal(108.0, 30.0, n_rows),
+        "T4U": rng.normal(1.0, 0.2, n_rows),
+        "FTI": rng.normal(110.0, 30.0, n_rows),
+    })
+    for name in CATEGORICAL:
+        values = ["F", "M"] if name == "sex" else ["f", "t"]
+        frame[name] = rng.choice(values, n_rows, p=[0.7, 0.3]).astype(object)
+    # Missing lab values and categories, as in the ingested data
+    for name in NUMERICAL + ["sex"]:
+        frame.loc[rng.random(n_rows) < 0.1, name] = np.nan
+    return frame
+
+
+@pytest.fixture(scope="module")
+def pipeline():
+    return DataTransformation.get_data_transformer_object().fit(make_frame(500, seed=0))
+
+
+@pytest.fixture(scope="module")
+def encoder(pipeline):
+    return CompiledFeatureEncoder.from_pipeline(pipeline)
+
+
+def sklearn_transform(pipeline, frame: pd.DataFrame) -> np.ndarray:
+    expected = pipeline.transform(frame)
+    if hasattr(expected, "toarray"):
+        expected = expected.toarray()
+    return np.asarray(expected, dtype=np.float64)
+
+
+def assert_bit_identical(actual: np.ndarray, expected: np.ndarray) -> None:
+    assert actual.shape == expected.shape
+    assert np.array_equal(actual.view(np.uint64), expected.view(np.uint64))
+
+
+def serving_frame() -> pd.DataFrame:
+    frame = make_frame(40, seed=1)
+    # NaN lab values, a whole row of them, and None / unseen categories
+    frame.loc[0, NUMERICAL] = np.nan
+    frame.loc[1, "TSH"] = None
+    frame.loc[2, "sex"] = None
+    frame.loc[3, "on_thyroxine"] = "unknown"
+    frame.loc[4, "sex"] = "X"
+    frame.loc[5, CATEGORICAL] = np.nan
+    return frame
+
+
+def test_transform_matches_pipeline(pipeline, encoder):
+    frame = make_frame(300, seed=2)
+    assert_bit_identical(encoder.transform(frame), sklearn_transform(pipeline, frame))
+
+
+def test_serving_inputs_match_pipeline(pipeline, encoder):
+    frame = serving_frame()
+    expected = sklearn_transform(pipeline, frame)
+    assert_bit_identical(encoder.transform(frame), expected)
+    assert_bit_identical(encoder.transform_records(frame.to_dict(orient="records")), expected)
+
+
+def test_transform_record_matches_pipeline(pipeline, encoder):
+    frame = serving_frame()
+    expected = sklearn_transform(pipeline, frame)
+    for position, record in enumerate(frame.to_dict(orient="records")):
+        assert_bit_identical(encoder.transform_record(record), expected[position:position + 1])
+
+
+def test_transform_record_with_none_lab_values(pipeline, encoder):
+    record = make_frame(1, seed=3).to_dict(orient="records")[0]
+    record.update(TSH=None, FTI=None)
+    expected = sklearn_transform(pipeline, pd.DataFrame([record]))
+    assert_bit_identical(encoder.transform_record(record), expected)
+
+
+def test_blank_lab_values_match_pipeline(pipeline, encoder):
+    # Blank strings reach the encoder as NaN once the serving validator has typed the batch
+    records = make_frame(20, seed=4).astype(object).to_dict(orient="records")
+    records[0].update(TSH="", T3="  ")
+    records[1].update(age="", sex="")
+    batch = InputValidator.from_schema(SCHEMA_FILE_PATH).validate_batch(records, columns=NUMERICAL + CATEGORICAL)
+    assert batch.invalid_count == 0
+    expected = sklearn_transform(pipeline, batch.dataframe)
+    assert_bit_identical(encoder.transform(batch.dataframe), expected)
+    assert_bit_identical(encoder.transform_records(batch.dataframe.to_dict(orient="records")), expected)
+
+
+def test_columnar_dict_matches_pipeline(pipeline, encoder):
+    frame = serving_frame()
+    # A binary columnar body: float columns, fixed-width string columns with blanks as missing
+    columns = {name: frame[name].to_numpy(dtype=np.float64) for name in NUMERICAL}
+    columns.update({name: np.array(["" if value is None or value != value else value for value in frame[name]])
+                    for name in CATEGORICAL})
+    decoded = columnar_to_dataframe(columns)
+    expected = sklearn_transform(pipeline, decoded)
+    assert_bit_identical(encoder.transform(decoded), expected)
+    assert_bit_identical(encoder.transform_records(decoded.to_dict(orient="records")), expected)
@@ -0,0 +1,60 @@
+"""
+Query parsing of /debug/profile and a short profile of the test process.
+"""
+import threading
+import time
+
+import pytest
+
+from thyroid_detection.constants import DEBUG_PROFILE_INTERVAL_MS, DEBUG_PROFILE_MAX_INTERVAL_MS
+from thyroid_detection.serving import profiler
+from thyroid_detection.serving.profiler import COLLAPSED_FORMAT, ProfileRequest, run_profile
+
+
+def test_defaults():
+    profile_request = ProfileRequest.from_query({})
+    assert profile_request.interval_ms == DEBUG_PROFILE_INTERVAL_MS
+    assert not profile_request.memory
+
+
+# A NaN interval never reaches the deadline of _sample_stacks, which would sample forever
+# while holding the profile lock of the process
+@pytest.mark.parametrize("query", [
+    {"interval_ms": "nan"},
+    {"interval_ms": "inf"},
+    {"interval_ms": "-inf"},
+    {"interval_ms": "0.5"},
+    {"interval_ms": str(DEBUG_PROFILE_MAX_INTERVAL_MS + 1)},
+    {"seconds": "nan"},
+    {"seconds": "inf"},
+    {"seconds": "0"},
+    {"seconds": "1e9"},
+    {"top": "0"},
+    {"format": "svg"},
+])
+def test_rejects_out_of_range_parameters(query):
+    with pytest.raises(ValueError):
+        ProfileRequest.from_query(query)
+
+
+def test_profile_samples_other_threads():
+    stop = threading.Event()
+
+    def busy_worker():
+        while not stop.is_set():
+            sum(range(1000))
+
+    thread = threading.Thread(target=busy_worker, name="busy-worker")
+    thread.start()
+    try:
+        profile_request = ProfileRequest.from_query({"seconds": "0.2", "interval_ms": "5", "format": COLLAPSED_FORMAT})
+        start = time.monotonic()
+        result = run_profile(profile_request)
+    finally:
+        stop.set()
+        thread.join()
+    assert time.monotonic() - start < 5.0
+    assert result["samples"] > 1
+    assert "busy_worker" in result["collapsed"]
+    # The lock is released for the next profile
+    assert not profiler._profile_lock.locked()
@@ -0,0 +1,341 @@
+"""
+StreamPredictionWorker restarts against an in-memory stand-in for a MongoDB client: the writes of
+a transaction are applied together when it commits and dropped when it fails, and the change
+stream replays the insert events after a resume token.
+"""
+import collections
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from bson import ObjectId, Timestamp
+
+from thyroid_detection.entity.config_entity import StreamPredictionConfig
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.pipline.stream_predict import CHANGE_STREAM_MODE, POLL_MODE, StreamPredictionWorker
+
+FLAGS = ["on_thyroxine", "query_on_thyroxine", "on_antithyroid_medication", "sick", "pregnant",
+         "I131_treatment", "tumor", "hypopituitary", "psych"]
+CONFIG = StreamPredictionConfig()
+
+
+class MemorySession:
+    def __init__(self):
+        self.pending = []
+        self.transactions = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def with_transaction(self, callback):
+        self.pending = []
+        result = callback(self)
+        # Committed only once the whole callback succeeded
+        for write in self.pending:
+            write()
+        self.transactions += 1
+        return result
+
+
+class MemoryStream:
+    def __init__(self, events, position: int):
+        self.events = events
+        self.position = position
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def try_next(self):
+        if self.position < len(self.events):
+            self.position += 1
+            return self.events[self.position - 1]
+        time.sleep(0.001)
+        return None
+
+
+class MemoryCollection:
+    """
+    The find, find_one, bulk_write, update_one and watch calls of pymongo used by the worker
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.events = []
+        self.watch_calls = []
+        self.find_calls = 0
+        self.session_writes = 0
+        self.replaced = 0
+        # Raises in update_one while set, as a crash before the progress is saved
+        self.fail_updates = False
+
+    def insert_many(self, documents):
+        for document in documents:
+            self.documents[document["_id"]] = dict(document)
+            position = len(self.events)
+            self.events.append({"_id": {"_data": f"{position:08d}"}, "operationType": "insert",
+                                "fullDocument": dict(document), "clusterTime": Timestamp(int(time.time()), position)})
+
+    def find(self, query=None, projection=None, sort=None, limit=0):
+        self.find_calls += 1
+        documents = self._select(query)
+        return documents[:limit] if limit else documents
+
+    def find_one(self, query=None, projection=None, sort=None):
+        if query and "_id" in query and not isinstance(query["_id"], dict):
+            document = self.documents.get(query["_id"])
+            return None if document is None else dict(document)
+        documents = self._select(query)
+        if sort and sort[0][1] < 0:
+            documents.reverse()
+        return documents[0] if documents else None
+
+    def bulk_write(self, operations, ordered=True, session=None):
+        def write():
+            for operation in operations:
+                document_id = operation._filter["_id"]
+                self.replaced += document_id in self.documents
+                self.documents[document_id] = dict(operation._doc, _id=document_id)
+
+        self._apply(write, session)
+        return SimpleNamespace(upserted_count=len(operations), modified_count=0)
+
+    def update_one(self, query, update, upsert=False, session=None):
+        if self.fail_updates:
+            raise RuntimeError("connection lost")
+
+        def write():
+            self.documents.setdefault(query["_id"], {"_id": query["_id"]}).update(update["$set"])
+
+        self._apply(write, session)
+
+    def watch(self, pipeline, resume_after=None, max_await_time_ms=None, batch_size=None):
+        self.watch_calls.append(resume_after)
+        # Without a token the stream starts with the events from now on
+        position = len(self.events) if resume_after is None else int(resume_after["_data"]) + 1
+        return MemoryStream(self.events, position)
+
+    def _select(self, query):
+        # Only the {"_id": {"$gt": ...}} filter of the poll mode, in _id order
+        lower = (query or {}).get("_id", {}).get("$gt")
+        return [dict(document) for _id, document in sorted(self.documents.items()) if lower is None or _id > lower]
+
+    def _apply(self, write, session):
+        if session is None:
+            write()
+        else:
+            self.session_writes += 1
+            session.pending.append(write)
+
+
+class MemoryClient:
+    def __init__(self, replica_set: bool):
+        self.databases = collections.defaultdict(lambda: collections.defaultdict(MemoryCollection))
+        self.sessions = []
+        hello = {"setName": "rs0"} if replica_set else {"ismaster": True}
+        self.admin = SimpleNamespace(command=lambda name: hello)
+
+    def __getitem__(self, name):
+        return self.databases[name]
+
+    def start_session(self):
+        session = MemorySession()
+        self.sessions.append(session)
+        return session
+
+    def collection(self, name):
+        return self.databases[CONFIG.database_name][name]
+
+
+class ThresholdModel:
+    def predict(self, dataframe):
+        return np.where(dataframe["TSH"].to_numpy(dtype=np.float64) > 6.0, 2, 0)
+
+
+class RunningWorker:
+    """
+    A worker scoring in a background thread, as the stream_predict process would
+    """
+
+    def __init__(self, client: MemoryClient, mode: str):
+        config = StreamPredictionConfig(mode=mode, model_file_path="model.pkl", max_batch_size=8, max_wait_ms=20,
+                                        poll_interval_seconds=0.01)
+        self.worker = StreamPredictionWorker(config, client=client)
+        self.worker.batch_predictor.model = ThresholdModel()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            self.worker.run()
+        except Exception as e:
+            self.error = e
+
+    def stop(self):
+        self.worker.stop()
+        self.thread.join(timeout=5)
+        assert not self.thread.is_alive()
+
+
+def make_documents(count: int):
+    documents = []
+    for position in range(count):
+        document = {"_id": ObjectId(), "age": 30 + position, "sex": "F", "TSH": 1.0 + position, "T3": 2.0,
+                    "TT4": 100.0, "T4U": 1.0, "FTI": 100.0}
+        document.update({name: "f" for name in FLAGS})
+        documents.append(document)
+    return documents
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def state(client: MemoryClient) -> dict:
+    return client.collection(CONFIG.state_collection_name).documents.get(
+        f"{CONFIG.collection_name}:{CONFIG.predictions_collection_name}", {})
+
+
+@pytest.fixture
+def replica_set():
+    return MemoryClient(replica_set=True)
+
+
+@pytest.fixture
+def standalone():
+    return MemoryClient(replica_set=False)
+
+
+def test_resolve_mode(replica_set, standalone):
+    assert StreamPredictionWorker(client=replica_set).resolve_mode() == CHANGE_STREAM_MODE
+    assert StreamPredictionWorker(client=standalone).resolve_mode() == POLL_MODE
+
+
+def test_change_stream_resumes_after_the_last_scored_batch(replica_set):
+    inputs = replica_set.collection(CONFIG.collection_name)
+    predictions = replica_set.collection(CONFIG.predictions_collection_name)
+    states = replica_set.collection(CONFIG.state_collection_name)
+
+    running = RunningWorker(replica_set, CHANGE_STREAM_MODE)
+    assert wait_for(lambda: inputs.watch_calls == [None])
+    first = make_documents(20)
+    inputs.insert_many(first)
+    assert wait_for(lambda: len(predictions.documents) == 20)
+    running.stop()
+    token = state(replica_set)["resume_token"]
+    assert token == inputs.events[-1]["_id"]
+    # Predictions and resume token of every batch are written in its transaction
+    transactions = sum(session.transactions for session in replica_set.sessions)
+    assert transactions >= 3
+    assert predictions.session_writes == states.session_writes == transactions
+
+    # Inserted while the worker is down, scored by the next one from the saved token
+    second = make_documents(12)
+    inputs.insert_many(second)
+    running = RunningWorker(replica_set, CHANGE_STREAM_MODE)
+    assert wait_for(lambda: len(predictions.documents) == 32)
+    running.stop()
+    assert inputs.watch_calls[-1] == token
+    assert set(predictions.documents) == {document["_id"] for document in first + second}
+    assert predictions.replaced == 0
+    assert predictions.documents[first[10]["_id"]]["prediction"] == "primary_hypothyroid"
+    assert predictions.documents[first[0]["_id"]]["prediction"] == "negative"
+
+
+def test_change_stream_crash_before_commit_loses_nothing(replica_set):
+    inputs = replica_set.collection(CONFIG.collection_name)
+    predictions = replica_set.collection(CONFIG.predictions_collection_name)
+    states = replica_set.collection(CONFIG.state_collection_name)
+
+    running = RunningWorker(replica_set, CHANGE_STREAM_MODE)
+    assert wait_for(lambda: inputs.watch_calls == [None])
+    first = make_documents(8)
+    inputs.insert_many(first)
+    assert wait_for(lambda: len(predictions.documents) == 8)
+    token = state(replica_set)["resume_token"]
+
+    # The transaction of the next batch fails after its predictions were written in it
+    states.fail_updates = True
+    second = make_documents(8)
+    inputs.insert_many(second)
+    assert wait_for(lambda: running.error is not None)
+    running.stop()
+    assert isinstance(running.error, ThyroidException)
+    assert len(predictions.documents) == 8
+    assert state(replica_set)["resume_token"] == token
+
+    states.fail_updates = False
+    running = RunningWorker(replica_set, CHANGE_STREAM_MODE)
+    assert wait_for(lambda: len(predictions.documents) == 16)
+    running.stop()
+    assert inputs.watch_calls[-1] == token
+    assert state(replica_set)["resume_token"] == inputs.events[-1]["_id"]
+    assert predictions.replaced == 0
+
+
+def test_poll_resumes_from_the_last_id(standalone):
+    inputs = standalone.collection(CONFIG.collection_name)
+    predictions = standalone.collection(CONFIG.predictions_collection_name)
+    # Inserted before the first run: the worker starts with the documents inserted from then on
+    existing = make_documents(5)
+    inputs.insert_many(existing)
+
+    running = RunningWorker(standalone, POLL_MODE)
+    assert wait_for(lambda: state(standalone).get("last_id") == existing[-1]["_id"])
+    first = make_documents(20)
+    inputs.insert_many(first)
+    assert wait_for(lambda: len(predictions.documents) == 20)
+    running.stop()
+    assert state(standalone)["last_id"] == first[-1]["_id"]
+
+    second = make_documents(10)
+    inputs.insert_many(second)
+    running = RunningWorker(standalone, POLL_MODE)
+    assert wait_for(lambda: len(predictions.documents) == 30)
+    running.stop()
+    assert set(predictions.documents) == {document["_id"] for document in first + second}
+    assert predictions.replaced == 0
+    assert not standalone.sessions
+
+
+def test_poll_crash_before_saving_progress_rescores_in_place(standalone):
+    inputs = standalone.collection(CONFIG.collection_name)
+    predictions = standalone.collection(CONFIG.predictions_collection_name)
+    states = standalone.collection(CONFIG.state_collection_name)
+
+    running = RunningWorker(standalone, POLL_MODE)
+    # Polling the empty collection
+    assert wait_for(lambda: inputs.find_calls > 0)
+    first = make_documents(8)
+    inputs.insert_many(first)
+    assert wait_for(lambda: state(standalone).get("last_id") == first[-1]["_id"])
+
+    # The predictions of the next batch are upserted, saving its last _id fails
+    states.fail_updates = True
+    second = make_documents(8)
+    inputs.insert_many(second)
+    assert wait_for(lambda: running.error is not None)
+    running.stop()
+    assert len(predictions.documents) == 16
+    assert state(standalone)["last_id"] == first[-1]["_id"]
+
+    states.fail_updates = False
+    running = RunningWorker(standalone, POLL_MODE)
+    assert wait_for(lambda: state(standalone).get("last_id") == second[-1]["_id"])
+    running.stop()
+    # The batch is scored again under the same _ids, not duplicated
+    assert len(predictions.documents) == 16
+    assert predictions.replaced == 8
@@ -0,0 +1,127 @@
+"""
+InputValidator with the input_validation rules of config/schema.yaml.
+"""
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from thyroid_detection.serving.validation import InputValidationError, InputValidator
+
+SCHEMA_FILE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "schema.yaml")
+NUMERICAL = ["age", "TSH", "T3", "TT4", "T4U", "FTI"]
+FLAGS = ["on_thyroxine", "query_on_thyroxine", "on_antithyroid_medication", "sick", "pregnant",
+         "I131_treatment", "tumor", "hypopituitary", "psych"]
+
+
+@pytest.fixture(scope="module")
+def validator():
+    return InputValidator.from_schema(SCHEMA_FILE_PATH)
+
+
+def make_record(**fields) -> dict:
+    record = {"age": 41, "TSH": 1.3, "T3": 2.5, "TT4": 125.0, "T4U": 1.14, "FTI": 109.0, "sex": "F"}
+    record.update({name: "f" for name in FLAGS})
+    record.update(fields)
+    return record
+
+
+def test_validate_record_types_the_fields(validator):
+    values = validator.validate_record(make_record(age="41", TSH="1.3", T3="", sex=None))
+    assert values["age"] == 41 and isinstance(values["age"], int)
+    assert values["TSH"] == 1.3
+    assert math.isnan(values["T3"]) and math.isnan(values["sex"])
+
+
+def test_validate_record_reports_every_invalid_field(validator):
+    with pytest.raises(InputValidationError) as raised:
+        validator.validate_record(make_record(age=41.5, TSH="high", T3=-1, FTI=float("inf"), sex="X", sick=None))
+    assert raised.value.errors == {
+        "age": "must be an integer",
+        "TSH": "must be a number",
+        "T3": "must be between 0 and 20",
+        "FTI": "must be a finite number",
+        "sex": "must be one of F, M",
+        "sick": "is required",
+    }
+
+
+def test_validate_batch_mixed_rows(validator):
+    records = [
+        make_record(),
+        make_record(TSH="", T3="  ", sex=""),          # blank values of nullable fields are missing
+        make_record(TSH=float("nan")),                 # NaN is missing as well
+        make_record(TSH="abc"),
+        make_record(age=150, TT4=-3),
+        make_record(pregnant=""),                      # blank value of a required field
+        make_record(on_thyroxine="yes"),
+        make_record(T4U="1.2"),
+    ]
+    batch = validator.validate_batch(records)
+    assert batch.errors == {
+        3: {"TSH": "must be a number"},
+        4: {"age": "must be between 0 and 130", "TT4": "must be between 0 and 600"},
+        5: {"pregnant": "is required"},
+        6: {"on_thyroxine": "must be one of f, t"},
+    }
+    assert batch.invalid_count == 4
+    assert list(batch.dataframe.columns) == validator.columns
+
+    frame = batch.dataframe
+    assert frame["TSH"].dtype == np.float64 and frame["T4U"].dtype == np.float64
+    assert np.isnan(frame.loc[1, "TSH"]) and np.isnan(frame.loc[1, "T3"]) and np.isnan(frame.loc[2, "TSH"])
+    assert frame.loc[7, "T4U"] == 1.2
+    assert pd.isna(frame.loc[1, "sex"])
+    assert batch.valid_mask().tolist() == [True, True, True, False, False, False, False, True]
+    assert len(batch.valid_rows()) == 4
+
+
+def test_validate_batch_missing_column(validator):
+    records = [make_record()]
+    del records[0]["FTI"]
+    with pytest.raises(InputValidationError):
+        validator.validate_batch(records)
+
+
+def test_expand_aligns_labels_with_rows(validator):
+    records = [make_record(), make_record(TSH="abc"), make_record(), make_record(sex="X"), make_record()]
+    batch = validator.validate_batch(records)
+    assert batch.expand(np.array(["a", "b", "c"], dtype=object)).tolist() == ["a", None, "b", None, "c"]
+
+
+def test_all_valid_batch_is_passed_through(validator):
+    batch = validator.validate_batch([make_record(), make_record()])
+    labels = np.array(["negative", "negative"], dtype=object)
+    assert batch.valid_rows() is batch.dataframe
+    assert batch.expand(labels) is labels
+
+
+def test_numeric_columns_are_not_copied(validator):
+    # A binary columnar body: float64 lab values and fixed categories, already typed
+    rows = 4
+    frame = pd.DataFrame({name: np.full(rows, 1.0) for name in NUMERICAL})
+    frame["TSH"] = [1.0, np.nan, 2.0, 3.0]
+    frame["sex"] = ["F", "M", "F", "M"]
+    for name in FLAGS:
+        frame[name] = ["f"] * rows
+    batch = validator.validate_batch(frame)
+    assert batch.invalid_count == 0
+    assert batch.dataframe is frame
+    for name in NUMERICAL:
+        assert np.shares_memory(batch.dataframe[name].to_numpy(), frame[name].to_numpy())
+
+
+def test_converted_columns_do_not_touch_the_input(validator):
+    rows = 3
+    frame = pd.DataFrame({name: np.full(rows, 1.0) for name in NUMERICAL})
+    frame["TSH"] = ["1.5", "", "2"]
+    frame["sex"] = ["F", "", "M"]
+    for name in FLAGS:
+        frame[name] = ["t"] * rows
+    batch = validator.validate_batch(frame)
+    assert batch.invalid_count == 0
+    assert batch.dataframe is not frame
+    assert frame["TSH"].tolist() == ["1.5", "", "2"] and frame["sex"].tolist() == ["F", "", "M"]
+    assert np.shares_memory(batch.dataframe["FTI"].to_numpy(), frame["FTI"].to_numpy())
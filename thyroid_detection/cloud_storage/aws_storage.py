@@ -1,14 +1,17 @@
 import boto3
 from thyroid_detection.configuration.aws_connection import S3Client
 from io import StringIO
-from typing import Union,List
+from typing import TYPE_CHECKING, Optional, Union,List
 import os,sys
 from thyroid_detection.logger import logging
-from mypy_boto3_s3.service_resource import Bucket
 from thyroid_detection.exception import ThyroidException
+from thyroid_detection.entity.model_artifact import load_model_bytes
 from botocore.exceptions import ClientError
 from pandas import DataFrame,read_csv
-import pickle
+import shutil
+
+if TYPE_CHECKING:
+    from mypy_boto3_s3.service_resource import Bucket
 
 
 class SimpleStorageService:
@@ -58,7 +61,7 @@ class SimpleStorageService:
         except Exception as e:
             raise ThyroidException(e, sys) from e
 
-    def get_bucket(self, bucket_name: str) -> Bucket:
+    def get_bucket(self, bucket_name: str) -> "Bucket":
         """
         Method Name :   get_bucket
         Description :   This method gets the bucket object based on the bucket_name
@@ -128,13 +131,54 @@ class SimpleStorageService:
             model_file = func()
             file_object = self.get_file_object(model_file, bucket_name)
             model_obj = self.read_object(file_object, decode=False)
-            model = pickle.loads(model_obj)
+            model = load_model_bytes(model_obj)
             logging.info("Exited the load_model method of S3Operations class")
             return model
 
         except Exception as e:
             raise ThyroidException(e, sys) from e
 
+    def get_object_etag(self, key: str, bucket_name: str, version_id: Optional[str] = None) -> str:
+        """
+        Method Name :   get_object_etag
+        Description :   This method fetches the ETag of the key object in bucket_name bucket
+                        with a HEAD request, without downloading the object body. With version_id
+                        the given S3 object version is read instead of the latest one
+
+        Output      :   ETag of the object is returned
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        logging.info("Entered the get_object_etag method of S3Operations class")
+
+        try:
+            response = self.s3_client.head_object(Bucket=bucket_name, Key=key, **_version_kwargs(version_id))
+            logging.info("Exited the get_object_etag method of S3Operations class")
+            return response["ETag"]
+
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def download_object(self, key: str, bucket_name: str, file_obj, version_id: Optional[str] = None) -> str:
+        """
+        Method Name :   download_object
+        Description :   This method streams the body of the key object in bucket_name bucket
+                        into file_obj without buffering it in memory. With version_id the given
+                        S3 object version is downloaded instead of the latest one
+
+        Output      :   ETag of the downloaded object is returned
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        logging.info("Entered the download_object method of S3Operations class")
+
+        try:
+            response = self.s3_client.get_object(Bucket=bucket_name, Key=key, **_version_kwargs(version_id))
+            shutil.copyfileobj(response["Body"], file_obj, 1024 * 1024)
+            logging.info("Exited the download_object method of S3Operations class")
+            return response["ETag"]
+
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
     def create_folder(self, folder_name: str, bucket_name: str) -> None:
         """
         Method Name :   create_folder
@@ -261,4 +305,8 @@ class SimpleStorageService:
             logging.info("Exited the read_csv method of S3Operations class")
             return df
         except Exception as e:
-            raise ThyroidException(e, sys) from e
\ No newline at end of file
+            raise ThyroidException(e, sys) from e
+
+
+def _version_kwargs(version_id: Optional[str]) -> dict:
+    return {} if version_id is None else {"VersionId": version_id}
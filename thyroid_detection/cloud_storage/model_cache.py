@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from typing import BinaryIO, Callable, Optional
+
+from thyroid_detection.constants import (MODEL_CACHE_DIR, MODEL_CACHE_DIR_ENV_KEY, MODEL_CACHE_MAX_BYTES,
+                                         MODEL_CACHE_MAX_BYTES_ENV_KEY)
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+
+
+class LocalModelCache:
+    """
+    Class Name :   LocalModelCache
+    Description :   Content-addressed local disk cache of model objects pulled from S3.
+
+                    Blobs are stored once under the sha256 of their content in blobs/, and
+                    refs/ maps the sha256 of (bucket, key, ETag) to a blob, so a changed ETag
+                    is a cache miss while identical bytes are never stored twice. Files are
+                    written to a temporary name and renamed, so readers never see partial
+                    blobs, and least recently used blobs are evicted past max_bytes.
+
+    Output      :   Local path of the cached object
+    On Failure  :   Write an exception log and then raise an exception
+    """
+
+    def __init__(self, cache_dir: str = MODEL_CACHE_DIR, max_bytes: int = MODEL_CACHE_MAX_BYTES):
+        """
+        :param cache_dir: folder holding the cache, created on first write
+        :param max_bytes: total size of blobs kept before least recently used ones are evicted
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        self.ref_dir = os.path.join(cache_dir, "refs")
+
+    @classmethod
+    def from_env(cls) -> Optional["LocalModelCache"]:
+        """
+        Build the cache from the MODEL_CACHE_DIR and MODEL_CACHE_MAX_BYTES environment
+        variables, None when MODEL_CACHE_DIR is set to an empty string
+        """
+        cache_dir = os.getenv(MODEL_CACHE_DIR_ENV_KEY, MODEL_CACHE_DIR)
+        if not cache_dir:
+            return None
+        return cls(cache_dir=cache_dir, max_bytes=int(os.getenv(MODEL_CACHE_MAX_BYTES_ENV_KEY, MODEL_CACHE_MAX_BYTES)))
+
+    def get(self, bucket_name: str, key: str, etag: str) -> Optional[str]:
+        """
+        Return the local path of bucket_name/key at etag, None when it is not cached
+        """
+        try:
+            ref = self._read_ref(self._ref_path(bucket_name, key, etag))
+            if ref is None:
+                return None
+            blob_path = os.path.join(self.blob_dir, ref["sha256"])
+            try:
+                if os.path.getsize(blob_path) != ref["size"]:
+                    logging.info(f"Cached blob {blob_path} has the wrong size, ignoring it")
+                    return None
+                # The modification time orders blobs for eviction
+                os.utime(blob_path)
+            except FileNotFoundError:
+                return None
+            return blob_path
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def put(self, bucket_name: str, key: str, download: Callable[[BinaryIO], str]) -> str:
+        """
+        Download an object into the cache
+        :param download: writes the object body to the given file and returns its ETag
+        :return: local path of the cached object
+        """
+        try:
+            os.makedirs(self.blob_dir, exist_ok=True)
+            os.makedirs(self.ref_dir, exist_ok=True)
+
+            with _HashingWriter(tempfile.NamedTemporaryFile(dir=self.blob_dir, suffix=".tmp", delete=False)) as writer:
+                etag = download(writer)
+            sha256, size = writer.hexdigest(), writer.size
+            blob_path = os.path.join(self.blob_dir, sha256)
+            os.replace(writer.name, blob_path)
+
+            _write_atomic(self._ref_path(bucket_name, key, etag), json.dumps({
+                "bucket_name": bucket_name, "key": key, "etag": etag, "sha256": sha256, "size": size,
+            }).encode())
+            logging.info(f"Cached {bucket_name}/{key} (ETag {etag}, {size} bytes) as {blob_path}")
+
+            self.evict(keep=blob_path)
+            return blob_path
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def get_or_download(self, bucket_name: str, key: str, etag: str, download: Callable[[BinaryIO], str]) -> str:
+        path = self.get(bucket_name, key, etag)
+        if path is not None:
+            logging.info(f"Model cache hit for {bucket_name}/{key} (ETag {etag})")
+            return path
+        logging.info(f"Model cache miss for {bucket_name}/{key} (ETag {etag}), downloading")
+        return self.put(bucket_name, key, download)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Remove least recently used blobs until the cache fits in max_bytes; refs to
+        removed blobs are ignored on lookup
+        """
+        blobs = []
+        for entry in os.scandir(self.blob_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                blobs.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in blobs)
+        for _, size, path in sorted(blobs):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                logging.info(f"Evicted {path} from the model cache")
+            except FileNotFoundError:
+                pass
+
+    def _ref_path(self, bucket_name: str, key: str, etag: str) -> str:
+        digest = hashlib.sha256("\0".join([bucket_name, key, etag]).encode()).hexdigest()
+        return os.path.join(self.ref_dir, digest + ".json")
+
+    @staticmethod
+    def _read_ref(ref_path: str) -> Optional[dict]:
+        try:
+            with open(ref_path, "rb") as ref_file:
+                return json.load(ref_file)
+        except FileNotFoundError:
+            return None
+
+
+class _HashingWriter:
+    """
+    File wrapper computing the sha256 and size of everything written through it
+    """
+
+    def __init__(self, file_obj):
+        self._file = file_obj
+        self._sha256 = hashlib.sha256()
+        self.name = file_obj.name
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self._sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        return self._sha256.hexdigest()
+
+    def __enter__(self) -> "_HashingWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+            if exc_type is not None:
+                os.remove(self.name)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as tmp_file:
+        tmp_file.write(data)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    os.replace(tmp_file.name, path)
@@ -12,10 +12,18 @@ from sklearn.compose import ColumnTransformer
 from imblearn.over_sampling import RandomOverSampler
 from sklearn.impute import SimpleImputer
 from thyroid_detection.utils import main_utils
+from thyroid_detection.entity.compiled_encoder import CompiledFeatureEncoder
+from thyroid_detection.serving.drift import build_feature_reference
 from thyroid_detection.constants import TARGET_COLUMN
 
 
 class DataTransformation:
+    CATEGORICAL_FEATURES = [
+        "sex", "on_thyroxine", "query_on_thyroxine", "on_antithyroid_medication", "sick",
+        "pregnant", "I131_treatment", "tumor", "hypopituitary", "psych"
+    ]
+    NUMERICAL_FEATURES = ["age", "TSH", "T3", "TT4", "T4U", "FTI"]
+
     def __init__(self, data_transformation_config: config_entity.DataTransformationConfig,
                  data_ingestion_artifact: artifact_entity.DataIngestionArtifact):
         try:
@@ -28,12 +36,6 @@ class DataTransformation:
     @classmethod
     def get_data_transformer_object(cls) -> Pipeline:
         try:
-            Categorical_Features = [
-                "sex", "on_thyroxine", "query_on_thyroxine", "on_antithyroid_medication", "sick",
-                "pregnant", "I131_treatment", "tumor", "hypopituitary", "psych"
-            ]
-            Numerical_Features = ["age", "TSH", "T3", "TT4", "T4U", "FTI"]
-            
             categorical_transformer = Pipeline(
                 steps=[
                     ("imputer", SimpleImputer(strategy="most_frequent")),
@@ -49,8 +51,8 @@ class DataTransformation:
             
             preprocessor = ColumnTransformer(
                 [
-                    ("num", numeric_transformer, Numerical_Features),
-                    ("cat", categorical_transformer, Categorical_Features)
+                    ("num", numeric_transformer, cls.NUMERICAL_FEATURES),
+                    ("cat", categorical_transformer, cls.CATEGORICAL_FEATURES)
                 ]
             )
             
@@ -83,6 +85,19 @@ class DataTransformation:
             transformation_pipeline = DataTransformation.get_data_transformer_object()
             transformation_pipeline.fit(input_feature_train_df)
 
+            # The serving path uses the compiled NumPy encoder, check it reproduces the pipeline exactly
+            compiled_encoder = CompiledFeatureEncoder.from_pipeline(transformation_pipeline)
+            compiled_encoder.verify(transformation_pipeline, input_feature_train_df)
+            compiled_encoder.verify(transformation_pipeline, input_feature_test_df)
+
+            # Distribution of the inputs the pipeline was fitted on, compared with live inputs by the server
+            feature_reference = build_feature_reference(
+                input_feature_train_df, DataTransformation.NUMERICAL_FEATURES, DataTransformation.CATEGORICAL_FEATURES
+            )
+            main_utils.write_yaml_file(
+                file_path=self.data_transformation_config.feature_reference_file_path, content=feature_reference
+            )
+
             # Transforming input features
             input_feature_train_arr = transformation_pipeline.transform(input_feature_train_df)
             input_feature_test_arr = transformation_pipeline.transform(input_feature_test_df)
@@ -132,7 +147,8 @@ class DataTransformation:
             data_transformation_artifact = artifact_entity.DataTransformationArtifact(
                 transformed_object_file_path=self.data_transformation_config.transformed_object_file_path,
                 transformed_train_file_path=self.data_transformation_config.transformed_train_file_path,
-                transformed_test_file_path=self.data_transformation_config.transformed_test_file_path
+                transformed_test_file_path=self.data_transformation_config.transformed_test_file_path,
+                feature_reference_file_path=self.data_transformation_config.feature_reference_file_path
             )
 
             logging.info(f"Data transformation artifact: {data_transformation_artifact}")
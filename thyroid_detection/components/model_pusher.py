@@ -36,6 +36,11 @@ class ModelPusher:
 
             self.usvisa_estimator.save_model(from_file=self.model_evaluation_artifact.trained_model_path)
 
+            if self.model_evaluation_artifact.fallback_model_path is not None:
+                logging.info("Uploading fallback model to s3 bucket")
+                fallback_estimator = thyroidEstimator(bucket_name=self.model_pusher_config.bucket_name,
+                                                      model_path=self.model_pusher_config.s3_fallback_model_key_path)
+                fallback_estimator.save_model(from_file=self.model_evaluation_artifact.fallback_model_path)
 
             model_pusher_artifact = ModelPusherArtifact(bucket_name=self.model_pusher_config.bucket_name,
                                                         s3_model_path=self.model_pusher_config.s3_model_key_path)
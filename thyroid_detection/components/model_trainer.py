@@ -1,5 +1,6 @@
+import importlib
 import sys
-from typing import Tuple
+from typing import Optional, Tuple
 
 import numpy as np
 import pandas as pd
@@ -12,18 +13,25 @@ from thyroid_detection.exception import ThyroidException
 from thyroid_detection.logger import logging
 from thyroid_detection.utils.main_utils import load_numpy_array_data, read_yaml_file, load_object, save_object
 from thyroid_detection.entity.config_entity import ModelTrainerConfig
-from thyroid_detection.entity.artifact_entity import DataTransformationArtifact, ModelTrainerArtifact, ClassificationMetricArtifact
+from thyroid_detection.entity.artifact_entity import (DataIngestionArtifact, DataTransformationArtifact, ModelTrainerArtifact,
+                                                      ClassificationMetricArtifact)
 from thyroid_detection.entity.estimator import thyroidModel
+from thyroid_detection.entity.compiled_model import compile_estimator
+from thyroid_detection.entity.model_artifact import save_model_artifact
+from thyroid_detection.entity.model_bundle import export_model_bundle, verify_model_bundle
+from thyroid_detection.constants import MODEL_TRAINER_FALLBACK_MODEL_KEY, TARGET_COLUMN
 
 class ModelTrainer:
     def __init__(self, data_transformation_artifact: DataTransformationArtifact,
-                 model_trainer_config: ModelTrainerConfig):
+                 model_trainer_config: ModelTrainerConfig,
+                 data_ingestion_artifact: Optional[DataIngestionArtifact] = None):
         """
         :param data_ingestion_artifact: Output reference of data ingestion artifact stage
         :param data_transformation_config: Configuration for data transformation
         """
         self.data_transformation_artifact = data_transformation_artifact
         self.model_trainer_config = model_trainer_config
+        self.data_ingestion_artifact = data_ingestion_artifact
 
     def get_model_object_and_report(self, train: np.array, test: np.array) -> Tuple[object, object]:
         """
@@ -58,6 +66,90 @@ class ModelTrainer:
             raise ThyroidException(e, sys) from e
         
 
+    def compile_model(self, model_obj: object, x_test: np.array) -> object:
+        """
+        Method Name :   compile_model
+        Description :   This function compiles the best model into flat NumPy arrays and checks
+                        that the compiled model predicts exactly like the original on the test split
+
+        Output      :   Returns the compiled model, or None if it is unavailable or not identical
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            compiled_model = compile_estimator(model_obj)
+            if compiled_model is None:
+                return None
+
+            if not np.array_equal(compiled_model.predict(x_test), model_obj.predict(x_test)):
+                logging.info("Compiled model predictions differ from the trained model, not using it")
+                return None
+
+            logging.info(f"Compiled {type(model_obj).__name__} verified on {len(x_test)} test rows")
+            return compiled_model
+
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def get_fallback_model(self, train: np.array, test: np.array) -> Optional[object]:
+        """
+        Method Name :   get_fallback_model
+        Description :   This function trains the cheap fallback model described under the fallback_model
+                        section of model.yaml, served instead of the best model when the server is overloaded
+
+        Output      :   Returns the fitted fallback model, or None if model.yaml has no fallback_model section
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            model_config = read_yaml_file(file_path=self.model_trainer_config.model_config_file_path)
+            fallback_config = model_config.get(MODEL_TRAINER_FALLBACK_MODEL_KEY)
+            if not fallback_config:
+                logging.info("No fallback model configured")
+                return None
+
+            x_train, y_train, x_test, y_test = train[:, :-1], train[:, -1], test[:, :-1], test[:, -1]
+
+            model_class = getattr(importlib.import_module(fallback_config["module"]), fallback_config["class"])
+            model_obj = model_class(**(fallback_config.get("params") or {}))
+            model_obj.fit(x_train, y_train)
+
+            y_pred = model_obj.predict(x_test)
+            accuracy = accuracy_score(y_test, y_pred)
+            f1 = f1_score(y_test, y_pred, average='weighted')
+            logging.info(f"Trained fallback model {model_obj}: accuracy {accuracy:.4f}, f1 {f1:.4f}")
+            return model_obj
+
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def save_model(self, file_path: str, thyroid_model: thyroidModel) -> None:
+        if thyroid_model.compiled_model is not None and thyroid_model.get_compiled_encoder() is not None:
+            save_model_artifact(file_path, thyroid_model)
+        else:
+            save_object(file_path, thyroid_model)
+
+    def export_bundle(self, thyroid_model: thyroidModel) -> Optional[str]:
+        """
+        Method Name :   export_bundle
+        Description :   This function exports the trained model as a standalone NumPy-only bundle and
+                        checks it against the sklearn pipeline and estimator on the ingested test split
+
+        Output      :   Returns the bundle directory, or None if the model has no compiled predictor
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            if thyroid_model.compiled_model is None or thyroid_model.get_compiled_encoder() is None:
+                logging.info("Model has no compiled encoder and predictor, not exporting a bundle")
+                return None
+
+            bundle_dir = export_model_bundle(self.model_trainer_config.model_bundle_dir, thyroid_model)
+            if self.data_ingestion_artifact is not None:
+                test_df = pd.read_csv(self.data_ingestion_artifact.test_file_path)
+                verify_model_bundle(bundle_dir, thyroid_model, test_df.drop(TARGET_COLUMN, axis=1))
+            return bundle_dir
+
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
     def initiate_model_trainer(self, ) -> ModelTrainerArtifact:
         logging.info("Entered initiate_model_trainer method of ModelTrainer class")
         """
@@ -74,6 +166,9 @@ class ModelTrainer:
             best_model_detail ,metric_artifact = self.get_model_object_and_report(train=train_arr, test=test_arr)
             
             preprocessing_obj = load_object(file_path=self.data_transformation_artifact.transformed_object_file_path)
+            feature_reference = None
+            if self.data_transformation_artifact.feature_reference_file_path:
+                feature_reference = read_yaml_file(file_path=self.data_transformation_artifact.feature_reference_file_path)
 
 
             if best_model_detail.best_score < self.model_trainer_config.expected_accuracy:
@@ -82,13 +177,28 @@ class ModelTrainer:
 
             thyroid_model = thyroidModel(preprocessing_object=preprocessing_obj,
                                        trained_model_object=best_model_detail.best_model)
+            thyroid_model.compiled_model = self.compile_model(best_model_detail.best_model, x_test=test_arr[:, :-1])
+            thyroid_model.feature_reference = feature_reference
             logging.info("Created usvisa model object with preprocessor and model")
             logging.info("Created best model file path.")
-            save_object(self.model_trainer_config.trained_model_file_path, thyroid_model)
+            self.save_model(self.model_trainer_config.trained_model_file_path, thyroid_model)
+            model_bundle_dir_path = self.export_bundle(thyroid_model)
+
+            fallback_model_file_path = None
+            fallback_model_obj = self.get_fallback_model(train=train_arr, test=test_arr)
+            if fallback_model_obj is not None:
+                fallback_model = thyroidModel(preprocessing_object=preprocessing_obj,
+                                              trained_model_object=fallback_model_obj)
+                fallback_model.compiled_model = self.compile_model(fallback_model_obj, x_test=test_arr[:, :-1])
+                fallback_model.feature_reference = feature_reference
+                fallback_model_file_path = self.model_trainer_config.fallback_model_file_path
+                self.save_model(fallback_model_file_path, fallback_model)
 
             model_trainer_artifact = ModelTrainerArtifact(
                 trained_model_file_path=self.model_trainer_config.trained_model_file_path,
                 metric_artifact=metric_artifact,
+                fallback_model_file_path=fallback_model_file_path,
+                model_bundle_dir_path=model_bundle_dir_path,
             )
             logging.info(f"Model trainer artifact: {model_trainer_artifact}")
             return model_trainer_artifact
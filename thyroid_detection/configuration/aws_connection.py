@@ -1,6 +1,7 @@
 import boto3
 import os
-from thyroid_detection.constants import AWS_SECRET_ACCESS_KEY_ENV_KEY, AWS_ACCESS_KEY_ID_ENV_KEY,REGION_NAME
+from thyroid_detection.constants import (AWS_SECRET_ACCESS_KEY_ENV_KEY, AWS_ACCESS_KEY_ID_ENV_KEY, AWS_ENDPOINT_URL_ENV_KEY,
+                                         REGION_NAME)
 
 
 class S3Client:
@@ -10,7 +11,8 @@ class S3Client:
     def __init__(self, region_name=REGION_NAME):
         """ 
         This Class gets aws credentials from env_variable and creates an connection with s3 bucket 
-        and raise exception when environment variable is not set
+        and raise exception when environment variable is not set.
+        AWS_ENDPOINT_URL points the connection at an S3 compatible server, e.g. a local stand-in
         """
 
         if S3Client.s3_resource==None or S3Client.s3_client==None:
@@ -20,17 +22,32 @@ class S3Client:
                 raise Exception(f"Environment variable: {AWS_ACCESS_KEY_ID_ENV_KEY} is not not set.")
             if __secret_access_key is None:
                 raise Exception(f"Environment variable: {AWS_SECRET_ACCESS_KEY_ENV_KEY} is not set.")
+            __endpoint_url = os.getenv(AWS_ENDPOINT_URL_ENV_KEY) or None
         
             S3Client.s3_resource = boto3.resource('s3',
                                             aws_access_key_id=__access_key_id,
                                             aws_secret_access_key=__secret_access_key,
-                                            region_name=region_name
+                                            region_name=region_name,
+                                            endpoint_url=__endpoint_url
                                             )
             S3Client.s3_client = boto3.client('s3',
                                         aws_access_key_id=__access_key_id,
                                         aws_secret_access_key=__secret_access_key,
-                                        region_name=region_name
+                                        region_name=region_name,
+                                        endpoint_url=__endpoint_url
                                         )
         self.s3_resource = S3Client.s3_resource
         self.s3_client = S3Client.s3_client
+
+    @classmethod
+    def reset(cls) -> None:
+        """
+        Drop the shared clients so the next S3Client creates fresh connections,
+        used in forked children which must not reuse the parent's sockets
+        """
+        cls.s3_client = None
+        cls.s3_resource = None
+
+
+os.register_at_fork(after_in_child=S3Client.reset)
         
\ No newline at end of file
@@ -11,6 +11,7 @@ PIPELINE_NAME: str = "thyroid"
 ARTIFACT_DIR: str = "artifact"
 
 MODEL_FILE_NAME = "model.pkl"
+FALLBACK_MODEL_FILE_NAME = "fallback_model.pkl"
 
 TARGET_COLUMN = "Class"
 CURRENT_YEAR = date.today().year
@@ -46,6 +47,8 @@ Data Transformation ralated constant start with DATA_TRANSFORMATION VAR NAME
 DATA_TRANSFORMATION_DIR_NAME: str = "data_transformation"
 DATA_TRANSFORMATION_TRANSFORMED_DATA_DIR: str = "transformed"
 DATA_TRANSFORMATION_TRANSFORMED_OBJECT_DIR: str = "transformed_object"
+DATA_TRANSFORMATION_FEATURE_REFERENCE_DIR: str = "feature_reference"
+DATA_TRANSFORMATION_FEATURE_REFERENCE_FILE_NAME: str = "feature_reference.yaml"
 
 
 
@@ -57,16 +60,109 @@ MODEL_TRAINER_TRAINED_MODEL_DIR: str = "trained_model"
 MODEL_TRAINER_TRAINED_MODEL_NAME: str = "model.pkl"
 MODEL_TRAINER_EXPECTED_SCORE: float = 0.6
 MODEL_TRAINER_MODEL_CONFIG_FILE_PATH: str = os.path.join("config", "model.yaml")
+MODEL_TRAINER_FALLBACK_MODEL_KEY: str = "fallback_model"
+MODEL_TRAINER_BUNDLE_DIR: str = "bundle"
 
 
 AWS_ACCESS_KEY_ID_ENV_KEY = "AWS_ACCESS_KEY_ID"
 AWS_SECRET_ACCESS_KEY_ENV_KEY = "AWS_SECRET_ACCESS_KEY"
+AWS_ENDPOINT_URL_ENV_KEY = "AWS_ENDPOINT_URL"
 REGION_NAME = "us-east-1"
 
 MODEL_EVALUATION_CHANGED_THRESHOLD_SCORE: float = 0.02
 MODEL_BUCKET_NAME = "thyroid-model2024"
 MODEL_PUSHER_S3_KEY = "model-registry"
-
+MODEL_RELOAD_INTERVAL_SECONDS: float = 60.0
+
+MODEL_CACHE_DIR: str = "model_cache"
+MODEL_CACHE_MAX_BYTES: int = 2 * 1024 ** 3
+MODEL_CACHE_DIR_ENV_KEY = "MODEL_CACHE_DIR"
+MODEL_CACHE_MAX_BYTES_ENV_KEY = "MODEL_CACHE_MAX_BYTES"
+
+PREDICTION_COALESCE_ENABLED: bool = True
+PREDICTION_COALESCE_MAX_BATCH_SIZE: int = 64
+PREDICTION_COALESCE_MAX_WAIT_MS: float = 2.0
+
+PREDICTION_CACHE_ENABLED: bool = False
+PREDICTION_CACHE_MAX_SIZE: int = 10000
+PREDICTION_CACHE_TTL_SECONDS: float = 300.0
+PREDICTION_CACHE_ROUNDING = {"age": 0, "TSH": 3, "T3": 2, "TT4": 1, "T4U": 3, "FTI": 1}
+
+WARMUP_ROUNDS: int = 3
+WARMUP_BATCH_SIZE: int = 32
+WARMUP_RETRY_INTERVAL_SECONDS: float = 5.0
+
+ADMISSION_MAX_IN_FLIGHT: int = 8
+ADMISSION_MAX_QUEUE_DEPTH: int = 64
+ADMISSION_DEFAULT_DEADLINE_MS: float = 2000.0
+REQUEST_DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+FALLBACK_MODEL_ENABLED: bool = True
+FALLBACK_QUEUE_DEPTH_THRESHOLD: int = 16
+FALLBACK_P95_MS_THRESHOLD: float = 250.0
+FALLBACK_LATENCY_WINDOW: int = 256
+FALLBACK_MIN_HOLD_SECONDS: float = 5.0
+FALLBACK_RETRY_INTERVAL_SECONDS: float = 60.0
+MODEL_TIER_HEADER = "X-Model-Tier"
+
+MODEL_POOL_MAX_BYTES: int = 1024 * 1024 * 1024
+MODEL_POOL_MAX_BYTES_ENV_KEY = "MODEL_POOL_MAX_BYTES"
+# Unknown versions are remembered this long, so repeated bogus pins cost no S3 round trip
+MODEL_POOL_MISSING_VERSION_TTL_SECONDS: float = 60.0
+MODEL_POOL_MISSING_VERSION_MAX_ENTRIES: int = 1024
+MODEL_VERSION_HEADER = "X-Model-Version"
+MODEL_VERSION_QUERY_PARAM = "model_version"
+
+PREDICTION_AUDIT_ENABLED_ENV_KEY = "PREDICTION_AUDIT_ENABLED"
+PREDICTION_AUDIT_COLLECTION_NAME: str = "prediction_audit"
+PREDICTION_AUDIT_MAX_BUFFERED_ROWS: int = 50000
+PREDICTION_AUDIT_FLUSH_ROWS: int = 1000
+PREDICTION_AUDIT_FLUSH_INTERVAL_SECONDS: float = 1.0
+PREDICTION_AUDIT_ENQUEUE_TIMEOUT_MS: float = 50.0
+PREDICTION_AUDIT_RETRY_INTERVAL_SECONDS: float = 30.0
+# Relative to the working directory; the spill files hold patient inputs, so production should
+# point PREDICTION_AUDIT_SPILL_DIR at a persistent, access-restricted volume outside the code checkout
+PREDICTION_AUDIT_SPILL_DIR: str = "audit_spill"
+PREDICTION_AUDIT_SPILL_DIR_ENV_KEY = "PREDICTION_AUDIT_SPILL_DIR"
+
+DRIFT_MONITORING_ENABLED: bool = True
+DRIFT_PSI_THRESHOLD: float = 0.2
+DRIFT_MIN_ROWS: int = 100
+DRIFT_SKETCH_RELATIVE_ACCURACY: float = 0.01
+
+DEBUG_PROFILE_TOKEN_ENV_KEY = "DEBUG_PROFILE_TOKEN"
+DEBUG_PROFILE_DEFAULT_SECONDS: float = 10.0
+DEBUG_PROFILE_MAX_SECONDS: float = 120.0
+DEBUG_PROFILE_INTERVAL_MS: float = 10.0
+DEBUG_PROFILE_MAX_INTERVAL_MS: float = 1000.0
+DEBUG_PROFILE_TOP_ALLOCATIONS: int = 25
+
+
+BATCH_PREDICTION_STREAM_CHUNK_SIZE: int = 1000
+INVALID_ROWS_HEADER = "X-Invalid-Rows"
+
+BATCH_PREDICTION_CHUNK_SIZE: int = 50000
+# Chunks parsed, predicted or waiting to be written per worker process, bounds the memory of a run
+BATCH_PREDICTION_MAX_PENDING_CHUNKS_PER_WORKER: int = 2
+BATCH_PREDICTION_PROGRESS_INTERVAL_SECONDS: float = 10.0
+BATCH_PREDICTION_CHECKPOINT_SUFFIX: str = ".checkpoint.json"
+
+COLLECTION_PREDICTION_COLLECTION_NAME: str = "thyroid_predictions"
+COLLECTION_PREDICTION_BATCH_SIZE: int = 5000
+COLLECTION_PREDICTION_MAX_BATCHES_IN_FLIGHT: int = 4
+
+STREAM_PREDICTION_STATE_COLLECTION_NAME: str = "prediction_stream_state"
+# auto follows a change stream on replica sets and mongos, and polls new _ids on standalone servers
+STREAM_PREDICTION_MODE: str = "auto"
+STREAM_PREDICTION_MAX_BATCH_SIZE: int = 500
+STREAM_PREDICTION_MAX_WAIT_MS: int = 1000
+STREAM_PREDICTION_POLL_INTERVAL_SECONDS: float = 1.0
 
 APP_HOST = "0.0.0.0"
-APP_PORT = 8080
\ No newline at end of file
+APP_PORT = 8080
+APP_WORKERS = 1
+
+APP_HOST_ENV_KEY = "APP_HOST"
+APP_PORT_ENV_KEY = "APP_PORT"
+APP_WORKERS_ENV_KEY = "APP_WORKERS"
+INFERENCE_POOL_SIZE_ENV_KEY = "INFERENCE_POOL_SIZE"
\ No newline at end of file
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 
 
 @dataclass
@@ -18,6 +19,7 @@ class DataTransformationArtifact:
     transformed_object_file_path:str
     transformed_train_file_path:str
     transformed_test_file_path:str
+    feature_reference_file_path:Optional[str] = None
 
 
 @dataclass
@@ -30,6 +32,8 @@ class ClassificationMetricArtifact:
 class ModelTrainerArtifact:
     trained_model_file_path:str
     metric_artifact:ClassificationMetricArtifact
+    fallback_model_file_path:Optional[str] = None
+    model_bundle_dir_path:Optional[str] = None
 
 @dataclass
 class ModelEvaluationArtifact:
@@ -37,6 +41,7 @@ class ModelEvaluationArtifact:
     changed_accuracy:float
     s3_model_path:str 
     trained_model_path:str
+    fallback_model_path:Optional[str] = None
 
 @dataclass
 class ModelPusherArtifact:
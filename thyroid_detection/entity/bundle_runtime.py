@@ -0,0 +1,229 @@
+"""
+Standalone runtime of an exported thyroid model bundle.
+
+This file is copied verbatim into every bundle written by thyroid_detection.entity.model_bundle,
+next to the manifest and array data of the model, so it must only ever import the standard
+library and NumPy. It reproduces the compiled encoder and compiled predictors of the training
+code operation for operation, and the exporter checks it predicts exactly like the trained model.
+
+    import thyroid_bundle
+    model = thyroid_bundle.load()
+    model.predict([{"age": 41, "sex": "F", "on_thyroxine": "f", ..., "FTI": 109.0}])  # ["negative"]
+"""
+import json
+import os
+from typing import Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_FILE_NAME = "manifest.json"
+ARRAYS_FILE_NAME = "arrays.npz"
+UNKNOWN_LABEL = "Unknown"
+KNN_QUERY_CHUNK_SIZE = 1024
+
+
+class BundleEncoder:
+    """
+    Median imputation and robust scaling of the numerical features, most frequent imputation
+    and one-hot encoding of the categorical ones
+    """
+
+    def __init__(self, numerical_features, categorical_features, fill_values, onehot_categories,
+                 medians, onehot_feature_index, centers=None, scales=None):
+        self.numerical_features = list(numerical_features)
+        self.categorical_features = list(categorical_features)
+        self.fill_values = list(fill_values)
+        self.onehot_categories = list(onehot_categories)
+        self.medians = medians
+        self.onehot_feature_index = onehot_feature_index
+        self.centers = centers
+        self.scales = scales
+        self.n_features_out = len(self.numerical_features) + len(self.onehot_categories)
+
+    def transform_columns(self, columns: Mapping[str, Sequence]) -> np.ndarray:
+        numerical = np.column_stack([np.asarray(columns[name], dtype=np.float64) for name in self.numerical_features])
+        categorical = []
+        for name in self.categorical_features:
+            values = columns[name]
+            column = np.empty(len(values), dtype=object)
+            column[:] = list(values)
+            categorical.append(column)
+        return self._encode(numerical, categorical)
+
+    def transform_records(self, records: Sequence[Mapping[str, object]]) -> np.ndarray:
+        names = self.numerical_features + self.categorical_features
+        return self.transform_columns({name: [record.get(name) for record in records] for name in names})
+
+    def _encode(self, numerical: np.ndarray, categorical: List[np.ndarray]) -> np.ndarray:
+        output = np.zeros((numerical.shape[0], self.n_features_out), dtype=np.float64)
+        numerical = np.where(np.isnan(numerical), self.medians, numerical)
+        if self.centers is not None:
+            numerical -= self.centers
+        if self.scales is not None:
+            numerical /= self.scales
+        output[:, :len(self.numerical_features)] = numerical
+
+        imputed = []
+        for index, column in enumerate(categorical):
+            missing = column != column
+            if missing.any():
+                column = column.copy()
+                column[missing] = self.fill_values[index]
+            imputed.append(column)
+        offset = len(self.numerical_features)
+        for position, (feature_index, category) in enumerate(zip(self.onehot_feature_index, self.onehot_categories)):
+            output[:, offset + position] = imputed[feature_index] == category
+        return output
+
+
+class BundleForest:
+    """
+    Random forest flattened into node arrays; every sample walks down all trees at once
+    """
+
+    def __init__(self, max_depth, classes, roots, feature, threshold, children_left, children_right,
+                 missing_go_to_left, leaf_proba):
+        self.max_depth = max_depth
+        self.classes = classes
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.children_left = children_left
+        self.children_right = children_right
+        self.missing_go_to_left = missing_go_to_left
+        self.leaf_proba = leaf_proba
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])[:, np.newaxis]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            left = self.children_left[nodes]
+            active = left != -1
+            if not active.any():
+                break
+            values = X[rows, self.feature[nodes]]
+            go_left = np.where(np.isnan(values), self.missing_go_to_left[nodes], values <= self.threshold[nodes])
+            nodes = np.where(active, np.where(go_left, left, self.children_right[nodes]), nodes)
+
+        proba = np.zeros((nodes.shape[0], self.leaf_proba.shape[1]), dtype=np.float64)
+        for tree_index in range(nodes.shape[1]):
+            proba += self.leaf_proba[nodes[:, tree_index]]
+        proba /= nodes.shape[1]
+        return self.classes.take(np.argmax(proba, axis=1), axis=0)
+
+
+class BundleKNN:
+    """
+    K nearest neighbours over float32 training points, one matrix product per chunk of queries
+    """
+
+    def __init__(self, n_neighbors, distance_weighted, classes, reference, reference_norms, reference_labels):
+        self.n_neighbors = n_neighbors
+        self.distance_weighted = distance_weighted
+        self.classes = classes
+        self.reference = reference
+        self.reference_norms = reference_norms
+        self.reference_labels = reference_labels
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        codes = np.empty(X.shape[0], dtype=np.int64)
+        for start in range(0, X.shape[0], KNN_QUERY_CHUNK_SIZE):
+            codes[start:start + KNN_QUERY_CHUNK_SIZE] = self._predict_codes(X[start:start + KNN_QUERY_CHUNK_SIZE])
+        return self.classes.take(codes)
+
+    def _predict_codes(self, X: np.ndarray) -> np.ndarray:
+        k = self.n_neighbors
+        squared = np.einsum("ij,ij->i", X, X)[:, np.newaxis] - 2.0 * (X @ self.reference.T) + self.reference_norms
+        np.maximum(squared, 0.0, out=squared)
+        neighbours = np.argpartition(squared, k - 1, axis=1)[:, :k]
+        labels = self.reference_labels[neighbours]
+
+        if self.distance_weighted:
+            distances = np.sqrt(np.take_along_axis(squared, neighbours, axis=1)).astype(np.float64)
+            exact = distances == 0.0
+            with np.errstate(divide="ignore"):
+                weights = np.where(exact.any(axis=1, keepdims=True), exact.astype(np.float64), 1.0 / distances)
+        else:
+            weights = np.ones(labels.shape, dtype=np.float64)
+
+        n_classes = len(self.classes)
+        slots = (np.arange(X.shape[0])[:, np.newaxis] * n_classes + labels).ravel()
+        votes = np.bincount(slots, weights=weights.ravel(), minlength=X.shape[0] * n_classes)
+        return np.argmax(votes.reshape(X.shape[0], n_classes), axis=1)
+
+
+PREDICTOR_TYPES = {"CompiledForest": BundleForest, "CompiledKNN": BundleKNN}
+
+
+class ThyroidBundle:
+    """
+    Encoder and predictor of an exported model, predicting class labels from raw input fields
+    """
+
+    def __init__(self, encoder: BundleEncoder, predictor, class_labels: Dict[int, str],
+                 input_features: List[str], feature_reference: Optional[dict] = None):
+        self.encoder = encoder
+        self.predictor = predictor
+        self.class_labels = class_labels
+        self.input_features = input_features
+        self.feature_reference = feature_reference
+        self._labels = np.array([class_labels.get(code, UNKNOWN_LABEL) for code in range(max(class_labels) + 1)],
+                                dtype=object)
+
+    @classmethod
+    def load(cls, bundle_dir: Optional[str] = None) -> "ThyroidBundle":
+        """
+        Load the bundle stored in bundle_dir, by default the directory of this file
+        """
+        bundle_dir = bundle_dir or os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(bundle_dir, MANIFEST_FILE_NAME)) as file_obj:
+            manifest = json.load(file_obj)
+        if manifest["format_version"] > BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"Bundle format version {manifest['format_version']} is newer than the supported "
+                             f"version {BUNDLE_FORMAT_VERSION}")
+
+        with np.load(os.path.join(bundle_dir, ARRAYS_FILE_NAME), allow_pickle=False) as arrays:
+            def read_arrays(prefix: str) -> Dict[str, np.ndarray]:
+                return {name[len(prefix) + 1:]: arrays[name] for name in arrays.files if name.startswith(prefix + ".")}
+
+            encoder = BundleEncoder(**manifest["encoder"]["params"], **read_arrays("encoder"))
+            predictor_cls = PREDICTOR_TYPES[manifest["predictor"]["type"]]
+            predictor = predictor_cls(**manifest["predictor"]["params"], **read_arrays("predictor"))
+
+        return cls(encoder=encoder, predictor=predictor,
+                   class_labels={int(code): label for code, label in manifest["class_labels"].items()},
+                   input_features=manifest["input_features"],
+                   feature_reference=manifest.get("feature_reference"))
+
+    def predict_codes(self, records: Sequence[Mapping[str, object]]) -> np.ndarray:
+        """
+        Class codes of records, dicts of raw input fields
+        """
+        return self.predictor.predict(self.encoder.transform_records(records))
+
+    def predict(self, records: Sequence[Mapping[str, object]]) -> List[str]:
+        """
+        Class labels of records, dicts of raw input fields
+        """
+        return self.map_codes(self.predict_codes(records))
+
+    def predict_columns(self, columns: Mapping[str, Sequence]) -> List[str]:
+        """
+        Class labels of a batch given as one sequence per input field
+        """
+        return self.map_codes(self.predictor.predict(self.encoder.transform_columns(columns)))
+
+    def map_codes(self, codes: np.ndarray) -> List[str]:
+        codes = np.asarray(codes)
+        labels = np.full(codes.shape, UNKNOWN_LABEL, dtype=object)
+        int_codes = np.nan_to_num(codes.astype(np.float64), nan=-1).astype(np.int64)
+        valid = (int_codes == codes) & (int_codes >= 0) & (int_codes < len(self._labels))
+        labels[valid] = self._labels[int_codes[valid]]
+        return labels.tolist()
+
+
+def load(bundle_dir: Optional[str] = None) -> ThyroidBundle:
+    return ThyroidBundle.load(bundle_dir)
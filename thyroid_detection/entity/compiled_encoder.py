@@ -0,0 +1,221 @@
+import sys
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pandas import DataFrame
+
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+
+if TYPE_CHECKING:
+    from sklearn.pipeline import Pipeline
+
+
+class CompiledFeatureEncoder:
+    """
+    NumPy-only replacement for the fitted preprocessing Pipeline built by
+    DataTransformation.get_data_transformer_object.
+
+    The fitted medians, RobustScaler centers/scales and one-hot category tables are
+    extracted into flat arrays, and the same float64 operations are applied in the same
+    order, so the output is bit-identical to pipeline.transform without the pandas and
+    sklearn validation overhead. As in sklearn, a value is treated as missing only when
+    it is NaN (value != value) after conversion to a NumPy array.
+    """
+
+    def __init__(self, numerical_features: List[str], medians: np.ndarray, centers: Optional[np.ndarray],
+                 scales: Optional[np.ndarray], categorical_features: List[str], fill_values: List[object],
+                 onehot_feature_index: np.ndarray, onehot_categories: List[object]):
+        """
+        :param numerical_features: numerical input columns, in output order
+        :param medians: fitted median imputation value per numerical feature
+        :param centers: fitted RobustScaler center per numerical feature, None without centering
+        :param scales: fitted RobustScaler scale per numerical feature, None without scaling
+        :param categorical_features: categorical input columns, in output order
+        :param fill_values: fitted most frequent imputation value per categorical feature
+        :param onehot_feature_index: for every one-hot output column, index of its categorical feature
+        :param onehot_categories: for every one-hot output column, the category it encodes
+        """
+        self.numerical_features = list(numerical_features)
+        self.medians = np.asarray(medians, dtype=np.float64)
+        self.centers = None if centers is None else np.asarray(centers, dtype=np.float64)
+        self.scales = None if scales is None else np.asarray(scales, dtype=np.float64)
+        self.categorical_features = list(categorical_features)
+        self.fill_values = list(fill_values)
+        self.onehot_feature_index = np.asarray(onehot_feature_index, dtype=np.int64)
+        self.onehot_categories = list(onehot_categories)
+
+        self.n_features_out = len(self.numerical_features) + len(self.onehot_categories)
+        # Per categorical feature: list of (output column, category), used for single records
+        self._onehot_lookup: List[List[Tuple[int, object]]] = [[] for _ in self.categorical_features]
+        offset = len(self.numerical_features)
+        for position, (feature_index, category) in enumerate(zip(self.onehot_feature_index, self.onehot_categories)):
+            self._onehot_lookup[feature_index].append((offset + position, category))
+
+    @classmethod
+    def from_pipeline(cls, pipeline: "Pipeline") -> "CompiledFeatureEncoder":
+        """
+        Compile a fitted preprocessing pipeline, raising for any step this encoder cannot reproduce exactly
+        """
+        try:
+            from sklearn.compose import ColumnTransformer
+            from sklearn.pipeline import Pipeline
+
+            if not isinstance(pipeline, Pipeline) or len(pipeline.steps) != 1 or \
+                    not isinstance(pipeline.steps[0][1], ColumnTransformer):
+                raise ValueError("Expected a pipeline with a single ColumnTransformer step")
+            column_transformer = pipeline.steps[0][1]
+
+            fitted = [(name, transformer, columns) for name, transformer, columns in column_transformer.transformers_
+                      if transformer != "drop" and len(columns) > 0]
+            if [name for name, _, _ in fitted] != ["num", "cat"]:
+                raise ValueError(f"Unsupported ColumnTransformer layout: {[name for name, _, _ in fitted]}")
+
+            _, numeric_pipeline, numerical_features = fitted[0]
+            _, categorical_pipeline, categorical_features = fitted[1]
+
+            imputer, scaler = [step for _, step in numeric_pipeline.steps]
+            if imputer.strategy != "median" or np.isnan(imputer.statistics_).any() or imputer.add_indicator:
+                raise ValueError("Unsupported numerical imputer")
+
+            cat_imputer, onehot = [step for _, step in categorical_pipeline.steps]
+            if cat_imputer.strategy != "most_frequent" or cat_imputer.add_indicator:
+                raise ValueError("Unsupported categorical imputer")
+            if onehot.handle_unknown != "ignore" or getattr(onehot, "_infrequent_enabled", False):
+                raise ValueError("Unsupported one-hot encoder settings")
+
+            onehot_feature_index, onehot_categories = [], []
+            drop_idx = onehot.drop_idx_
+            for feature_index, categories in enumerate(onehot.categories_):
+                dropped = None if drop_idx is None else drop_idx[feature_index]
+                for category_index, category in enumerate(categories):
+                    if dropped is not None and category_index == dropped:
+                        continue
+                    onehot_feature_index.append(feature_index)
+                    onehot_categories.append(category)
+
+            return cls(
+                numerical_features=list(numerical_features),
+                medians=imputer.statistics_,
+                centers=scaler.center_ if scaler.with_centering else None,
+                scales=scaler.scale_ if scaler.with_scaling else None,
+                categorical_features=list(categorical_features),
+                fill_values=list(cat_imputer.statistics_),
+                onehot_feature_index=np.array(onehot_feature_index, dtype=np.int64),
+                onehot_categories=onehot_categories,
+            )
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def transform(self, dataframe: DataFrame) -> np.ndarray:
+        """
+        Drop-in replacement for pipeline.transform on a DataFrame of raw features
+        """
+        try:
+            numerical = np.column_stack(
+                [np.asarray(dataframe[name].to_numpy(), dtype=np.float64) for name in self.numerical_features]
+            )
+            categorical = [np.asarray(dataframe[name].to_numpy(), dtype=object) for name in self.categorical_features]
+            return self._encode(numerical, categorical)
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def transform_records(self, records: Sequence[object]) -> np.ndarray:
+        """
+        Encode a batch of records (dicts keyed by feature name or ThyroidData objects)
+        straight into the float feature matrix, without building a DataFrame
+        """
+        try:
+            getters = [self._field_getter(record) for record in records]
+            numerical = np.array(
+                [[get(name) for name in self.numerical_features] for get in getters], dtype=np.float64
+            ).reshape(len(getters), len(self.numerical_features))
+            categorical = []
+            for name in self.categorical_features:
+                column = np.empty(len(getters), dtype=object)
+                column[:] = [get(name) for get in getters]
+                categorical.append(column)
+            return self._encode(numerical, categorical)
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def transform_record(self, record: object) -> np.ndarray:
+        """
+        Encode one record into a (1, n_features_out) matrix with plain Python float arithmetic,
+        which is IEEE float64 and therefore identical to the vectorized path
+        """
+        try:
+            get = self._field_getter(record)
+            row = np.zeros((1, self.n_features_out), dtype=np.float64)
+            for index, name in enumerate(self.numerical_features):
+                value = get(name)
+                value = np.nan if value is None else float(value)
+                if value != value:
+                    value = float(self.medians[index])
+                if self.centers is not None:
+                    value = value - float(self.centers[index])
+                if self.scales is not None:
+                    value = value / float(self.scales[index])
+                row[0, index] = value
+
+            for index, name in enumerate(self.categorical_features):
+                value = get(name)
+                if value != value:
+                    value = self.fill_values[index]
+                for column, category in self._onehot_lookup[index]:
+                    if value == category:
+                        row[0, column] = 1.0
+                        break
+            return row
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def verify(self, pipeline: "Pipeline", dataframe: DataFrame) -> None:
+        """
+        Check that this encoder reproduces pipeline.transform bit for bit on dataframe,
+        both through the DataFrame path and the record path
+        """
+        try:
+            expected = pipeline.transform(dataframe)
+            if hasattr(expected, "toarray"):
+                expected = expected.toarray()
+            expected = np.asarray(expected, dtype=np.float64)
+
+            records = dataframe.to_dict(orient="records")
+            for name, actual in (("transform", self.transform(dataframe)),
+                                 ("transform_records", self.transform_records(records))):
+                if actual.shape != expected.shape or not np.array_equal(
+                        actual.view(np.uint64), expected.view(np.uint64)):
+                    raise ValueError(f"Compiled encoder {name} output differs from the sklearn pipeline")
+            logging.info(f"Compiled encoder matches the sklearn pipeline on {len(dataframe)} rows")
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def _encode(self, numerical: np.ndarray, categorical: List[np.ndarray]) -> np.ndarray:
+        n_rows = numerical.shape[0]
+        output = np.zeros((n_rows, self.n_features_out), dtype=np.float64)
+
+        numerical = np.where(np.isnan(numerical), self.medians, numerical)
+        if self.centers is not None:
+            numerical -= self.centers
+        if self.scales is not None:
+            numerical /= self.scales
+        output[:, :len(self.numerical_features)] = numerical
+
+        offset = len(self.numerical_features)
+        imputed = []
+        for index, column in enumerate(categorical):
+            missing = column != column
+            if missing.any():
+                column = column.copy()
+                column[missing] = self.fill_values[index]
+            imputed.append(column)
+        for position, (feature_index, category) in enumerate(zip(self.onehot_feature_index, self.onehot_categories)):
+            output[:, offset + position] = imputed[feature_index] == category
+        return output
+
+    @staticmethod
+    def _field_getter(record: object):
+        if isinstance(record, dict):
+            return record.get
+        return lambda name: getattr(record, name, None)
@@ -0,0 +1,215 @@
+import sys
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+
+if TYPE_CHECKING:
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.neighbors import KNeighborsClassifier
+
+KNN_QUERY_CHUNK_SIZE: int = 1024
+
+
+class CompiledForest:
+    """
+    Flattened RandomForestClassifier: the nodes of all trees are concatenated into contiguous
+    feature/threshold/children/leaf-probability arrays and every sample is walked down every
+    tree at once with vectorized NumPy indexing. Inputs are cast to float32 and leaf
+    probabilities are summed tree by tree, as sklearn does, so predictions are identical.
+    """
+
+    def __init__(self, classes: np.ndarray, roots: np.ndarray, feature: np.ndarray, threshold: np.ndarray,
+                 children_left: np.ndarray, children_right: np.ndarray, missing_go_to_left: np.ndarray,
+                 leaf_proba: np.ndarray, max_depth: int):
+        """
+        :param classes: class labels, as classes_ of the forest
+        :param roots: index of the root node of each tree
+        :param feature: split feature of every node, 0 for leaves
+        :param threshold: split threshold of every node
+        :param children_left: left child of every node, -1 for leaves
+        :param children_right: right child of every node, -1 for leaves
+        :param missing_go_to_left: whether NaN goes to the left child at every node
+        :param leaf_proba: class probabilities of every node, used at leaves
+        :param max_depth: depth of the deepest tree
+        """
+        self.classes = classes
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.children_left = children_left
+        self.children_right = children_right
+        self.missing_go_to_left = missing_go_to_left
+        self.leaf_proba = leaf_proba
+        self.max_depth = max_depth
+
+    @classmethod
+    def from_estimator(cls, forest: "RandomForestClassifier") -> "CompiledForest":
+        try:
+            if forest.n_outputs_ != 1:
+                raise ValueError("Only single output forests can be compiled")
+
+            n_classes = forest.n_classes_
+            roots, features, thresholds, lefts, rights, missing_lefts, probas = [], [], [], [], [], [], []
+            offset = 0
+            for tree in forest.estimators_:
+                tree_ = tree.tree_
+                is_leaf = tree_.children_left == -1
+                roots.append(offset)
+                features.append(np.where(is_leaf, 0, tree_.feature))
+                thresholds.append(tree_.threshold)
+                lefts.append(np.where(is_leaf, -1, tree_.children_left + offset))
+                rights.append(np.where(is_leaf, -1, tree_.children_right + offset))
+                missing_left = getattr(tree_, "missing_go_to_left", None)
+                missing_lefts.append(np.zeros(tree_.node_count, dtype=bool) if missing_left is None
+                                     else missing_left.astype(bool))
+
+                # Recent sklearn stores class fractions in value, older releases stored counts and
+                # normalized them at predict time; integer counts summing to 1 are unchanged either way
+                proba = tree_.value[:, 0, :n_classes].astype(np.float64)
+                normalizer = proba.sum(axis=1)[:, np.newaxis]
+                counts = ~np.isclose(normalizer, 1.0)
+                normalizer[normalizer == 0.0] = 1.0
+                proba = np.where(counts, proba / normalizer, proba)
+                probas.append(proba)
+                offset += tree_.node_count
+
+            return cls(
+                classes=np.asarray(forest.classes_),
+                roots=np.asarray(roots, dtype=np.int64),
+                feature=np.ascontiguousarray(np.concatenate(features), dtype=np.int64),
+                threshold=np.ascontiguousarray(np.concatenate(thresholds), dtype=np.float64),
+                children_left=np.ascontiguousarray(np.concatenate(lefts), dtype=np.int64),
+                children_right=np.ascontiguousarray(np.concatenate(rights), dtype=np.int64),
+                missing_go_to_left=np.ascontiguousarray(np.concatenate(missing_lefts)),
+                leaf_proba=np.ascontiguousarray(np.concatenate(probas)),
+                max_depth=max(tree.tree_.max_depth for tree in forest.estimators_),
+            )
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """
+        Return the leaf index reached by every sample in every tree, shape (n_samples, n_trees)
+        """
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])[:, np.newaxis]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            left = self.children_left[nodes]
+            active = left != -1
+            if not active.any():
+                break
+            values = X[rows, self.feature[nodes]]
+            go_left = np.where(np.isnan(values), self.missing_go_to_left[nodes], values <= self.threshold[nodes])
+            nodes = np.where(active, np.where(go_left, left, self.children_right[nodes]), nodes)
+        return nodes
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        leaves = self.apply(X)
+        proba = np.zeros((leaves.shape[0], self.leaf_proba.shape[1]), dtype=np.float64)
+        for tree_index in range(leaves.shape[1]):
+            proba += self.leaf_proba[leaves[:, tree_index]]
+        proba /= leaves.shape[1]
+        return proba
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        try:
+            return self.classes.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+
+class CompiledKNN:
+    """
+    Compact KNeighborsClassifier: the training points are kept as one float32 reference matrix
+    with precomputed squared norms, so neighbours are found with a single matrix product per
+    chunk of queries (||x||^2 - 2 x.r + ||r||^2). Ties between classes resolve to the smallest
+    class index like sklearn; float32 distances can differ from sklearn's in the last bits,
+    so compile_estimator only ships this model after checking predictions on held-out data.
+    """
+
+    def __init__(self, classes: np.ndarray, reference: np.ndarray, reference_norms: np.ndarray,
+                 reference_labels: np.ndarray, n_neighbors: int, distance_weighted: bool):
+        """
+        :param classes: class labels, as classes_ of the estimator
+        :param reference: float32 training points
+        :param reference_norms: squared L2 norm of every training point
+        :param reference_labels: class index of every training point
+        :param n_neighbors: number of neighbours voting
+        :param distance_weighted: weights="distance" when True, uniform votes otherwise
+        """
+        self.classes = classes
+        self.reference = reference
+        self.reference_norms = reference_norms
+        self.reference_labels = reference_labels
+        self.n_neighbors = n_neighbors
+        self.distance_weighted = distance_weighted
+
+    @classmethod
+    def from_estimator(cls, knn: "KNeighborsClassifier") -> "CompiledKNN":
+        try:
+            if knn.outputs_2d_ or knn.weights not in ("uniform", "distance"):
+                raise ValueError("Only single output KNN with uniform or distance weights can be compiled")
+            if knn.effective_metric_ != "euclidean":
+                raise ValueError(f"Unsupported KNN metric: {knn.effective_metric_}")
+
+            reference = np.ascontiguousarray(knn._fit_X, dtype=np.float32)
+            return cls(
+                classes=np.asarray(knn.classes_),
+                reference=reference,
+                reference_norms=np.einsum("ij,ij->i", reference, reference),
+                reference_labels=np.asarray(knn._y, dtype=np.int64),
+                n_neighbors=knn.n_neighbors,
+                distance_weighted=knn.weights == "distance",
+            )
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        try:
+            X = np.asarray(X, dtype=np.float32)
+            codes = np.empty(X.shape[0], dtype=np.int64)
+            for start in range(0, X.shape[0], KNN_QUERY_CHUNK_SIZE):
+                codes[start:start + KNN_QUERY_CHUNK_SIZE] = self._predict_codes(X[start:start + KNN_QUERY_CHUNK_SIZE])
+            return self.classes.take(codes)
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def _predict_codes(self, X: np.ndarray) -> np.ndarray:
+        k = self.n_neighbors
+        squared = np.einsum("ij,ij->i", X, X)[:, np.newaxis] - 2.0 * (X @ self.reference.T) + self.reference_norms
+        np.maximum(squared, 0.0, out=squared)
+        neighbours = np.argpartition(squared, k - 1, axis=1)[:, :k]
+        labels = self.reference_labels[neighbours]
+
+        if self.distance_weighted:
+            distances = np.sqrt(np.take_along_axis(squared, neighbours, axis=1)).astype(np.float64)
+            exact = distances == 0.0
+            with np.errstate(divide="ignore"):
+                weights = np.where(exact.any(axis=1, keepdims=True), exact.astype(np.float64), 1.0 / distances)
+        else:
+            weights = np.ones(labels.shape, dtype=np.float64)
+
+        n_classes = len(self.classes)
+        slots = (np.arange(X.shape[0])[:, np.newaxis] * n_classes + labels).ravel()
+        votes = np.bincount(slots, weights=weights.ravel(), minlength=X.shape[0] * n_classes)
+        return np.argmax(votes.reshape(X.shape[0], n_classes), axis=1)
+
+
+def compile_estimator(estimator: object) -> Optional[object]:
+    """
+    Compile a fitted model_selection candidate from config/model.yaml, returning None for
+    estimator types without a compiled counterpart
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.neighbors import KNeighborsClassifier
+
+    if isinstance(estimator, RandomForestClassifier):
+        return CompiledForest.from_estimator(estimator)
+    if isinstance(estimator, KNeighborsClassifier):
+        return CompiledKNN.from_estimator(estimator)
+    logging.info(f"No compiled predictor for {type(estimator).__name__}")
+    return None
@@ -1,6 +1,7 @@
 from datetime import datetime
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional
 from thyroid_detection.constants import *
 
 TIMESTAMP: str = datetime.now().strftime("%m_%d_%Y_%H_%M_%S")
@@ -41,12 +42,18 @@ class DataTransformationConfig:
     transformed_object_file_path: str = os.path.join(data_transformation_dir,
                                                      DATA_TRANSFORMATION_TRANSFORMED_OBJECT_DIR,
                                                      PREPROCSSING_OBJECT_FILE_NAME)
+    feature_reference_file_path: str = os.path.join(data_transformation_dir,
+                                                    DATA_TRANSFORMATION_FEATURE_REFERENCE_DIR,
+                                                    DATA_TRANSFORMATION_FEATURE_REFERENCE_FILE_NAME)
 
 
 @dataclass
 class ModelTrainerConfig:
     model_trainer_dir: str = os.path.join(training_pipeline_config.artifact_dir, MODEL_TRAINER_DIR_NAME)
     trained_model_file_path: str = os.path.join(model_trainer_dir, MODEL_TRAINER_TRAINED_MODEL_DIR, MODEL_FILE_NAME)
+    fallback_model_file_path: str = os.path.join(model_trainer_dir, MODEL_TRAINER_TRAINED_MODEL_DIR,
+                                                 FALLBACK_MODEL_FILE_NAME)
+    model_bundle_dir: str = os.path.join(model_trainer_dir, MODEL_TRAINER_BUNDLE_DIR)
     expected_accuracy: float = MODEL_TRAINER_EXPECTED_SCORE
     model_config_file_path: str = MODEL_TRAINER_MODEL_CONFIG_FILE_PATH
 
@@ -61,9 +68,71 @@ class ModelEvaluationConfig:
 class ModelPusherConfig:
     bucket_name: str = MODEL_BUCKET_NAME
     s3_model_key_path: str = MODEL_FILE_NAME
+    s3_fallback_model_key_path: str = FALLBACK_MODEL_FILE_NAME
 
 
 @dataclass
 class ThyroidPredictorConfig:
     model_file_path: str = MODEL_FILE_NAME
     model_bucket_name: str = MODEL_BUCKET_NAME
+    # S3 object version served from the model pool, the latest (hot reloaded) model when None
+    model_version: Optional[str] = None
+    model_reload_interval_seconds: float = MODEL_RELOAD_INTERVAL_SECONDS
+    coalesce_predictions: bool = PREDICTION_COALESCE_ENABLED
+    coalesce_max_batch_size: int = PREDICTION_COALESCE_MAX_BATCH_SIZE
+    coalesce_max_wait_ms: float = PREDICTION_COALESCE_MAX_WAIT_MS
+    prediction_cache_enabled: bool = PREDICTION_CACHE_ENABLED
+    prediction_cache_max_size: int = PREDICTION_CACHE_MAX_SIZE
+    prediction_cache_ttl_seconds: float = PREDICTION_CACHE_TTL_SECONDS
+    prediction_cache_rounding: dict = field(default_factory=lambda: dict(PREDICTION_CACHE_ROUNDING))
+    fallback_enabled: bool = FALLBACK_MODEL_ENABLED
+    fallback_model_file_path: str = FALLBACK_MODEL_FILE_NAME
+    fallback_queue_depth_threshold: int = FALLBACK_QUEUE_DEPTH_THRESHOLD
+    fallback_p95_ms_threshold: float = FALLBACK_P95_MS_THRESHOLD
+    drift_monitoring_enabled: bool = DRIFT_MONITORING_ENABLED
+
+
+@dataclass
+class BatchPredictionConfig:
+    # Local model file; when None the model is read from model_bucket_name/model_s3_key_path
+    model_file_path: Optional[str] = None
+    model_bucket_name: str = MODEL_BUCKET_NAME
+    model_s3_key_path: str = MODEL_FILE_NAME
+    chunk_size: int = BATCH_PREDICTION_CHUNK_SIZE
+    # Worker processes, one per CPU when None
+    workers: Optional[int] = None
+    max_pending_chunks_per_worker: int = BATCH_PREDICTION_MAX_PENDING_CHUNKS_PER_WORKER
+    progress_interval_seconds: float = BATCH_PREDICTION_PROGRESS_INTERVAL_SECONDS
+    checkpoint_suffix: str = BATCH_PREDICTION_CHECKPOINT_SUFFIX
+
+
+@dataclass
+class CollectionPredictionConfig:
+    database_name: str = DATABASE_NAME
+    collection_name: str = COLLECTION_NAME
+    # Predictions are upserted here under the _id of their input document
+    predictions_collection_name: str = COLLECTION_PREDICTION_COLLECTION_NAME
+    batch_size: int = COLLECTION_PREDICTION_BATCH_SIZE
+    max_batches_in_flight: int = COLLECTION_PREDICTION_MAX_BATCHES_IN_FLIGHT
+    # Local model file; when None the model is read from model_bucket_name/model_s3_key_path
+    model_file_path: Optional[str] = None
+    model_bucket_name: str = MODEL_BUCKET_NAME
+    model_s3_key_path: str = MODEL_FILE_NAME
+
+
+@dataclass
+class StreamPredictionConfig:
+    database_name: str = DATABASE_NAME
+    collection_name: str = COLLECTION_NAME
+    predictions_collection_name: str = COLLECTION_PREDICTION_COLLECTION_NAME
+    # Resume token or last _id of the worker, updated with every batch of predictions
+    state_collection_name: str = STREAM_PREDICTION_STATE_COLLECTION_NAME
+    mode: str = STREAM_PREDICTION_MODE
+    max_batch_size: int = STREAM_PREDICTION_MAX_BATCH_SIZE
+    max_wait_ms: int = STREAM_PREDICTION_MAX_WAIT_MS
+    poll_interval_seconds: float = STREAM_PREDICTION_POLL_INTERVAL_SECONDS
+    # Local model file; when None the model is read from S3 and hot reloaded when it changes
+    model_file_path: Optional[str] = None
+    model_bucket_name: str = MODEL_BUCKET_NAME
+    model_s3_key_path: str = MODEL_FILE_NAME
+    model_reload_interval_seconds: float = MODEL_RELOAD_INTERVAL_SECONDS
@@ -1,10 +1,16 @@
 import sys
+from typing import TYPE_CHECKING, Optional, Sequence
 
+import numpy as np
 from pandas import DataFrame
-from sklearn.pipeline import Pipeline
 
+from thyroid_detection.entity.compiled_encoder import CompiledFeatureEncoder
 from thyroid_detection.exception import ThyroidException
 from thyroid_detection.logger import logging
+from thyroid_detection.serving.metrics import stage_timer
+
+if TYPE_CHECKING:
+    from sklearn.pipeline import Pipeline
 
 class TargetValueMapping:
     def __init__(self):
@@ -22,13 +28,49 @@ class TargetValueMapping:
     
 
 class thyroidModel:
-    def __init__(self, preprocessing_object: Pipeline, trained_model_object: object):
+    def __init__(self, preprocessing_object: "Pipeline", trained_model_object: object):
         """
-        :param preprocessing_object: Input Object of preprocesser
+        :param preprocessing_object: Input Object of preprocesser, the fitted pipeline or its CompiledFeatureEncoder
         :param trained_model_object: Input Object of trained model 
         """
         self.preprocessing_object = preprocessing_object
         self.trained_model_object = trained_model_object
+        self.compiled_encoder: Optional[CompiledFeatureEncoder] = None
+        self.compiled_model: Optional[object] = None
+        # Summary of the training inputs, see thyroid_detection.serving.drift.build_feature_reference
+        self.feature_reference: Optional[dict] = None
+        self.get_compiled_encoder()
+
+    @property
+    def predictor(self) -> object:
+        """
+        The compiled predictor when one was attached after training, else the sklearn estimator
+        """
+        compiled_model = getattr(self, "compiled_model", None)
+        return self.trained_model_object if compiled_model is None else compiled_model
+
+    def get_compiled_encoder(self) -> Optional[CompiledFeatureEncoder]:
+        """
+        Return the NumPy-only encoder compiled from preprocessing_object, or None when the
+        preprocessing pipeline cannot be compiled. Models pickled before the encoder
+        existed are compiled on first use.
+        """
+        if isinstance(self.preprocessing_object, CompiledFeatureEncoder):
+            self.compiled_encoder = self.preprocessing_object
+        elif getattr(self, "compiled_encoder", None) is None and not getattr(self, "_encoder_unsupported", False):
+            try:
+                self.compiled_encoder = CompiledFeatureEncoder.from_pipeline(self.preprocessing_object)
+            except ThyroidException as e:
+                logging.info(f"Preprocessing pipeline is not compilable, using sklearn transform: {e}")
+                self.compiled_encoder = None
+                self._encoder_unsupported = True
+        return self.compiled_encoder
+
+    def transform(self, dataframe: DataFrame) -> np.ndarray:
+        encoder = self.get_compiled_encoder()
+        if encoder is not None:
+            return encoder.transform(dataframe)
+        return self.preprocessing_object.transform(dataframe)
 
     def predict(self, dataframe: DataFrame) -> DataFrame:
         """
@@ -41,10 +83,33 @@ class thyroidModel:
         try:
             logging.info("Using the trained model to get predictions")
 
-            transformed_feature = self.preprocessing_object.transform(dataframe)
+            with stage_timer("transform"):
+                transformed_feature = self.transform(dataframe)
 
             logging.info("Used the trained model to get predictions")
-            return self.trained_model_object.predict(transformed_feature)
+            with stage_timer("model_predict"):
+                return self.predictor.predict(transformed_feature)
+
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def predict_records(self, records: Sequence[object]) -> np.ndarray:
+        """
+        Predict a batch of records (dicts or ThyroidData objects) without building a DataFrame
+        when the preprocessing pipeline is compiled
+        """
+        try:
+            encoder = self.get_compiled_encoder()
+            if encoder is None:
+                return self.predict(DataFrame.from_records(
+                    [record if isinstance(record, dict) else vars(record) for record in records]))
+            with stage_timer("transform"):
+                if len(records) == 1:
+                    transformed_feature = encoder.transform_record(records[0])
+                else:
+                    transformed_feature = encoder.transform_records(records)
+            with stage_timer("model_predict"):
+                return self.predictor.predict(transformed_feature)
 
         except Exception as e:
             raise ThyroidException(e, sys) from e
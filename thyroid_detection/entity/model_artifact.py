@@ -0,0 +1,278 @@
+"""
+Memory-mappable model artifact format.
+
+A file starts with a fixed header (magic, format version, manifest length), then a
+JSON manifest, then every NumPy array of the compiled encoder and predictor as a raw
+segment aligned to MODEL_ARTIFACT_ALIGNMENT bytes:
+
+    | magic | version | reserved | manifest length | manifest JSON | pad | segment | pad | segment | ...
+
+Loading maps the file read-only and wraps each segment in a NumPy view, so nothing is
+copied and all worker processes share one page-cache copy of the arrays. Files that do
+not start with the magic are loaded as the dill/pickle model.pkl files written before
+this format, and migrate_model_file converts them.
+
+    python -m thyroid_detection.entity.model_artifact model.pkl model.tmdl --verify-csv test.csv
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from typing import Dict, Tuple, Union
+
+import numpy as np
+
+from thyroid_detection.entity.compiled_encoder import CompiledFeatureEncoder
+from thyroid_detection.entity.compiled_model import CompiledForest, CompiledKNN, compile_estimator
+from thyroid_detection.entity.estimator import thyroidModel
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+
+MODEL_ARTIFACT_MAGIC: bytes = b"THYMODEL"
+MODEL_ARTIFACT_FORMAT_VERSION: int = 1
+MODEL_ARTIFACT_ALIGNMENT: int = 64
+_HEADER = struct.Struct("<8sIIQ")
+
+# Compiled predictor classes that can be stored, by the type name written in the manifest
+PREDICTOR_TYPES = {cls.__name__: cls for cls in (CompiledForest, CompiledKNN)}
+
+
+def is_model_artifact(data: Union[bytes, memoryview]) -> bool:
+    return bytes(data[:len(MODEL_ARTIFACT_MAGIC)]) == MODEL_ARTIFACT_MAGIC
+
+
+def save_model_artifact(file_path: str, model: thyroidModel) -> None:
+    """
+    Write model in the artifact format; the model needs a compiled encoder and a compiled predictor
+    """
+    logging.info("Entered the save_model_artifact method of model_artifact")
+
+    try:
+        encoder = model.get_compiled_encoder()
+        predictor = getattr(model, "compiled_model", None)
+        if encoder is None or predictor is None:
+            raise ValueError("Only models with a compiled encoder and a compiled predictor can be saved as artifacts")
+
+        segments, arrays = [], []
+        offset = 0
+
+        def add_arrays(component_arrays: Dict[str, np.ndarray], prefix: str) -> Dict[str, int]:
+            nonlocal offset
+            indexes = {}
+            for name, array in component_arrays.items():
+                array = np.ascontiguousarray(array)
+                if array.dtype.hasobject:
+                    raise ValueError(f"Array {prefix}.{name} has object dtype and cannot be memory mapped")
+                offset = _align(offset)
+                indexes[name] = len(segments)
+                segments.append({"dtype": array.dtype.str, "shape": list(array.shape),
+                                 "offset": offset, "nbytes": array.nbytes})
+                arrays.append(array)
+                offset += array.nbytes
+            return indexes
+
+        encoder_params, encoder_arrays = get_encoder_state(encoder)
+        predictor_params, predictor_arrays = get_predictor_state(predictor)
+        manifest = {
+            "format_version": MODEL_ARTIFACT_FORMAT_VERSION,
+            "encoder": {"params": encoder_params, "arrays": add_arrays(encoder_arrays, "encoder")},
+            "predictor": {"type": type(predictor).__name__, "params": predictor_params,
+                          "arrays": add_arrays(predictor_arrays, "predictor")},
+            "segments": segments,
+            "feature_reference": getattr(model, "feature_reference", None),
+        }
+        manifest_bytes = json.dumps(manifest).encode()
+        data_start = _align(_HEADER.size + len(manifest_bytes))
+
+        dir_path = os.path.dirname(file_path) or "."
+        os.makedirs(dir_path, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=dir_path, suffix=".tmp", delete=False) as file_obj:
+            file_obj.write(_HEADER.pack(MODEL_ARTIFACT_MAGIC, MODEL_ARTIFACT_FORMAT_VERSION, 0, len(manifest_bytes)))
+            file_obj.write(manifest_bytes)
+            for segment, array in zip(segments, arrays):
+                file_obj.seek(data_start + segment["offset"])
+                file_obj.write(array.tobytes())
+            file_obj.truncate(data_start + offset)
+            file_obj.flush()
+            os.fsync(file_obj.fileno())
+        os.replace(file_obj.name, file_path)
+
+        logging.info(f"Saved model artifact {file_path}: {len(segments)} segments, {data_start + offset} bytes")
+    except Exception as e:
+        raise ThyroidException(e, sys) from e
+
+
+def load_model_artifact(file_path: str) -> thyroidModel:
+    """
+    Load an artifact file with read-only memory-mapped array views
+    """
+    try:
+        with open(file_path, "rb") as file_obj:
+            buffer = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        return parse_model_artifact(buffer)
+    except Exception as e:
+        raise ThyroidException(e, sys) from e
+
+
+def parse_model_artifact(buffer: Union[bytes, mmap.mmap]) -> thyroidModel:
+    """
+    Build the model from an artifact held in buffer; the arrays are views into buffer
+    """
+    try:
+        magic, format_version, _, manifest_length = _HEADER.unpack_from(buffer, 0)
+        if magic != MODEL_ARTIFACT_MAGIC:
+            raise ValueError("Not a model artifact")
+        if format_version > MODEL_ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Model artifact format version {format_version} is newer than the supported "
+                             f"version {MODEL_ARTIFACT_FORMAT_VERSION}")
+
+        manifest = json.loads(bytes(buffer[_HEADER.size:_HEADER.size + manifest_length]))
+        data_start = _align(_HEADER.size + manifest_length)
+        segments = manifest["segments"]
+
+        def read_arrays(indexes: Dict[str, int]) -> Dict[str, np.ndarray]:
+            arrays = {}
+            for name, index in indexes.items():
+                segment = segments[index]
+                dtype = np.dtype(segment["dtype"])
+                count = segment["nbytes"] // dtype.itemsize
+                arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                             offset=data_start + segment["offset"]).reshape(segment["shape"])
+            return arrays
+
+        encoder = CompiledFeatureEncoder(**manifest["encoder"]["params"],
+                                         **read_arrays(manifest["encoder"]["arrays"]))
+        predictor_cls = PREDICTOR_TYPES[manifest["predictor"]["type"]]
+        predictor = predictor_cls(**manifest["predictor"]["params"],
+                                  **read_arrays(manifest["predictor"]["arrays"]))
+
+        model = thyroidModel(preprocessing_object=encoder, trained_model_object=predictor)
+        model.compiled_model = predictor
+        model.feature_reference = manifest.get("feature_reference")
+        return model
+    except Exception as e:
+        raise ThyroidException(e, sys) from e
+
+
+def load_model_file(file_path: str) -> thyroidModel:
+    """
+    Load a model file in either format: memory-mapped artifact, or dill/pickle model.pkl
+    """
+    try:
+        with open(file_path, "rb") as file_obj:
+            magic = file_obj.read(len(MODEL_ARTIFACT_MAGIC))
+        if is_model_artifact(magic):
+            return load_model_artifact(file_path)
+
+        from thyroid_detection.utils.main_utils import load_object
+        return load_object(file_path)
+    except Exception as e:
+        raise ThyroidException(e, sys) from e
+
+
+def load_model_bytes(data: bytes) -> thyroidModel:
+    """
+    Load a model from an in-memory object body in either format
+    """
+    try:
+        if is_model_artifact(data):
+            return parse_model_artifact(data)
+
+        import pickle
+        return pickle.loads(data)
+    except Exception as e:
+        raise ThyroidException(e, sys) from e
+
+
+def migrate_model_file(from_file_path: str, to_file_path: str, verify_dataframe=None) -> thyroidModel:
+    """
+    Convert a dill/pickle model.pkl into the artifact format, compiling the predictor if it was
+    pickled before compiled predictors existed
+    :param verify_dataframe: raw input rows on which the migrated model must predict exactly as the original
+    """
+    logging.info("Entered the migrate_model_file method of model_artifact")
+
+    try:
+        from thyroid_detection.utils.main_utils import load_object
+
+        model = load_object(from_file_path)
+        if getattr(model, "compiled_model", None) is None:
+            model.compiled_model = compile_estimator(model.trained_model_object)
+
+        save_model_artifact(to_file_path, model)
+        migrated = load_model_artifact(to_file_path)
+
+        if verify_dataframe is not None:
+            expected = model.trained_model_object.predict(model.preprocessing_object.transform(verify_dataframe))
+            if not np.array_equal(migrated.predict(verify_dataframe), expected):
+                os.remove(to_file_path)
+                raise ValueError("Migrated model predictions differ from the original model")
+            logging.info(f"Migrated model verified on {len(verify_dataframe)} rows")
+        return migrated
+    except Exception as e:
+        raise ThyroidException(e, sys) from e
+
+
+def get_encoder_state(encoder: CompiledFeatureEncoder) -> Tuple[dict, Dict[str, np.ndarray]]:
+    params = {
+        "numerical_features": list(encoder.numerical_features),
+        "categorical_features": list(encoder.categorical_features),
+        "fill_values": [_to_json_value(value) for value in encoder.fill_values],
+        "onehot_categories": [_to_json_value(value) for value in encoder.onehot_categories],
+        "centers": None,
+        "scales": None,
+    }
+    arrays = {"medians": encoder.medians, "onehot_feature_index": encoder.onehot_feature_index}
+    for name in ("centers", "scales"):
+        if getattr(encoder, name) is not None:
+            del params[name]
+            arrays[name] = getattr(encoder, name)
+    return params, arrays
+
+
+def get_predictor_state(predictor: object) -> Tuple[dict, Dict[str, np.ndarray]]:
+    if isinstance(predictor, CompiledForest):
+        return {"max_depth": int(predictor.max_depth)}, {
+            "classes": predictor.classes, "roots": predictor.roots, "feature": predictor.feature,
+            "threshold": predictor.threshold, "children_left": predictor.children_left,
+            "children_right": predictor.children_right, "missing_go_to_left": predictor.missing_go_to_left,
+            "leaf_proba": predictor.leaf_proba,
+        }
+    if isinstance(predictor, CompiledKNN):
+        return {"n_neighbors": int(predictor.n_neighbors), "distance_weighted": bool(predictor.distance_weighted)}, {
+            "classes": predictor.classes, "reference": predictor.reference,
+            "reference_norms": predictor.reference_norms, "reference_labels": predictor.reference_labels,
+        }
+    raise ValueError(f"Unsupported compiled predictor: {type(predictor).__name__}")
+
+
+def _to_json_value(value: object) -> object:
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _align(offset: int) -> int:
+    return -(-offset // MODEL_ARTIFACT_ALIGNMENT) * MODEL_ARTIFACT_ALIGNMENT
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a pickled model.pkl into the memory-mappable model artifact format")
+    parser.add_argument('from_file_path')
+    parser.add_argument('to_file_path')
+    parser.add_argument('--verify-csv', help="CSV of raw input rows to check the migrated predictions on")
+    args = parser.parse_args()
+
+    verify_dataframe = None
+    if args.verify_csv:
+        import pandas as pd
+        from thyroid_detection.pipline.prediction_pipeline import THYROID_INPUT_COLUMNS
+        verify_dataframe = pd.read_csv(args.verify_csv)[THYROID_INPUT_COLUMNS]
+
+    migrate_model_file(args.from_file_path, args.to_file_path, verify_dataframe=verify_dataframe)
+    print(f"Migrated {args.from_file_path} to {args.to_file_path}")
+
+
+if __name__ == '__main__':
+    main()
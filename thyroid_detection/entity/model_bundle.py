@@ -0,0 +1,164 @@
+"""
+Standalone model bundle export.
+
+A bundle is a directory that scores raw input records with NumPy only, for sidecars that
+cannot afford sklearn, pandas or boto3:
+
+    thyroid_bundle.py   runtime module, a verbatim copy of thyroid_detection/entity/bundle_runtime.py
+    manifest.json       feature names, class labels and the parameters of the encoder and predictor
+    arrays.npz          the arrays of the compiled encoder and predictor
+
+    python -m thyroid_detection.entity.model_bundle model.pkl bundle_dir --verify-csv test.csv
+"""
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+from typing import Dict, List
+
+import numpy as np
+
+from thyroid_detection.entity import bundle_runtime
+from thyroid_detection.entity.compiled_encoder import CompiledFeatureEncoder
+from thyroid_detection.entity.estimator import TargetValueMapping, thyroidModel
+from thyroid_detection.entity.model_artifact import get_encoder_state, get_predictor_state, load_model_file
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+
+BUNDLE_RUNTIME_MODULE_NAME = "thyroid_bundle"
+
+
+def export_model_bundle(bundle_dir: str, model: thyroidModel) -> str:
+    """
+    Write model as a standalone bundle in bundle_dir, replacing any bundle already there;
+    the model needs a compiled encoder and a compiled predictor
+    :return: bundle_dir
+    """
+    logging.info("Entered the export_model_bundle method of model_bundle")
+
+    try:
+        encoder = model.get_compiled_encoder()
+        predictor = getattr(model, "compiled_model", None)
+        if encoder is None or predictor is None:
+            raise ValueError("Only models with a compiled encoder and a compiled predictor can be exported as bundles")
+
+        encoder_params, encoder_arrays = get_encoder_state(encoder)
+        predictor_params, predictor_arrays = get_predictor_state(predictor)
+        arrays: Dict[str, np.ndarray] = {}
+        for prefix, component_arrays in (("encoder", encoder_arrays), ("predictor", predictor_arrays)):
+            for name, array in component_arrays.items():
+                if np.asarray(array).dtype.hasobject:
+                    raise ValueError(f"Array {prefix}.{name} has object dtype and cannot be stored without pickle")
+                arrays[f"{prefix}.{name}"] = np.ascontiguousarray(array)
+
+        manifest = {
+            "format_version": bundle_runtime.BUNDLE_FORMAT_VERSION,
+            "input_features": encoder.numerical_features + encoder.categorical_features,
+            "class_labels": {str(code): label for code, label in TargetValueMapping().reverse_mapping().items()},
+            "encoder": {"params": encoder_params},
+            "predictor": {"type": type(predictor).__name__, "params": predictor_params},
+            "feature_reference": getattr(model, "feature_reference", None),
+        }
+
+        # Written next to the target and swapped in whole, so readers never see half a bundle
+        parent_dir = os.path.dirname(os.path.abspath(bundle_dir))
+        os.makedirs(parent_dir, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(dir=parent_dir, prefix=".bundle-")
+        try:
+            shutil.copyfile(bundle_runtime.__file__, os.path.join(staging_dir, BUNDLE_RUNTIME_MODULE_NAME + ".py"))
+            with open(os.path.join(staging_dir, bundle_runtime.MANIFEST_FILE_NAME), "w") as file_obj:
+                json.dump(manifest, file_obj, indent=2)
+            np.savez(os.path.join(staging_dir, bundle_runtime.ARRAYS_FILE_NAME), **arrays)
+            if os.path.isdir(bundle_dir):
+                shutil.rmtree(bundle_dir)
+            os.replace(staging_dir, bundle_dir)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        size = sum(os.path.getsize(os.path.join(bundle_dir, name)) for name in os.listdir(bundle_dir))
+        logging.info(f"Exported model bundle {bundle_dir}: {len(arrays)} arrays, {size} bytes")
+        return bundle_dir
+    except Exception as e:
+        raise ThyroidException(e, sys) from e
+
+
+def load_bundle_runtime(bundle_dir: str):
+    """
+    Import the runtime module shipped in bundle_dir, so checks run the exact code the bundle ships with
+    """
+    path = os.path.join(bundle_dir, BUNDLE_RUNTIME_MODULE_NAME + ".py")
+    spec = importlib.util.spec_from_file_location(BUNDLE_RUNTIME_MODULE_NAME, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def has_sklearn_reference(model: thyroidModel) -> bool:
+    """
+    True when model still holds its sklearn pipeline and estimator, i.e. it was trained in this
+    process or loaded from a pickle, not from a model artifact which only holds compiled code
+    """
+    return not isinstance(model.preprocessing_object, CompiledFeatureEncoder) and \
+        model.trained_model_object is not getattr(model, "compiled_model", None)
+
+
+def verify_model_bundle(bundle_dir: str, model: thyroidModel, dataframe) -> int:
+    """
+    Check that the bundle in bundle_dir predicts exactly like the original model, i.e. its
+    sklearn preprocessing pipeline and sklearn estimator, on the raw input rows of dataframe
+    :return: number of rows checked
+    """
+    try:
+        if not has_sklearn_reference(model):
+            raise ValueError("Bundle verification needs the sklearn pipeline and estimator as reference; "
+                             "a model loaded from a model artifact only holds the compiled code the bundle "
+                             "is exported from, verify with the pickled model.pkl instead")
+        records: List[dict] = dataframe.to_dict(orient="records")
+        expected = np.asarray(model.trained_model_object.predict(model.preprocessing_object.transform(dataframe)))
+        bundle = load_bundle_runtime(bundle_dir).load(bundle_dir)
+
+        for name, actual in (("predict_codes", bundle.predict_codes(records)),
+                             ("predict_columns", bundle.predictor.predict(bundle.encoder.transform_columns(
+                                 {column: dataframe[column].tolist() for column in bundle.input_features})))):
+            if actual.shape != expected.shape or not np.array_equal(actual, expected):
+                mismatches = int(np.sum(actual != expected)) if actual.shape == expected.shape else len(expected)
+                raise ValueError(f"Model bundle {name} differs from the original model on {mismatches} "
+                                 f"of {len(expected)} rows")
+        logging.info(f"Model bundle {bundle_dir} matches the original model on {len(records)} rows")
+        return len(records)
+    except Exception as e:
+        raise ThyroidException(e, sys) from e
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a trained model.pkl as a standalone NumPy-only bundle")
+    parser.add_argument('model_file_path', help="model artifact or pickled model.pkl")
+    parser.add_argument('bundle_dir')
+    parser.add_argument('--verify-csv', help="CSV of raw input rows to check the bundle predictions on, "
+                                             "needs a pickled model.pkl holding the sklearn pipeline and estimator")
+    args = parser.parse_args()
+
+    from thyroid_detection.entity.compiled_model import compile_estimator
+
+    model = load_model_file(args.model_file_path)
+    if args.verify_csv and not has_sklearn_reference(model):
+        parser.error(f"{args.model_file_path} is a model artifact without the sklearn pipeline and estimator "
+                     f"to verify against; export it without --verify-csv or verify with the pickled model.pkl")
+    if getattr(model, "compiled_model", None) is None:
+        model.compiled_model = compile_estimator(model.trained_model_object)
+    export_model_bundle(args.bundle_dir, model)
+
+    if args.verify_csv:
+        import pandas as pd
+        from thyroid_detection.pipline.prediction_pipeline import THYROID_INPUT_COLUMNS
+        rows = verify_model_bundle(args.bundle_dir, model, pd.read_csv(args.verify_csv)[THYROID_INPUT_COLUMNS])
+        print(f"Verified on {rows} rows")
+    print(f"Exported {args.model_file_path} to {args.bundle_dir}")
+
+
+if __name__ == '__main__':
+    main()
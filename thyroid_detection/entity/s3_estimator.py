@@ -1,7 +1,15 @@
-from thyroid_detection.cloud_storage.aws_storage import SimpleStorageService
+from thyroid_detection.cloud_storage.model_cache import LocalModelCache
 from thyroid_detection.exception import ThyroidException
 from thyroid_detection.entity.estimator import thyroidModel
+from thyroid_detection.constants import MODEL_RELOAD_INTERVAL_SECONDS
+from thyroid_detection.logger import logging
+from thyroid_detection.serving.metrics import MODEL_INFO, MODEL_LOAD_DURATION, MODEL_LOADS, REGISTRY
+import io
+import os
 import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
 from pandas import DataFrame
 
 
@@ -10,14 +18,22 @@ class thyroidEstimator:
     This class is used to save and retrieve us_visas model in s3 bucket and to do prediction
     """
 
-    def __init__(self,bucket_name,model_path,):
+    def __init__(self,bucket_name,model_path,model_cache:Optional[LocalModelCache]=None,version_id:Optional[str]=None):
         """
         :param bucket_name: Name of your model bucket
         :param model_path: Location of your model in bucket
+        :param version_id: S3 object version of the model to load, the latest version when None
+        :param model_cache: Local disk cache of downloaded models, by default configured from
+                            the MODEL_CACHE_DIR environment variable (empty disables it)
         """
+        # boto3 is only imported once a model is actually read from or written to S3
+        from thyroid_detection.cloud_storage.aws_storage import SimpleStorageService
+
         self.bucket_name = bucket_name
         self.s3 = SimpleStorageService()
         self.model_path = model_path
+        self.version_id = version_id
+        self.model_cache = model_cache if model_cache is not None else LocalModelCache.from_env()
         self.loaded_model:thyroidModel=None
 
 
@@ -28,13 +44,59 @@ class thyroidEstimator:
             print(e)
             return False
 
-    def load_model(self,)->thyroidModel:
+    def load_model(self,etag:Optional[str]=None)->thyroidModel:
         """
-        Load the model from the model_path
+        Load the model from the model_path, through the local model cache when enabled
+        :param etag: ETag of the model if already known, otherwise it is read with a HEAD request
         :return:
         """
+        if self.model_cache is None and self.version_id is None:
+            return self.s3.load_model(self.model_path,bucket_name=self.bucket_name)
+
+        try:
+            from thyroid_detection.entity.model_artifact import load_model_bytes, load_model_file
 
-        return self.s3.load_model(self.model_path,bucket_name=self.bucket_name)
+            download = lambda file_obj: self.s3.download_object(self.model_path, self.bucket_name, file_obj,
+                                                                version_id=self.version_id)
+            if self.model_cache is None:
+                body = io.BytesIO()
+                download(body)
+                return load_model_bytes(body.getvalue())
+
+            if etag is None:
+                etag = self.get_model_etag()
+            model_file_path = self.model_cache.get_or_download(self.bucket_name, self.model_path, etag,
+                                                               download=download)
+            return load_model_file(model_file_path)
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def get_model_file(self, download_dir: str) -> str:
+        """
+        Local path of the model file, for processes that load the model themselves: the cached
+        file when the local model cache is enabled, else a fresh download into download_dir
+        :return: path of the model file, in either model format
+        """
+        try:
+            download = lambda file_obj: self.s3.download_object(self.model_path, self.bucket_name, file_obj,
+                                                                version_id=self.version_id)
+            if self.model_cache is not None:
+                return self.model_cache.get_or_download(self.bucket_name, self.model_path, self.get_model_etag(),
+                                                        download=download)
+
+            model_file_path = os.path.join(download_dir, os.path.basename(self.model_path))
+            with open(model_file_path, "wb") as file_obj:
+                download(file_obj)
+            return model_file_path
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def get_model_etag(self) -> str:
+        """
+        Get the ETag of the model object stored at model_path
+        :return: ETag of the model object
+        """
+        return self.s3.get_object_etag(self.model_path, bucket_name=self.bucket_name, version_id=self.version_id)
 
     def save_model(self,from_file,remove:bool=False)->None:
         """
@@ -63,4 +125,175 @@ class thyroidEstimator:
                 self.loaded_model = self.load_model()
             return self.loaded_model.predict(dataframe=dataframe)
         except Exception as e:
-            raise ThyroidException(e, sys)
\ No newline at end of file
+            raise ThyroidException(e, sys)
+
+
+class ModelHolder:
+    """
+    Process-wide holder of the model stored at one bucket/model_path.
+
+    The model is downloaded once per process; concurrent cold loads wait on a
+    single download. After the first load a daemon thread compares the object's
+    ETag every refresh_interval seconds and swaps a changed model in atomically.
+    """
+
+    _holders: Dict[Tuple[str, str], "ModelHolder"] = {}
+    _holders_lock = threading.Lock()
+
+    def __init__(self, bucket_name: str, model_path: str,
+                 refresh_interval: float = MODEL_RELOAD_INTERVAL_SECONDS):
+        """
+        :param bucket_name: Name of your model bucket
+        :param model_path: Location of your model in bucket
+        :param refresh_interval: Seconds between ETag checks, 0 disables hot reload
+        """
+        self.bucket_name = bucket_name
+        self.model_path = model_path
+        self.refresh_interval = refresh_interval
+        self._estimator: Optional[thyroidEstimator] = None
+        self._state: Optional[Tuple[thyroidModel, str]] = None
+        self._load_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+
+    @classmethod
+    def get_instance(cls, bucket_name: str, model_path: str,
+                     refresh_interval: float = MODEL_RELOAD_INTERVAL_SECONDS) -> "ModelHolder":
+        """
+        Return the process-wide holder for bucket_name/model_path, creating it on first use
+        """
+        key = (bucket_name, model_path)
+        holder = cls._holders.get(key)
+        if holder is None:
+            with cls._holders_lock:
+                holder = cls._holders.get(key)
+                if holder is None:
+                    holder = cls(bucket_name=bucket_name, model_path=model_path,
+                                 refresh_interval=refresh_interval)
+                    cls._holders[key] = holder
+        return holder
+
+    @property
+    def estimator(self) -> thyroidEstimator:
+        if self._estimator is None:
+            self._estimator = thyroidEstimator(bucket_name=self.bucket_name, model_path=self.model_path)
+        return self._estimator
+
+    @property
+    def version(self) -> Optional[str]:
+        """
+        ETag of the currently loaded model, None before the first load
+        """
+        state = self._state
+        return None if state is None else state[1]
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._state is not None
+
+    def get_model(self) -> thyroidModel:
+        """
+        Return the loaded model, downloading it on the first call
+        """
+        try:
+            state = self._state
+            if state is None:
+                with self._load_lock:
+                    state = self._state
+                    if state is None:
+                        state = self._load()
+            if self._refresher is None:
+                self._start_refresher()
+            return state[0]
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def preload(self) -> thyroidModel:
+        """
+        Load the model without starting the background ETag checks, used by a
+        pre-fork master so that no thread is running when workers are forked
+        """
+        try:
+            with self._load_lock:
+                state = self._state if self._state is not None else self._load()
+            return state[0]
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def refresh(self) -> bool:
+        """
+        Reload the model if its ETag changed since the last load
+        :return: True if a new model was swapped in
+        """
+        try:
+            with self._load_lock:
+                state = self._state
+                if state is not None and self.estimator.get_model_etag() == state[1]:
+                    return False
+                self._load()
+                return True
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def stop(self) -> None:
+        """
+        Stop the background ETag checks
+        """
+        self._stop_event.set()
+
+    def _reset_after_fork(self) -> None:
+        # Locks, threads and S3 connections are not inherited usefully by a forked child,
+        # the loaded model itself is kept and shared copy-on-write with the parent
+        self._estimator = None
+        self._load_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresher = None
+
+    def _load(self) -> Tuple[thyroidModel, str]:
+        # The ETag is read before the body so a model pushed in between is picked up on the next check
+        logging.info(f"Loading model {self.model_path} from bucket {self.bucket_name}")
+        start = time.perf_counter()
+        etag = self.estimator.get_model_etag()
+        model = self.estimator.load_model(etag=etag)
+        state = (model, etag)
+        self._state = state
+        labels = (("model_path", self.model_path),)
+        REGISTRY.set_gauge(MODEL_LOAD_DURATION, time.perf_counter() - start, labels)
+        REGISTRY.inc_counter(MODEL_LOADS, labels)
+        logging.info(f"Loaded model {self.model_path} with ETag {etag}")
+        return state
+
+    def _start_refresher(self) -> None:
+        if self.refresh_interval <= 0:
+            return
+        with self._load_lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name="model-refresher", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self) -> None:
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                if self.refresh():
+                    logging.info(f"Hot reloaded model {self.model_path}, new ETag {self.version}")
+            except Exception as e:
+                logging.error(f"Model refresh failed, keeping current model: {e}")
+
+
+def _collect_model_metrics():
+    for holder in list(ModelHolder._holders.values()):
+        if holder.is_loaded:
+            yield MODEL_INFO, {"model_path": holder.model_path, "version": holder.version}, 1
+
+
+REGISTRY.register_collector(_collect_model_metrics)
+
+
+def _reset_model_holders_after_fork() -> None:
+    ModelHolder._holders_lock = threading.Lock()
+    for holder in ModelHolder._holders.values():
+        holder._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_model_holders_after_fork)
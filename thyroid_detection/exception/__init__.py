@@ -19,5 +19,16 @@ class ThyroidException(Exception):
             error_message, error_detail=error_detail
         )
 
+    def __reduce__(self):
+        # Rebuilt from the formatted message, e.g. when raised in a worker process of a pool
+        return _restore_exception, (type(self), self.error_message)
+
     def __str__(self):
         return self.error_message
+
+
+def _restore_exception(exception_class, error_message):
+    exception = exception_class.__new__(exception_class)
+    Exception.__init__(exception, error_message)
+    exception.error_message = error_message
+    return exception
@@ -9,15 +9,28 @@ LOG_FILE_NAME = f"{datetime.now().strftime('%m%d%Y__%H%M%S')}.log"
 #log directory
 LOG_FILE_DIR = os.path.join(os.getcwd(),"logs")
 
-#create folder if not available
-os.makedirs(LOG_FILE_DIR,exist_ok=True)
-
 #log file path
 
 LOG_FILE_PATH = os.path.join(LOG_FILE_DIR,LOG_FILE_NAME)
 
+
+class LazyFileHandler(logging.FileHandler):
+    """
+    File handler that creates the log folder and opens the log file on the first
+    record instead of at import time
+    """
+
+    def __init__(self, filename: str):
+        super().__init__(filename, delay=True)
+
+    def _open(self):
+        #create folder if not available
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
 logging.basicConfig(
-    filename=LOG_FILE_PATH,
+    handlers=[LazyFileHandler(LOG_FILE_PATH)],
     format="[ %(asctime)s ] %(lineno)d %(name)s - %(levelname)s - %(message)s",
     level=logging.INFO,
-)
\ No newline at end of file
+)
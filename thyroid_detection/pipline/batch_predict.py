@@ -0,0 +1,294 @@
+"""
+Bulk scoring of large CSV files with a pool of worker processes.
+
+The input is read in chunks of chunk_size lines. Each chunk is parsed, validated and predicted
+by a worker process that loads the model once, and the results are written in input order.
+At most max_pending_chunks_per_worker chunks per worker are in flight, so memory stays bounded
+whatever the size of the input. The output is a CSV, or an Arrow IPC stream for .arrow/.arrows
+paths, with one line per input row:
+
+    row          position of the row in the input, from 0
+    prediction   predicted class, empty (null in Arrow) for rows failing input validation
+    errors       field errors of the invalid rows as JSON, empty (null in Arrow) otherwise
+
+After every chunk the output is flushed and a checkpoint next to it records how far the input
+and output got, so that --resume after a crash truncates the output to the last checkpoint and
+carries on from there:
+
+    python -m thyroid_detection.pipline.batch_predict artifact/<timestamp>/data_ingestion/feature_store/hypothyroid.csv \\
+        predictions.csv --workers 8 --resume
+"""
+import argparse
+import collections
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from thyroid_detection.entity.config_entity import BatchPredictionConfig
+from thyroid_detection.entity.estimator import thyroidModel
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+from thyroid_detection.pipline.prediction_pipeline import THYROID_INPUT_COLUMNS, ThyroidClassifier, ThyroidData
+from thyroid_detection.serving.validation import RowErrors
+
+CSV_FORMAT = "csv"
+ARROW_FORMAT = "arrow"
+ARROW_FILE_EXTENSIONS = (".arrow", ".arrows")
+OUTPUT_FIELDS = ("row", "prediction", "errors")
+# End-of-stream marker of the Arrow IPC stream format
+ARROW_END_OF_STREAM = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+# Model of a worker process, loaded once by _init_worker
+_worker_model: Optional[thyroidModel] = None
+
+
+class CsvPredictionWriter:
+    def __init__(self, file_obj: BinaryIO):
+        self.file_obj = file_obj
+
+    def write_header(self) -> None:
+        self.file_obj.write((",".join(OUTPUT_FIELDS) + "\n").encode())
+
+    def write_chunk(self, first_row: int, labels: np.ndarray, errors: Dict[int, RowErrors]) -> None:
+        predictions, error_column = _output_columns(labels, errors, missing="")
+        buffer = io.StringIO()
+        pd.DataFrame({
+            "row": np.arange(first_row, first_row + len(labels)),
+            "prediction": predictions,
+            "errors": error_column,
+        }).to_csv(buffer, header=False, index=False)
+        self.file_obj.write(buffer.getvalue().encode())
+
+    def finish(self) -> None:
+        pass
+
+
+class ArrowPredictionWriter:
+    """
+    Writes the IPC stream one encapsulated message at a time, so a stream cut at a chunk
+    boundary can be appended to when resuming
+    """
+
+    def __init__(self, file_obj: BinaryIO):
+        from thyroid_detection.serving.batch_io import import_pyarrow
+
+        self.pa = import_pyarrow()
+        self.file_obj = file_obj
+        self.schema = self.pa.schema([("row", self.pa.int64()), ("prediction", self.pa.string()),
+                                      ("errors", self.pa.string())])
+
+    def write_header(self) -> None:
+        self.file_obj.write(self.schema.serialize().to_pybytes())
+
+    def write_chunk(self, first_row: int, labels: np.ndarray, errors: Dict[int, RowErrors]) -> None:
+        predictions, error_column = _output_columns(labels, errors, missing=None)
+        batch = self.pa.record_batch([
+            self.pa.array(np.arange(first_row, first_row + len(labels), dtype=np.int64)),
+            self.pa.array(predictions, type=self.pa.string()),
+            self.pa.array(error_column, type=self.pa.string()),
+        ], schema=self.schema)
+        self.file_obj.write(batch.serialize().to_pybytes())
+
+    def finish(self) -> None:
+        self.file_obj.write(ARROW_END_OF_STREAM)
+
+
+OUTPUT_WRITERS = {CSV_FORMAT: CsvPredictionWriter, ARROW_FORMAT: ArrowPredictionWriter}
+
+
+def predict_chunk(header: bytes, body: bytes) -> Tuple[np.ndarray, Dict[int, RowErrors]]:
+    """
+    Parse, validate and predict one chunk of CSV lines in a worker process
+    :return: one label per row (None for invalid rows) and the errors of the invalid rows
+    """
+    dataframe = pd.read_csv(io.BytesIO(header + body), usecols=THYROID_INPUT_COLUMNS)
+    batch = ThyroidData.validate_batch(dataframe)
+    valid_rows = batch.valid_rows()
+    labels = np.empty(0, dtype=object)
+    if len(valid_rows):
+        labels = ThyroidClassifier.map_predictions(_worker_model.predict(valid_rows))
+    return batch.expand(labels), batch.errors
+
+
+def run_batch_prediction(input_file_path: str, output_file_path: str,
+                         config: BatchPredictionConfig = BatchPredictionConfig(),
+                         output_format: Optional[str] = None, resume: bool = False,
+                         progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Score every row of the input_file_path CSV into output_file_path
+    :param output_format: csv or arrow, from the extension of output_file_path when None
+    :param resume: carry on from the checkpoint of an interrupted run, if there is one
+    :param progress: called with the progress report every config.progress_interval_seconds
+    :return: report of the run (rows, invalid rows, throughput)
+    """
+    logging.info("Entered the run_batch_prediction method of batch_predict")
+
+    try:
+        output_format = output_format or (ARROW_FORMAT if output_file_path.endswith(ARROW_FILE_EXTENSIONS)
+                                          else CSV_FORMAT)
+        if output_format not in OUTPUT_WRITERS:
+            raise ValueError(f"Unknown output format {output_format}, expected one of {sorted(OUTPUT_WRITERS)}")
+        checkpoint_path = output_file_path + config.checkpoint_suffix
+        input_size = os.path.getsize(input_file_path)
+        workers = config.workers or os.cpu_count() or 1
+
+        with open(input_file_path, "rb") as input_file, tempfile.TemporaryDirectory() as download_dir:
+            header = input_file.readline()
+            missing_columns = [column for column in THYROID_INPUT_COLUMNS
+                               if column not in next(csv.reader([header.decode()]), [])]
+            if missing_columns:
+                raise ValueError(f"Missing columns in {input_file_path}: {missing_columns}")
+
+            checkpoint = _read_checkpoint(checkpoint_path) if resume else None
+            if checkpoint is not None:
+                if (checkpoint["input_size"], checkpoint["output_format"]) != (input_size, output_format):
+                    raise ValueError(f"Checkpoint {checkpoint_path} was written for another input or output format")
+                output_file = open(output_file_path, "r+b")
+                output_file.truncate(checkpoint["output_offset"])
+                output_file.seek(checkpoint["output_offset"])
+                input_file.seek(checkpoint["input_offset"])
+                writer = OUTPUT_WRITERS[output_format](output_file)
+                logging.info(f"Resuming batch prediction of {input_file_path} from row {checkpoint['rows']}")
+            else:
+                output_file = open(output_file_path, "wb")
+                writer = OUTPUT_WRITERS[output_format](output_file)
+                writer.write_header()
+                checkpoint = {"input_size": input_size, "output_format": output_format,
+                              "input_offset": len(header), "output_offset": output_file.tell(),
+                              "rows": 0, "invalid_rows": 0}
+
+            report = {"input_file_path": input_file_path, "output_file_path": output_file_path,
+                      "workers": workers, "resumed_from_row": checkpoint["rows"]}
+            start = last_progress = time.perf_counter()
+            start_offset = checkpoint["input_offset"]
+
+            def update_report() -> dict:
+                seconds = time.perf_counter() - start
+                rows = checkpoint["rows"] - report["resumed_from_row"]
+                report.update(rows=checkpoint["rows"], invalid_rows=checkpoint["invalid_rows"],
+                              seconds=round(seconds, 3),
+                              rows_per_second=round(rows / seconds, 1) if seconds > 0 else None,
+                              input_mb_per_second=round((checkpoint["input_offset"] - start_offset) / 1e6 / seconds, 2)
+                              if seconds > 0 else None,
+                              progress_percent=round(100.0 * checkpoint["input_offset"] / max(input_size, 1), 1))
+                return report
+
+            with output_file:
+                model_file_path = _resolve_model_file(config, download_dir)
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                         initargs=(model_file_path,)) as pool:
+                    # Chunks are submitted ahead up to the bound and written strictly in input order
+                    pending = collections.deque()
+                    end_of_input = False
+                    while True:
+                        while not end_of_input and len(pending) < workers * config.max_pending_chunks_per_worker:
+                            lines = list(itertools.islice(input_file, config.chunk_size))
+                            if not lines:
+                                end_of_input = True
+                                break
+                            pending.append((input_file.tell(), pool.submit(predict_chunk, header, b"".join(lines))))
+                        if not pending:
+                            break
+
+                        input_offset, future = pending.popleft()
+                        labels, errors = future.result()
+                        writer.write_chunk(checkpoint["rows"], labels, errors)
+                        output_file.flush()
+                        os.fsync(output_file.fileno())
+                        checkpoint.update(input_offset=input_offset, output_offset=output_file.tell(),
+                                          rows=checkpoint["rows"] + len(labels),
+                                          invalid_rows=checkpoint["invalid_rows"] + len(errors))
+                        _write_checkpoint(checkpoint_path, checkpoint)
+
+                        if time.perf_counter() - last_progress >= config.progress_interval_seconds:
+                            last_progress = time.perf_counter()
+                            update_report()
+                            logging.info(f"Batch prediction progress: {report}")
+                            if progress is not None:
+                                progress(dict(report))
+
+                writer.finish()
+
+        os.remove(checkpoint_path)
+        update_report()
+        logging.info(f"Batch prediction done: {report}")
+        return report
+    except Exception as e:
+        raise ThyroidException(e, sys) from e
+
+
+def _init_worker(model_file_path: str) -> None:
+    from thyroid_detection.entity.model_artifact import load_model_file
+
+    global _worker_model
+    _worker_model = load_model_file(model_file_path)
+
+
+def _resolve_model_file(config: BatchPredictionConfig, download_dir: str) -> str:
+    if config.model_file_path is not None:
+        return config.model_file_path
+    from thyroid_detection.entity.s3_estimator import thyroidEstimator
+
+    # Downloaded once here, the workers then load the local file
+    return thyroidEstimator(bucket_name=config.model_bucket_name,
+                            model_path=config.model_s3_key_path).get_model_file(download_dir)
+
+
+def _output_columns(labels: np.ndarray, errors: Dict[int, RowErrors], missing: Optional[str]):
+    predictions = np.asarray(labels, dtype=object)
+    error_column = np.full(len(predictions), missing, dtype=object)
+    if errors:
+        predictions = predictions.copy()
+        predictions[list(errors)] = missing
+        for position, row_errors in errors.items():
+            error_column[position] = json.dumps(row_errors)
+    return predictions, error_column
+
+
+def _read_checkpoint(checkpoint_path: str) -> Optional[dict]:
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as file_obj:
+        return json.load(file_obj)
+
+
+def _write_checkpoint(checkpoint_path: str, checkpoint: dict) -> None:
+    # Written to a temporary name and renamed, a crash never leaves a partial checkpoint
+    temp_path = checkpoint_path + ".tmp"
+    with open(temp_path, "w") as file_obj:
+        json.dump(checkpoint, file_obj)
+        file_obj.flush()
+        os.fsync(file_obj.fileno())
+    os.replace(temp_path, checkpoint_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a large CSV of thyroid records with a pool of worker processes")
+    parser.add_argument('input_file_path')
+    parser.add_argument('output_file_path', help="CSV, or Arrow IPC stream for .arrow/.arrows paths")
+    parser.add_argument('--model-file', help="local model file, by default the model is read from S3")
+    parser.add_argument('--chunk-size', type=int, default=BatchPredictionConfig.chunk_size)
+    parser.add_argument('--workers', type=int, help="worker processes, one per CPU by default")
+    parser.add_argument('--format', choices=sorted(OUTPUT_WRITERS), help="output format, from the extension by default")
+    parser.add_argument('--resume', action='store_true', help="carry on from the checkpoint of an interrupted run")
+    args = parser.parse_args()
+
+    config = BatchPredictionConfig(model_file_path=args.model_file, chunk_size=args.chunk_size, workers=args.workers)
+    report = run_batch_prediction(args.input_file_path, args.output_file_path, config,
+                                  output_format=args.format, resume=args.resume,
+                                  progress=lambda report: print(json.dumps(report), file=sys.stderr, flush=True))
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""
+In-database batch scoring of the thyroid_data MongoDB collection.
+
+The collection is read in _id order with a server-side cursor, batch_size documents at a time.
+Each batch is validated and predicted in one vectorized call, and its predictions are upserted
+with one unordered bulk_write into the predictions collection, one document per input document
+under the same _id:
+
+    {"_id": ..., "prediction": "negative", "errors": null, "model_path": ..., "model_version": ...,
+     "scored_at": ...}
+
+Up to max_batches_in_flight batches are predicted and written concurrently while the cursor
+fetches the next ones. Upserts make a rerun (e.g. after a model push) rescore in place.
+
+    python -m thyroid_detection.pipline.collection_predict --mongodb-url mongodb://localhost:27017
+"""
+import argparse
+import collections
+import json
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Deque, Dict, Iterator, List, Optional
+
+import numpy as np
+from pandas import DataFrame
+from pymongo import ReplaceOne
+
+from thyroid_detection.entity.config_entity import CollectionPredictionConfig
+from thyroid_detection.entity.estimator import thyroidModel
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+from thyroid_detection.pipline.prediction_pipeline import THYROID_INPUT_COLUMNS, ThyroidClassifier, ThyroidData
+
+# Counters of a batch and of a run
+BATCH_COUNTERS = ("rows", "invalid_rows", "upserted", "modified")
+# Fields read from the input documents
+INPUT_PROJECTION: Dict[str, int] = {column: 1 for column in THYROID_INPUT_COLUMNS}
+
+
+class CollectionBatchPredictor:
+    """
+    Class Name :   CollectionBatchPredictor
+    Description :   Scores every document of a MongoDB collection with the trained model and
+                    upserts the predictions into a predictions collection keyed by the _id of
+                    the scored documents, reading, predicting and writing in batches with
+                    several batches in flight at once.
+
+    Output      :   Predictions collection and a report of the run
+    On Failure  :   Write an exception log and then raise an exception
+    """
+
+    def __init__(self, config: CollectionPredictionConfig = CollectionPredictionConfig(), client=None):
+        """
+        :param config: collections, batch sizes and model of the run
+        :param client: pymongo style client, by default the pooled MongoDBClient.client
+        """
+        try:
+            if client is None:
+                from thyroid_detection.configuration.mongo_db_connection import MongoDBClient
+                client = MongoDBClient(database_name=config.database_name).client
+            self.config = config
+            self.database = client[config.database_name]
+            self.collection = self.database[config.collection_name]
+            self.predictions_collection = self.database[config.predictions_collection_name]
+            self.model: Optional[thyroidModel] = None
+            self.model_path: Optional[str] = None
+            self.model_version: Optional[str] = None
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def load_model(self) -> thyroidModel:
+        """
+        Method Name :   load_model
+        Description :   This method loads the model from config.model_file_path, or else from S3
+                        and records its S3 ETag as the model version
+
+        Output      :   Loaded model
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            if self.config.model_file_path is not None:
+                from thyroid_detection.entity.model_artifact import load_model_file
+                self.model = load_model_file(self.config.model_file_path)
+                self.model_path, self.model_version = self.config.model_file_path, None
+            else:
+                from thyroid_detection.entity.s3_estimator import thyroidEstimator
+                estimator = thyroidEstimator(bucket_name=self.config.model_bucket_name,
+                                             model_path=self.config.model_s3_key_path)
+                self.model_version = estimator.get_model_etag()
+                self.model = estimator.load_model(etag=self.model_version)
+                self.model_path = self.config.model_s3_key_path
+            return self.model
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def score_batch(self, documents: List[dict], session=None) -> Dict[str, int]:
+        """
+        Method Name :   score_batch
+        Description :   This method predicts a batch of input documents and upserts their
+                        predictions; invalid documents get a null prediction and their errors.
+                        With a session the upserts are part of its transaction
+
+        Output      :   Counts of rows, invalid rows, upserted and modified prediction documents
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            dataframe = DataFrame.from_records(documents, columns=["_id"] + THYROID_INPUT_COLUMNS)
+            ids = dataframe.pop("_id").tolist()
+            # Missing values are stored as "na", as in the data ingestion export
+            dataframe = dataframe.replace({"na": np.nan})
+
+            batch = ThyroidData.validate_batch(dataframe)
+            valid_rows = batch.valid_rows()
+            labels = np.empty(0, dtype=object)
+            if len(valid_rows):
+                labels = ThyroidClassifier.map_predictions(self.model.predict(valid_rows))
+            labels = batch.expand(labels)
+
+            scored_at = datetime.now(timezone.utc)
+            operations = [
+                ReplaceOne({"_id": document_id}, {
+                    "prediction": label,
+                    "errors": batch.errors.get(position),
+                    "model_path": self.model_path,
+                    "model_version": self.model_version,
+                    "scored_at": scored_at,
+                }, upsert=True)
+                for position, (document_id, label) in enumerate(zip(ids, labels.tolist()))
+            ]
+            result = self.predictions_collection.bulk_write(operations, ordered=False, session=session)
+            return {"rows": len(ids), "invalid_rows": batch.invalid_count,
+                    "upserted": result.upserted_count, "modified": result.modified_count}
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def initiate_collection_prediction(self, query: Optional[dict] = None) -> dict:
+        """
+        Method Name :   initiate_collection_prediction
+        Description :   This method scores every document of the collection matching query,
+                        in _id order
+
+        Output      :   Report of the run (counters, throughput and model)
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        logging.info("Entered initiate_collection_prediction method of CollectionBatchPredictor class")
+
+        try:
+            if self.model is None:
+                self.load_model()
+
+            report = dict.fromkeys(BATCH_COUNTERS, 0)
+            start = time.perf_counter()
+            cursor = self.collection.find(query or {}, projection=INPUT_PROJECTION, sort=[("_id", 1)],
+                                          batch_size=self.config.batch_size)
+            pending: Deque[Future] = collections.deque()
+
+            def collect(future: Future) -> None:
+                for name, count in future.result().items():
+                    report[name] += count
+
+            # The cursor fetches the next batch while earlier ones are predicted and written
+            with ThreadPoolExecutor(max_workers=self.config.max_batches_in_flight,
+                                    thread_name_prefix="collection-predict") as executor:
+                try:
+                    for documents in _iter_batches(cursor, self.config.batch_size):
+                        while len(pending) >= self.config.max_batches_in_flight:
+                            collect(pending.popleft())
+                        pending.append(executor.submit(self.score_batch, documents))
+                    while pending:
+                        collect(pending.popleft())
+                finally:
+                    cursor.close()
+                    for future in pending:
+                        future.cancel()
+
+            seconds = time.perf_counter() - start
+            report.update(collection=self.config.collection_name,
+                          predictions_collection=self.config.predictions_collection_name,
+                          model_path=self.model_path, model_version=self.model_version,
+                          seconds=round(seconds, 3),
+                          rows_per_second=round(report["rows"] / seconds, 1) if seconds > 0 else None)
+            logging.info(f"Scored collection {self.config.collection_name}: {report}")
+            return report
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+
+def _iter_batches(cursor, batch_size: int) -> Iterator[List[dict]]:
+    documents = []
+    for document in cursor:
+        documents.append(document)
+        if len(documents) == batch_size:
+            yield documents
+            documents = []
+    if documents:
+        yield documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score the thyroid_data MongoDB collection and upsert the predictions")
+    parser.add_argument('--mongodb-url', help="e.g. mongodb://localhost:27017, by default the MONGODB_URL client")
+    parser.add_argument('--database', default=CollectionPredictionConfig.database_name)
+    parser.add_argument('--collection', default=CollectionPredictionConfig.collection_name)
+    parser.add_argument('--predictions-collection', default=CollectionPredictionConfig.predictions_collection_name)
+    parser.add_argument('--query', type=json.loads, help="JSON filter of the documents to score")
+    parser.add_argument('--model-file', help="local model file, by default the model is read from S3")
+    parser.add_argument('--batch-size', type=int, default=CollectionPredictionConfig.batch_size)
+    parser.add_argument('--max-batches-in-flight', type=int, default=CollectionPredictionConfig.max_batches_in_flight)
+    args = parser.parse_args()
+
+    client = None
+    if args.mongodb_url:
+        import pymongo
+        client = pymongo.MongoClient(args.mongodb_url)
+
+    config = CollectionPredictionConfig(database_name=args.database, collection_name=args.collection,
+                                        predictions_collection_name=args.predictions_collection,
+                                        batch_size=args.batch_size, max_batches_in_flight=args.max_batches_in_flight,
+                                        model_file_path=args.model_file)
+    report = CollectionBatchPredictor(config, client=client).initiate_collection_prediction(query=args.query)
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
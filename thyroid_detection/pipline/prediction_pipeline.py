@@ -1,13 +1,44 @@
 import os
 import sys
 import numpy as np
-import pandas as pd
 from thyroid_detection.entity.config_entity import ThyroidPredictorConfig
-from thyroid_detection.entity.s3_estimator import thyroidEstimator
+from thyroid_detection.entity.s3_estimator import ModelHolder
+from thyroid_detection.serving.audit_log import PredictionAuditLog
+from thyroid_detection.serving.batch_io import columnar_to_dataframe
+from thyroid_detection.serving.drift import FeatureDriftMonitor
+from thyroid_detection.serving.micro_batcher import PredictionCoalescer
+from thyroid_detection.serving.prediction_cache import PredictionCache
+from thyroid_detection.serving.validation import BatchValidation, InputValidationError, get_input_validator
+from thyroid_detection.serving.metrics import (CACHE_STAT_METRICS, DRIFT_PSI, DRIFT_ROWS, FALLBACK_ACTIVE, REGISTRY,
+                                               stage_timer)
+from thyroid_detection.serving.model_tiers import FALLBACK_TIER, PRIMARY_TIER, ModelTierSelector
+from thyroid_detection.serving.model_pool import ModelPool, ModelVersionNotFound
 from thyroid_detection.exception import ThyroidException
 from thyroid_detection.logger import logging
-from thyroid_detection.utils.main_utils import read_yaml_file
 from pandas import DataFrame
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+# Raw input columns of the prediction pipeline, in the order used to build the input DataFrame
+THYROID_INPUT_COLUMNS: List[str] = [
+    "age", "sex", "on_thyroxine", "query_on_thyroxine", "on_antithyroid_medication", "sick",
+    "pregnant", "I131_treatment", "tumor", "hypopituitary", "psych",
+    "TSH", "T3", "TT4", "T4U", "FTI",
+]
+THYROID_NUMERICAL_COLUMNS: List[str] = ["age", "TSH", "T3", "TT4", "T4U", "FTI"]
+THYROID_CATEGORICAL_COLUMNS: List[str] = [column for column in THYROID_INPUT_COLUMNS
+                                          if column not in THYROID_NUMERICAL_COLUMNS]
+
+# Map numerical predictions to their respective classes
+TARGET_MAPPING = {
+    0: 'negative',
+    1: 'compensated_hypothyroid',
+    2: 'primary_hypothyroid',
+    3: 'secondary_hypothyroid'
+}
+UNKNOWN_LABEL = "Unknown"
+_TARGET_LABELS = np.array([TARGET_MAPPING[code] for code in sorted(TARGET_MAPPING)], dtype=object)
 
 
 class ThyroidData:
@@ -40,6 +71,20 @@ class ThyroidData:
         except Exception as e:
             raise ThyroidException(e, sys) from e
 
+    @classmethod
+    def from_dict(cls, data: dict) -> "ThyroidData":
+        """
+        This function builds ThyroidData from a form or JSON dict of raw field values, checked
+        against the input_validation rules of the schema; missing lab values become NaN
+        :raises InputValidationError: with the errors of every invalid field
+        """
+        try:
+            return cls(**get_input_validator().validate_record(data))
+        except InputValidationError:
+            raise
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
     def get_thyroid_input_data_frame(self) -> DataFrame:
         """
         This function returns a DataFrame from ThyroidData class input
@@ -51,6 +96,35 @@ class ThyroidData:
         except Exception as e:
             raise ThyroidException(e, sys)
 
+    @staticmethod
+    def validate_batch(records: Union[list, DataFrame]) -> BatchValidation:
+        """
+        This function checks a batch of records, given either as a list of dicts keyed by feature
+        name or as an already parsed DataFrame (e.g. from a CSV body), one column at a time.
+        Invalid rows are reported in the errors of the result instead of failing the batch, and
+        numeric columns decoded from a binary columnar body are not copied
+        :raises InputValidationError: when the batch lacks input columns
+        """
+        try:
+            return get_input_validator().validate_batch(records, columns=THYROID_INPUT_COLUMNS)
+        except InputValidationError:
+            raise
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    @staticmethod
+    def get_thyroid_batch_data_frame(records: Union[list, DataFrame]) -> DataFrame:
+        """
+        This function returns one DataFrame for a batch of records, as validate_batch checks them
+        :raises InputValidationError: when any row is invalid
+        """
+        batch = ThyroidData.validate_batch(records)
+        if batch.errors:
+            position, errors = next(iter(batch.errors.items()))
+            raise InputValidationError(f"{batch.invalid_count} invalid rows in batch input, "
+                                       f"first at row {position}: {errors}", errors)
+        return batch.dataframe
+
     def get_thyroid_data_as_dict(self):
         """
         This function returns a dictionary from ThyroidData class input
@@ -86,42 +160,289 @@ class ThyroidData:
             raise ThyroidException(e, sys)
 
 class ThyroidClassifier:
+    # Process-wide helpers (coalescers, cache, tier selector, drift monitor) per model, shared by all ThyroidClassifier instances
+    _shared: Dict[Tuple[str, str, str], object] = {}
+    _shared_lock = threading.Lock()
+
     def __init__(self, prediction_pipeline_config: ThyroidPredictorConfig = ThyroidPredictorConfig()) -> None:
         """
         :param prediction_pipeline_config: Configuration for prediction the value
         """
         try:
             self.prediction_pipeline_config = prediction_pipeline_config
+            self.model_holder = ModelHolder.get_instance(
+                bucket_name=prediction_pipeline_config.model_bucket_name,
+                model_path=prediction_pipeline_config.model_file_path,
+                refresh_interval=prediction_pipeline_config.model_reload_interval_seconds,
+            )
+            self.coalescer: Optional[PredictionCoalescer] = None
+            if prediction_pipeline_config.coalesce_predictions:
+                self.coalescer = self._get_shared("coalescer", lambda: PredictionCoalescer(
+                    predict_fn=self._predict_codes,
+                    max_batch_size=prediction_pipeline_config.coalesce_max_batch_size,
+                    max_wait_ms=prediction_pipeline_config.coalesce_max_wait_ms,
+                ))
+            self.prediction_cache: Optional[PredictionCache] = None
+            if prediction_pipeline_config.prediction_cache_enabled:
+                self.prediction_cache = self._get_shared("prediction_cache", lambda: PredictionCache(
+                    feature_names=THYROID_INPUT_COLUMNS,
+                    numerical_features=THYROID_NUMERICAL_COLUMNS,
+                    max_size=prediction_pipeline_config.prediction_cache_max_size,
+                    ttl_seconds=prediction_pipeline_config.prediction_cache_ttl_seconds,
+                    rounding=prediction_pipeline_config.prediction_cache_rounding,
+                ))
+            self.model_pool: Optional[ModelPool] = None
+            if prediction_pipeline_config.model_version:
+                self.model_pool = ModelPool.get_instance()
+            self.audit_log: Optional[PredictionAuditLog] = PredictionAuditLog.get_instance()
+            self.drift_monitor: Optional[FeatureDriftMonitor] = None
+            if prediction_pipeline_config.drift_monitoring_enabled:
+                self.drift_monitor = self._get_shared("drift_monitor", lambda: FeatureDriftMonitor(
+                    numerical_features=THYROID_NUMERICAL_COLUMNS,
+                    categorical_features=THYROID_CATEGORICAL_COLUMNS,
+                ))
+            self.fallback_holder: Optional[ModelHolder] = None
+            self.fallback_coalescer: Optional[PredictionCoalescer] = None
+            self.tier_selector: Optional[ModelTierSelector] = None
+            if prediction_pipeline_config.fallback_enabled:
+                self.fallback_holder = ModelHolder.get_instance(
+                    bucket_name=prediction_pipeline_config.model_bucket_name,
+                    model_path=prediction_pipeline_config.fallback_model_file_path,
+                    refresh_interval=prediction_pipeline_config.model_reload_interval_seconds,
+                )
+                if self.coalescer is not None:
+                    self.fallback_coalescer = self._get_shared("fallback_coalescer", lambda: PredictionCoalescer(
+                        predict_fn=self._predict_fallback_codes,
+                        max_batch_size=prediction_pipeline_config.coalesce_max_batch_size,
+                        max_wait_ms=prediction_pipeline_config.coalesce_max_wait_ms,
+                    ))
+                self.tier_selector = self._get_shared("tier_selector", lambda: ModelTierSelector(
+                    queue_depth_threshold=prediction_pipeline_config.fallback_queue_depth_threshold,
+                    p95_ms_threshold=prediction_pipeline_config.fallback_p95_ms_threshold,
+                    queue_depth_sources=[] if self.coalescer is None else [self.coalescer.queue_depth],
+                ))
         except Exception as e:
             raise ThyroidException(e, sys)
 
     def predict(self, dataframe) -> list:
         """
         This is the method of ThyroidClassifier
+        Input: a DataFrame, or columnar data (NumPy structured array, dict of column arrays,
+               pyarrow Table or RecordBatch) with the THYROID_INPUT_COLUMNS fields
         Returns: Prediction in list format
         """
         try:
             logging.info("Entered predict method of ThyroidClassifier class")
-            model = thyroidEstimator(
-                bucket_name=self.prediction_pipeline_config.model_bucket_name,
-                model_path=self.prediction_pipeline_config.model_file_path,
-            )
-            result = model.predict(dataframe)
+            if not isinstance(dataframe, DataFrame):
+                dataframe = ThyroidData.get_thyroid_batch_data_frame(columnar_to_dataframe(dataframe))
+            return self.predict_labels(dataframe).tolist()
 
-            if isinstance(result, np.ndarray):
-                result = result.tolist()  # Convert NumPy array to list
+        except (ModelVersionNotFound, InputValidationError):
+            raise
+        except Exception as e:
+            raise ThyroidException(e, sys)
 
-            # Map numerical predictions to their respective classes
-            target_mapping = {
-                0: 'negative',
-                1: 'compensated_hypothyroid',
-                2: 'primary_hypothyroid',
-                3: 'secondary_hypothyroid'
-            }
+    def predict_labels(self, dataframe: DataFrame) -> np.ndarray:
+        """
+        This is the method of ThyroidClassifier
+        Returns: Prediction labels as a NumPy object array, one per row of dataframe
+        """
+        return self.predict_labels_with_tier(dataframe)[0]
 
-            mapped_result = [target_mapping.get(pred, "Unknown") for pred in result]
+    def predict_labels_with_tier(self, dataframe: DataFrame, allow_fallback: bool = True) -> Tuple[np.ndarray, str]:
+        """
+        This is the method of ThyroidClassifier
+        Input: allow_fallback=False keeps the primary model whatever the load, e.g. for bulk batches
+        Returns: Prediction labels as a NumPy object array, one per row of dataframe, and the model
+                 tier that predicted them; the fallback model is used while the server is overloaded.
+                 A pinned model_version is always predicted by that version, from the model pool
+        """
+        try:
+            start = time.perf_counter()
+            labels, tier = self._predict_labels_with_tier(dataframe, start, allow_fallback)
+            # Drift sketches describe the inputs of the current model, pinned versions are left out
+            if self.drift_monitor is not None and self.model_pool is None:
+                self._update_drift_monitor(dataframe)
+            if self.audit_log is not None:
+                model_path, model_version = self._served_model(tier)
+                self.audit_log.record(dataframe, labels, model_path, model_version, tier,
+                                      time.perf_counter() - start)
+            return labels, tier
 
-            return mapped_result
+        except ModelVersionNotFound:
+            raise
+        except Exception as e:
+            raise ThyroidException(e, sys)
+
+    def _update_drift_monitor(self, dataframe: DataFrame) -> None:
+        # Drift monitoring only observes: a sketching failure is logged, the prediction is still served
+        try:
+            with stage_timer("drift_sketch"):
+                self.drift_monitor.update(dataframe)
+        except Exception as e:
+            logging.error(f"Drift sketch update failed, skipping {len(dataframe)} rows: {e}")
+
+    def _predict_labels_with_tier(self, dataframe: DataFrame, start: float,
+                                  allow_fallback: bool) -> Tuple[np.ndarray, str]:
+        if self.model_pool is not None:
+            return self._predict_labels(dataframe, self._predict_pinned_codes, store=False,
+                                        use_cache=False), PRIMARY_TIER
+        if self.tier_selector is None:
+            return self._predict_labels(dataframe, self._predict_codes_batched), PRIMARY_TIER
+
+        tier = self.tier_selector.select() if allow_fallback else PRIMARY_TIER
+        labels = None
+        if tier == FALLBACK_TIER:
+            try:
+                labels = self._predict_labels(dataframe, self._predict_fallback_codes_batched, store=False)
+            except Exception as e:
+                logging.error(f"Fallback model failed, serving the primary model: {e}")
+                self.tier_selector.fallback_failed()
+                tier = PRIMARY_TIER
+        if labels is None:
+            labels = self._predict_labels(dataframe, self._predict_codes_batched)
+        self.tier_selector.record(tier, time.perf_counter() - start, rows=len(dataframe))
+        return labels, tier
+
+    def _served_model(self, tier: str) -> Tuple[str, Optional[str]]:
+        """
+        Key and version of the model that served tier, for the audit log
+        """
+        config = self.prediction_pipeline_config
+        if self.model_pool is not None:
+            return config.model_file_path, config.model_version
+        holder = self.fallback_holder if tier == FALLBACK_TIER else self.model_holder
+        return holder.model_path, holder.version
+
+    def drift_report(self) -> dict:
+        """
+        This is the method of ThyroidClassifier
+        Returns: Drift report of the inputs predicted by this process against the feature reference
+                 of the current model, see FeatureDriftMonitor.report
+        """
+        try:
+            if self.drift_monitor is None:
+                raise ValueError("Drift monitoring is disabled")
+            reference = getattr(self.model_holder.get_model(), "feature_reference", None)
+            report = self.drift_monitor.report(reference)
+            report["model_version"] = self.model_holder.version
+            return report
 
         except Exception as e:
             raise ThyroidException(e, sys)
+
+    def cache_stats(self) -> Optional[Dict[str, int]]:
+        return None if self.prediction_cache is None else self.prediction_cache.stats()
+
+    def _predict_labels(self, dataframe: DataFrame, predict_codes: Callable[[DataFrame], np.ndarray],
+                        store: bool = True, use_cache: bool = True) -> np.ndarray:
+        if self.prediction_cache is not None and use_cache:
+            return self._predict_labels_cached(dataframe, predict_codes, store)
+        codes = predict_codes(dataframe)
+        with stage_timer("map_labels"):
+            return self.map_predictions(codes)
+
+    def _predict_labels_cached(self, dataframe: DataFrame, predict_codes: Callable[[DataFrame], np.ndarray],
+                               store: bool = True) -> np.ndarray:
+        # The version is read before predicting, so labels of a model swapped in meanwhile
+        # are stored under the old version and dropped on the next lookup. The cache holds
+        # primary model labels only: fallback predictions are served from it but never stored
+        self.model_holder.get_model()
+        model_version = self.model_holder.version
+        with stage_timer("cache_lookup"):
+            keys = self.prediction_cache.make_keys(dataframe)
+            labels = np.empty(len(keys), dtype=object)
+            misses = []
+            for position, key in enumerate(keys):
+                label = self.prediction_cache.get(key, model_version)
+                if label is None:
+                    misses.append(position)
+                else:
+                    labels[position] = label
+
+        if misses:
+            codes = predict_codes(dataframe.iloc[misses])
+            with stage_timer("map_labels"):
+                missed_labels = self.map_predictions(codes)
+            labels[misses] = missed_labels
+            if store:
+                for position, label in zip(misses, missed_labels):
+                    self.prediction_cache.put(keys[position], label, model_version)
+        return labels
+
+    def _predict_codes_batched(self, dataframe: DataFrame) -> np.ndarray:
+        if self.coalescer is not None and len(dataframe) < self.coalescer.max_batch_size:
+            return self.coalescer.submit(dataframe)
+        return self._predict_codes(dataframe)
+
+    def _predict_codes(self, dataframe: DataFrame) -> np.ndarray:
+        return self.model_holder.get_model().predict(dataframe)
+
+    def _predict_pinned_codes(self, dataframe: DataFrame) -> np.ndarray:
+        config = self.prediction_pipeline_config
+        model = self.model_pool.get_model(config.model_bucket_name, config.model_file_path, config.model_version)
+        return model.predict(dataframe)
+
+    def _predict_fallback_codes_batched(self, dataframe: DataFrame) -> np.ndarray:
+        if self.fallback_coalescer is not None and len(dataframe) < self.fallback_coalescer.max_batch_size:
+            return self.fallback_coalescer.submit(dataframe)
+        return self._predict_fallback_codes(dataframe)
+
+    def _predict_fallback_codes(self, dataframe: DataFrame) -> np.ndarray:
+        return self.fallback_holder.get_model().predict(dataframe)
+
+    def _get_shared(self, kind: str, factory: Callable[[], object]) -> object:
+        key = (kind, self.model_holder.bucket_name, self.model_holder.model_path)
+        shared = ThyroidClassifier._shared.get(key)
+        if shared is None:
+            with ThyroidClassifier._shared_lock:
+                shared = ThyroidClassifier._shared.get(key)
+                if shared is None:
+                    shared = ThyroidClassifier._shared[key] = factory()
+        return shared
+
+    @staticmethod
+    def map_predictions(result) -> np.ndarray:
+        """
+        Map numerical predictions to their class labels with one vectorized lookup,
+        codes outside TARGET_MAPPING are mapped to UNKNOWN_LABEL
+        """
+        codes = np.asarray(result)
+        labels = np.full(codes.shape, UNKNOWN_LABEL, dtype=object)
+        if codes.size == 0 or codes.dtype.kind not in "biuf":
+            return labels
+
+        int_codes = np.nan_to_num(codes, nan=-1).astype(np.int64)
+        valid = (int_codes == codes) & (int_codes >= 0) & (int_codes < len(_TARGET_LABELS))
+        labels[valid] = _TARGET_LABELS[int_codes[valid]]
+        return labels
+
+
+def _collect_cache_metrics():
+    for (kind, bucket_name, model_path), shared in list(ThyroidClassifier._shared.items()):
+        if kind == "prediction_cache":
+            for stat, value in shared.stats().items():
+                yield CACHE_STAT_METRICS[stat], {"model_path": model_path}, value
+        elif kind == "tier_selector":
+            yield FALLBACK_ACTIVE, {"model_path": model_path}, int(shared.fallback_active)
+        elif kind == "drift_monitor":
+            yield DRIFT_ROWS, {"model_path": model_path}, shared.rows
+            holder = ModelHolder._holders.get((bucket_name, model_path))
+            reference = None
+            if holder is not None and holder.is_loaded:
+                reference = getattr(holder.get_model(), "feature_reference", None)
+            if reference:
+                for feature, psi in shared.feature_psi(reference).items():
+                    yield DRIFT_PSI, {"model_path": model_path, "feature": feature}, psi
+
+
+REGISTRY.register_collector(_collect_cache_metrics)
+
+
+def _reset_shared_after_fork() -> None:
+    # The coalescer threads, cache, selector and drift monitor locks of the parent are not usable in a forked child
+    ThyroidClassifier._shared = {}
+    ThyroidClassifier._shared_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_shared_after_fork)
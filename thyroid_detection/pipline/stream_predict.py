@@ -0,0 +1,250 @@
+"""
+Near-real-time scoring of the documents inserted into the thyroid_data MongoDB collection.
+
+A long-running worker follows the inserts, groups them in micro-batches of up to max_batch_size
+documents (waiting at most max_wait_ms for a batch to fill) and upserts their predictions in bulk
+into the predictions collection, exactly as collection_predict does for a whole collection.
+The model is cached by the process-wide ModelHolder, which hot reloads it when it changes in S3.
+
+Change stream mode, on replica sets and mongos: the worker follows a change stream of the
+inserts. The predictions of a batch and the resume token of its last event are written in one
+transaction, so after a restart the worker resumes right after the last batch it scored and
+every insert is scored exactly once.
+
+Poll mode, on standalone servers which have no change streams: documents with an _id greater
+than the last scored one are read in _id order. The predictions are upserted before the last _id
+is saved, so a crash in between only rescores that batch in place. This relies on _ids growing
+in insert order, as the ObjectIds created by the inserting clients do (to the second when
+several clients insert).
+
+Without saved progress the worker starts with the documents inserted from then on. Scored rows,
+lag and the time of the last write are exported as metrics, served at /metrics with --metrics-port:
+
+    python -m thyroid_detection.pipline.stream_predict --mongodb-url mongodb://localhost:27017 --metrics-port 9108
+"""
+import argparse
+import signal
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from bson import ObjectId
+
+from thyroid_detection.entity.config_entity import CollectionPredictionConfig, StreamPredictionConfig
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+from thyroid_detection.pipline.collection_predict import INPUT_PROJECTION, CollectionBatchPredictor
+from thyroid_detection.serving.metrics import (REGISTRY, STREAM_LAG, STREAM_LAST_SCORED, STREAM_ROWS,
+                                               start_metrics_server)
+
+AUTO_MODE = "auto"
+CHANGE_STREAM_MODE = "change_stream"
+POLL_MODE = "poll"
+STREAM_PREDICTION_MODES = (AUTO_MODE, CHANGE_STREAM_MODE, POLL_MODE)
+
+
+class StreamPredictionWorker:
+    """
+    Class Name :   StreamPredictionWorker
+    Description :   Scores the documents inserted into a MongoDB collection in micro-batches,
+                    following a change stream or polling new _ids, and upserts their predictions
+                    in bulk. Its progress (resume token or last _id) is saved in the state
+                    collection with every batch, so a restarted worker carries on where it stopped.
+
+    Output      :   Predictions collection, progress in the state collection, stream metrics
+    On Failure  :   Write an exception log and then raise an exception
+    """
+
+    def __init__(self, config: StreamPredictionConfig = StreamPredictionConfig(), client=None):
+        """
+        :param config: collections, batching, mode and model of the worker
+        :param client: pymongo style client, by default the pooled MongoDBClient.client
+        """
+        try:
+            if config.mode not in STREAM_PREDICTION_MODES:
+                raise ValueError(f"Unknown mode {config.mode}, expected one of {STREAM_PREDICTION_MODES}")
+            if client is None:
+                from thyroid_detection.configuration.mongo_db_connection import MongoDBClient
+                client = MongoDBClient(database_name=config.database_name).client
+            self.config = config
+            self.client = client
+            self.batch_predictor = CollectionBatchPredictor(CollectionPredictionConfig(
+                database_name=config.database_name,
+                collection_name=config.collection_name,
+                predictions_collection_name=config.predictions_collection_name,
+                batch_size=config.max_batch_size,
+                model_file_path=config.model_file_path,
+                model_bucket_name=config.model_bucket_name,
+                model_s3_key_path=config.model_s3_key_path,
+            ), client=client)
+            self.collection = self.batch_predictor.collection
+            self.state_collection = self.batch_predictor.database[config.state_collection_name]
+            # One progress document per input and predictions collection pair
+            self.state_id = f"{config.collection_name}:{config.predictions_collection_name}"
+            self.model_holder = None
+            self._stop_event = threading.Event()
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def stop(self) -> None:
+        """
+        Ask run() to return after the batch being scored; unscored events are left to the next run
+        """
+        self._stop_event.set()
+
+    def resolve_mode(self) -> str:
+        """
+        Method Name :   resolve_mode
+        Description :   This method picks the change stream mode on replica sets and mongos, which
+                        support change streams, and the poll mode on standalone servers
+
+        Output      :   change_stream or poll
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        if self.config.mode != AUTO_MODE:
+            return self.config.mode
+        try:
+            hello = self.client.admin.command("hello")
+            return CHANGE_STREAM_MODE if "setName" in hello or hello.get("msg") == "isdbgrid" else POLL_MODE
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def run(self) -> None:
+        """
+        Method Name :   run
+        Description :   This method scores the inserted documents until stop() is called
+
+        Output      :   None
+        On Failure  :   Write an exception log and then raise an exception
+        """
+        try:
+            mode = self.resolve_mode()
+            logging.info(f"Scoring inserts into {self.config.collection_name} in {mode} mode")
+            if mode == CHANGE_STREAM_MODE:
+                self._follow_change_stream()
+            else:
+                self._poll()
+            logging.info(f"Stopped scoring inserts into {self.config.collection_name}")
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def _follow_change_stream(self) -> None:
+        max_wait = self.config.max_wait_ms / 1000.0
+        resume_token = self._load_state().get("resume_token")
+        with self.collection.watch([{"$match": {"operationType": "insert"}}], resume_after=resume_token,
+                                   max_await_time_ms=self.config.max_wait_ms,
+                                   batch_size=self.config.max_batch_size) as stream:
+            changes: List[dict] = []
+            first_change_at = 0.0
+            while not self._stop_event.is_set():
+                change = stream.try_next()
+                if change is not None:
+                    if not changes:
+                        first_change_at = time.monotonic()
+                    changes.append(change)
+                # Scored when full, when the stream has nothing more for now, or after max_wait_ms
+                if changes and (change is None or len(changes) >= self.config.max_batch_size
+                                or time.monotonic() - first_change_at >= max_wait):
+                    self._score([change["fullDocument"] for change in changes],
+                                {"resume_token": changes[-1]["_id"]},
+                                inserted_at=changes[-1]["clusterTime"].time, mode=CHANGE_STREAM_MODE,
+                                transactional=True)
+                    changes = []
+
+    def _poll(self) -> None:
+        last_id = self._load_state().get("last_id")
+        if last_id is None:
+            newest = self.collection.find_one({}, projection={"_id": 1}, sort=[("_id", -1)])
+            if newest is not None:
+                last_id = newest["_id"]
+                self._save_state({"last_id": last_id})
+
+        while not self._stop_event.is_set():
+            documents = list(self.collection.find({} if last_id is None else {"_id": {"$gt": last_id}},
+                                                  projection=INPUT_PROJECTION, sort=[("_id", 1)],
+                                                  limit=self.config.max_batch_size))
+            if not documents:
+                self._stop_event.wait(self.config.poll_interval_seconds)
+                continue
+            last_id = documents[-1]["_id"]
+            inserted_at = last_id.generation_time.timestamp() if isinstance(last_id, ObjectId) else time.time()
+            self._score(documents, {"last_id": last_id}, inserted_at=inserted_at, mode=POLL_MODE,
+                        transactional=False)
+
+    def _score(self, documents: List[dict], progress: dict, inserted_at: float, mode: str,
+               transactional: bool) -> None:
+        self._refresh_model()
+        if transactional:
+            with self.client.start_session() as session:
+                counts = session.with_transaction(lambda session: self._write_batch(documents, progress, session))
+        else:
+            counts = self._write_batch(documents, progress)
+
+        now = time.time()
+        REGISTRY.add_to_gauge(STREAM_ROWS, counts["rows"], (("mode", mode),))
+        REGISTRY.set_gauge(STREAM_LAG, max(0.0, now - inserted_at))
+        REGISTRY.set_gauge(STREAM_LAST_SCORED, now)
+        logging.info(f"Scored {counts['rows']} inserted documents ({counts['invalid_rows']} invalid)")
+
+    def _write_batch(self, documents: List[dict], progress: dict, session=None) -> Dict[str, int]:
+        counts = self.batch_predictor.score_batch(documents, session=session)
+        self._save_state(progress, session=session)
+        return counts
+
+    def _refresh_model(self) -> None:
+        # A local model is loaded once, an S3 model is cached and hot reloaded by its ModelHolder
+        if self.config.model_file_path is not None:
+            if self.batch_predictor.model is None:
+                self.batch_predictor.load_model()
+            return
+        if self.model_holder is None:
+            from thyroid_detection.entity.s3_estimator import ModelHolder
+            self.model_holder = ModelHolder.get_instance(self.config.model_bucket_name, self.config.model_s3_key_path,
+                                                         self.config.model_reload_interval_seconds)
+        self.batch_predictor.model = self.model_holder.get_model()
+        self.batch_predictor.model_path = self.config.model_s3_key_path
+        self.batch_predictor.model_version = self.model_holder.version
+
+    def _load_state(self) -> dict:
+        return self.state_collection.find_one({"_id": self.state_id}) or {}
+
+    def _save_state(self, progress: dict, session=None) -> None:
+        self.state_collection.update_one({"_id": self.state_id},
+                                         {"$set": dict(progress, updated_at=datetime.now(timezone.utc))},
+                                         upsert=True, session=session)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score the documents inserted into the thyroid_data MongoDB collection")
+    parser.add_argument('--mongodb-url', help="e.g. mongodb://localhost:27017, by default the MONGODB_URL client")
+    parser.add_argument('--database', default=StreamPredictionConfig.database_name)
+    parser.add_argument('--collection', default=StreamPredictionConfig.collection_name)
+    parser.add_argument('--predictions-collection', default=StreamPredictionConfig.predictions_collection_name)
+    parser.add_argument('--mode', choices=STREAM_PREDICTION_MODES, default=StreamPredictionConfig.mode)
+    parser.add_argument('--model-file', help="local model file, by default the model is read from S3")
+    parser.add_argument('--max-batch-size', type=int, default=StreamPredictionConfig.max_batch_size)
+    parser.add_argument('--max-wait-ms', type=int, default=StreamPredictionConfig.max_wait_ms)
+    parser.add_argument('--metrics-port', type=int, help="serve the metrics at /metrics on this port")
+    args = parser.parse_args()
+
+    client = None
+    if args.mongodb_url:
+        import pymongo
+        client = pymongo.MongoClient(args.mongodb_url)
+
+    config = StreamPredictionConfig(database_name=args.database, collection_name=args.collection,
+                                    predictions_collection_name=args.predictions_collection, mode=args.mode,
+                                    model_file_path=args.model_file, max_batch_size=args.max_batch_size,
+                                    max_wait_ms=args.max_wait_ms)
+    worker = StreamPredictionWorker(config, client=client)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: worker.stop())
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()
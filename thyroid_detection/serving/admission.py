@@ -0,0 +1,186 @@
+import math
+import sys
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from thyroid_detection.constants import (ADMISSION_DEFAULT_DEADLINE_MS, ADMISSION_MAX_IN_FLIGHT,
+                                         ADMISSION_MAX_QUEUE_DEPTH)
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.serving.metrics import (ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT,
+                                               ADMISSION_SHED, REGISTRY)
+
+# Weight of the latest request in the moving average of service time
+SERVICE_TIME_SMOOTHING: float = 0.2
+
+
+class RequestShed(Exception):
+    """
+    Raised when a request is refused to protect the latency of the admitted ones
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Server overloaded ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """
+    A request admitted to the queue; entering it waits for an execution slot and exiting it frees the slot
+    """
+
+    def __init__(self, controller: "AdmissionController", deadline: float):
+        self.controller = controller
+        self.deadline = deadline
+        self.queued_at = time.monotonic()
+        self._started_at: Optional[float] = None
+        self._queued = True
+
+    def __enter__(self) -> "AdmissionTicket":
+        self.controller._enter(self)
+        self._started_at = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.controller._exit(time.monotonic() - self._started_at)
+
+    def run(self, func: Callable, *args):
+        """
+        Run func(*args) in an execution slot, e.g. from an inference thread pool
+        """
+        with self:
+            return func(*args)
+
+    def cancel(self) -> None:
+        """
+        Give up a ticket whose caller stopped waiting; a no-op once the ticket holds a slot,
+        and a ticket entered afterwards is refused without running
+        """
+        self.controller._dequeue(self)
+
+
+class AdmissionController:
+    """
+    Class Name :   AdmissionController
+    Description :   Bounds the number of predictions running at once and the number waiting
+                    for a slot, and gives every request a deadline.
+
+                    A request is shed on arrival when the queue is full or when the expected
+                    queue wait plus service time (moving average of recent requests) would
+                    miss its deadline, and while waiting once its deadline can no longer be met.
+                    Shed requests cost no model work and should be answered with 503 and
+                    Retry-After.
+
+    Output      :   Tickets for admitted requests, shed counts and queue wait times in /metrics
+    On Failure  :   RequestShed is raised for refused requests
+    """
+
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT, max_queue_depth: int = ADMISSION_MAX_QUEUE_DEPTH,
+                 default_deadline_ms: float = ADMISSION_DEFAULT_DEADLINE_MS):
+        """
+        :param max_in_flight: number of requests allowed to run at once
+        :param max_queue_depth: number of admitted requests allowed to wait for a slot
+        :param default_deadline_ms: deadline of requests that do not set their own
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.default_deadline_ms = default_deadline_ms
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.service_seconds = 0.0
+        self._condition = threading.Condition()
+        self._queue_wait = REGISTRY.histogram(ADMISSION_QUEUE_WAIT)
+        REGISTRY.register_collector(self._collect_metrics)
+
+    def reserve(self, deadline_ms: Optional[float] = None) -> AdmissionTicket:
+        """
+        Admit a request to the queue without blocking; use the ticket as `with controller.reserve():`
+        :param deadline_ms: time budget of the request from now, default_deadline_ms when None
+        """
+        try:
+            deadline_ms = self.default_deadline_ms if deadline_ms is None else deadline_ms
+            ticket = AdmissionTicket(self, time.monotonic() + deadline_ms / 1000.0)
+            with self._condition:
+                if self.in_flight >= self.max_in_flight and self.queue_depth >= self.max_queue_depth:
+                    self._shed("queue_full")
+                expected_wait = self._expected_wait(ahead=self.in_flight + self.queue_depth + 1 - self.max_in_flight)
+                if ticket.queued_at + expected_wait + self.service_seconds > ticket.deadline:
+                    self._shed("deadline")
+                self.queue_depth += 1
+            return ticket
+        except RequestShed:
+            raise
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def _enter(self, ticket: AdmissionTicket) -> None:
+        with self._condition:
+            try:
+                while self.in_flight >= self.max_in_flight and ticket._queued:
+                    remaining = ticket.deadline - self.service_seconds - time.monotonic()
+                    if remaining <= 0:
+                        self._shed("deadline_expired", pass_slot=False)
+                    self._condition.wait(remaining)
+                if not ticket._queued:
+                    # Cancelled by its caller, which no longer waits for the result
+                    self._shed("cancelled", pass_slot=self.in_flight < self.max_in_flight)
+                if time.monotonic() + self.service_seconds > ticket.deadline:
+                    self._shed("deadline_expired", pass_slot=True)
+                self.in_flight += 1
+            finally:
+                if ticket._queued:
+                    self.queue_depth -= 1
+                    ticket._queued = False
+        self._queue_wait.observe(time.monotonic() - ticket.queued_at)
+
+    def _exit(self, service_seconds: float) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            if self.service_seconds == 0.0:
+                self.service_seconds = service_seconds
+            else:
+                self.service_seconds += SERVICE_TIME_SMOOTHING * (service_seconds - self.service_seconds)
+            self._condition.notify()
+
+    def _dequeue(self, ticket: AdmissionTicket) -> None:
+        with self._condition:
+            if ticket._queued:
+                ticket._queued = False
+                self.queue_depth -= 1
+                # A pool thread may already be waiting on this ticket, wake it to give up
+                self._condition.notify_all()
+
+    def _expected_wait(self, ahead: int) -> float:
+        if ahead <= 0:
+            return 0.0
+        return ahead / self.max_in_flight * self.service_seconds
+
+    def _shed(self, reason: str, pass_slot: bool = False) -> None:
+        # Called with the condition held; Retry-After is the time to drain the current queue.
+        # A waiter woken for a free slot it does not take hands the wake-up on to the next one
+        if pass_slot:
+            self._condition.notify()
+        retry_after = max(1, math.ceil(self._expected_wait(ahead=self.queue_depth + 1)))
+        REGISTRY.inc_counter(ADMISSION_SHED, (("reason", reason),))
+        raise RequestShed(reason, retry_after)
+
+    def stats(self) -> Dict[str, float]:
+        with self._condition:
+            return {"in_flight": self.in_flight, "queue_depth": self.queue_depth,
+                    "service_seconds": self.service_seconds}
+
+    def _collect_metrics(self):
+        yield ADMISSION_IN_FLIGHT, {}, self.in_flight
+        yield ADMISSION_QUEUE_DEPTH, {}, self.queue_depth
+
+
+def parse_deadline_ms(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a per-request deadline header in milliseconds, None when absent or invalid
+    """
+    try:
+        deadline_ms = float(value)
+    except (TypeError, ValueError):
+        return None
+    return deadline_ms if deadline_ms > 0 else None
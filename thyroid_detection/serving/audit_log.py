@@ -0,0 +1,362 @@
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Deque, List, NamedTuple, Optional
+
+import numpy as np
+from pandas import DataFrame
+
+from thyroid_detection.constants import (DATABASE_NAME, PREDICTION_AUDIT_COLLECTION_NAME,
+                                         PREDICTION_AUDIT_ENABLED_ENV_KEY, PREDICTION_AUDIT_ENQUEUE_TIMEOUT_MS,
+                                         PREDICTION_AUDIT_FLUSH_INTERVAL_SECONDS, PREDICTION_AUDIT_FLUSH_ROWS,
+                                         PREDICTION_AUDIT_MAX_BUFFERED_ROWS, PREDICTION_AUDIT_RETRY_INTERVAL_SECONDS,
+                                         PREDICTION_AUDIT_SPILL_DIR, PREDICTION_AUDIT_SPILL_DIR_ENV_KEY)
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+from thyroid_detection.serving.metrics import AUDIT_BUFFERED_ROWS, AUDIT_ROWS, REGISTRY
+
+# MongoDB error code of a duplicate _id, returned when spilled rows that were partly inserted are replayed
+DUPLICATE_KEY_ERROR_CODE = 11000
+_SPILL_FILE_PATTERN = re.compile(r"^(spill|replay)-(\d+)(?:-\d+)?\.jsonl$")
+
+
+class _AuditBatch(NamedTuple):
+    timestamp: datetime
+    dataframe: DataFrame
+    labels: np.ndarray
+    model_path: str
+    model_version: Optional[str]
+    model_tier: str
+    latency_seconds: float
+
+
+class PredictionAuditLog:
+    """
+    Class Name :   PredictionAuditLog
+    Description :   Write-behind audit log of every prediction (inputs, output, model version,
+                    tier and latency) in MongoDB.
+
+                    Requests only append their DataFrame and labels to a bounded in-process
+                    buffer; a background thread turns them into one document per row and
+                    writes them with insert_many(ordered=False) once flush_rows rows are
+                    buffered or every flush_interval_seconds. When the buffer is full a
+                    request waits up to enqueue_timeout_ms for room, then writes its own rows
+                    to a local spill file, so rows are never dropped. Batches that fail to
+                    insert are spilled too, MongoDB is skipped for retry_interval_seconds, and
+                    spill files are replayed after the next successful insert. Documents carry
+                    a client-side _id, so replaying rows that were partly inserted is idempotent.
+
+    Output      :   Audit documents in the prediction_audit collection, buffer size and written
+                    rows in /metrics
+    On Failure  :   Rows are spilled to spill_dir as JSON lines and the error is logged
+    """
+
+    _instance: Optional["PredictionAuditLog"] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, collection_factory: Optional[Callable[[], object]] = None,
+                 max_buffered_rows: int = PREDICTION_AUDIT_MAX_BUFFERED_ROWS,
+                 flush_rows: int = PREDICTION_AUDIT_FLUSH_ROWS,
+                 flush_interval_seconds: float = PREDICTION_AUDIT_FLUSH_INTERVAL_SECONDS,
+                 enqueue_timeout_ms: float = PREDICTION_AUDIT_ENQUEUE_TIMEOUT_MS,
+                 retry_interval_seconds: float = PREDICTION_AUDIT_RETRY_INTERVAL_SECONDS,
+                 spill_dir: str = PREDICTION_AUDIT_SPILL_DIR):
+        """
+        :param collection_factory: returns the collection to insert into, any object with a pymongo
+                                   style insert_many(documents, ordered=False); by default the
+                                   prediction_audit collection of the pooled MongoDBClient.client
+        :param max_buffered_rows: rows buffered or being written before requests wait for room
+        :param flush_rows: rows that trigger a flush, and the size of each insert_many
+        :param flush_interval_seconds: maximum time a row waits in the buffer
+        :param enqueue_timeout_ms: time a request waits for room before spilling its rows itself
+        :param retry_interval_seconds: time MongoDB is skipped after a failed insert
+        :param spill_dir: folder of the spill files, created on first spill
+        """
+        self.collection_factory = collection_factory or _default_collection
+        self.max_buffered_rows = max_buffered_rows
+        self.flush_rows = flush_rows
+        self.flush_interval_seconds = flush_interval_seconds
+        self.enqueue_timeout_seconds = enqueue_timeout_ms / 1000.0
+        self.retry_interval_seconds = retry_interval_seconds
+        self.spill_dir = spill_dir
+        self.buffered_rows = 0
+        self._queued_rows = 0
+        self._buffer: Deque[_AuditBatch] = deque()
+        self._condition = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._collection = None
+        self._mongo_down_until = 0.0
+        # Spill files left by an earlier run are replayed after the first successful insert
+        self._spill_pending = True
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def get_instance(cls) -> Optional["PredictionAuditLog"]:
+        """
+        Return the process-wide audit log, None unless the PREDICTION_AUDIT_ENABLED environment variable is 1;
+        its spill files go to the PREDICTION_AUDIT_SPILL_DIR environment variable, ./audit_spill by default
+        """
+        if os.getenv(PREDICTION_AUDIT_ENABLED_ENV_KEY) != "1":
+            return None
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    spill_dir = os.getenv(PREDICTION_AUDIT_SPILL_DIR_ENV_KEY, PREDICTION_AUDIT_SPILL_DIR)
+                    cls._instance = cls(spill_dir=spill_dir)
+                    atexit.register(cls._instance.close)
+        return cls._instance
+
+    def record(self, dataframe: DataFrame, labels: np.ndarray, model_path: str, model_version: Optional[str],
+               model_tier: str, latency_seconds: float) -> None:
+        """
+        Queue the predictions of one request; returns without waiting for MongoDB
+        """
+        try:
+            batch = _AuditBatch(datetime.now(timezone.utc), dataframe, labels, model_path, model_version,
+                                model_tier, latency_seconds)
+            rows = len(labels)
+            deadline = time.monotonic() + self.enqueue_timeout_seconds
+            with self._condition:
+                closed = self._closed
+                if not closed:
+                    self._start()
+                    while self.buffered_rows and self.buffered_rows + rows > self.max_buffered_rows:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    else:
+                        self._buffer.append(batch)
+                        self.buffered_rows += rows
+                        self._queued_rows += rows
+                        if self._queued_rows >= self.flush_rows:
+                            self._condition.notify_all()
+                        return
+
+            if closed:
+                self._write([batch], counted=False)
+            else:
+                # Backpressure: the buffer stayed full, so this request writes its own rows locally
+                self._spill(self._to_documents([batch]))
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def flush(self) -> None:
+        """
+        Write everything buffered now, from the calling thread
+        """
+        self._write(self._take_buffer())
+
+    def close(self) -> None:
+        """
+        Stop the background thread after it wrote out the buffer
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=self.flush_interval_seconds + 30)
+        else:
+            self.flush()
+
+    def _start(self) -> None:
+        # Called with the condition held; the thread is started on first use so forked children start their own
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="prediction-audit", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval_seconds
+                while not self._closed and self._queued_rows < self.flush_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                closed = self._closed
+            batches = self._take_buffer()
+            try:
+                self._write(batches)
+            except Exception as e:
+                logging.error(f"Prediction audit flush failed: {e}")
+            if closed:
+                return
+
+    def _take_buffer(self) -> List[_AuditBatch]:
+        with self._condition:
+            batches = list(self._buffer)
+            self._buffer.clear()
+            self._queued_rows = 0
+        return batches
+
+    def _write(self, batches: List[_AuditBatch], counted: bool = True) -> None:
+        # Rows stay counted in buffered_rows until written, so a slow MongoDB pushes back on requests
+        if not batches:
+            return
+        try:
+            documents = self._to_documents(batches)
+            if time.monotonic() < self._mongo_down_until or not self._insert(documents):
+                self._spill(documents)
+            elif self._spill_pending:
+                self._replay_spill_files()
+        finally:
+            if counted:
+                with self._condition:
+                    self.buffered_rows -= sum(len(batch.labels) for batch in batches)
+                    self._condition.notify_all()
+
+    def _insert(self, documents: List[dict]) -> bool:
+        """
+        Insert documents in flush_rows chunks; on failure the uninserted chunks stay in documents
+        :return: True if every document was inserted
+        """
+        try:
+            if self._collection is None:
+                self._collection = self.collection_factory()
+            while documents:
+                chunk = documents[:self.flush_rows]
+                try:
+                    self._collection.insert_many(chunk, ordered=False)
+                except Exception as e:
+                    if not _only_duplicate_keys(e):
+                        raise
+                del documents[:len(chunk)]
+                REGISTRY.add_to_gauge(AUDIT_ROWS, len(chunk), (("destination", "mongodb"),))
+            return True
+        except Exception as e:
+            logging.error(f"Prediction audit insert failed, spilling {len(documents)} rows to "
+                          f"{self.spill_dir} for {self.retry_interval_seconds}s: {e}")
+            self._mongo_down_until = time.monotonic() + self.retry_interval_seconds
+            return False
+
+    def _spill(self, documents: List[dict]) -> None:
+        if not documents:
+            return
+        lines = []
+        for document in documents:
+            document = dict(document, timestamp=document["timestamp"].isoformat())
+            lines.append(json.dumps(document, default=str) + "\n")
+        with self._spill_lock:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(os.path.join(self.spill_dir, f"spill-{os.getpid()}.jsonl"), "a") as spill_file:
+                spill_file.writelines(lines)
+                spill_file.flush()
+                os.fsync(spill_file.fileno())
+            self._spill_pending = True
+        REGISTRY.add_to_gauge(AUDIT_ROWS, len(documents), (("destination", "spill"),))
+
+    def _replay_spill_files(self) -> None:
+        # Only files of this process or of processes that no longer exist are replayed, so no
+        # other process is still appending to them
+        self._spill_pending = False
+        try:
+            entries = list(os.scandir(self.spill_dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            match = _SPILL_FILE_PATTERN.match(entry.name)
+            if match is None:
+                continue
+            pid = int(match.group(2))
+            if pid != os.getpid() and _process_alive(pid):
+                continue
+            path = entry.path
+            if match.group(1) == "spill":
+                path = os.path.join(self.spill_dir, f"replay-{pid}-{time.time_ns()}.jsonl")
+                with self._spill_lock:
+                    try:
+                        os.rename(entry.path, path)
+                    except FileNotFoundError:
+                        continue
+            with open(path) as replay_file:
+                documents = [json.loads(line) for line in replay_file if line.strip()]
+            for document in documents:
+                document["timestamp"] = datetime.fromisoformat(document["timestamp"])
+            if not self._insert(documents):
+                self._spill_pending = True
+                return
+            os.remove(path)
+            logging.info(f"Replayed audit spill file {path} into MongoDB")
+
+    @staticmethod
+    def _to_documents(batches: List[_AuditBatch]) -> List[dict]:
+        documents = []
+        for batch in batches:
+            records = batch.dataframe.to_dict(orient="records")
+            latency_ms = batch.latency_seconds * 1000.0
+            for row, (record, label) in enumerate(zip(records, batch.labels.tolist())):
+                documents.append({
+                    "_id": uuid.uuid4().hex,
+                    "timestamp": batch.timestamp,
+                    "model_path": batch.model_path,
+                    "model_version": batch.model_version,
+                    "model_tier": batch.model_tier,
+                    "latency_ms": latency_ms,
+                    "batch_size": len(records),
+                    "row": row,
+                    "input": record,
+                    "prediction": label,
+                })
+        return documents
+
+    def _reset_after_fork(self) -> None:
+        # The buffered rows belong to the parent, which writes them itself
+        self._buffer = deque()
+        self.buffered_rows = 0
+        self._queued_rows = 0
+        self._condition = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._collection = None
+        self._thread = None
+
+
+def _default_collection():
+    # pymongo is only imported once the first audit rows are written
+    from thyroid_detection.configuration.mongo_db_connection import MongoDBClient
+    return MongoDBClient(database_name=DATABASE_NAME).database[PREDICTION_AUDIT_COLLECTION_NAME]
+
+
+def _only_duplicate_keys(error: Exception) -> bool:
+    details = getattr(error, "details", None)
+    if not isinstance(details, dict) or details.get("writeConcernErrors"):
+        return False
+    write_errors = details.get("writeErrors") or []
+    return bool(write_errors) and all(error.get("code") == DUPLICATE_KEY_ERROR_CODE for error in write_errors)
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _collect_audit_metrics():
+    audit_log = PredictionAuditLog._instance
+    if audit_log is not None:
+        yield AUDIT_BUFFERED_ROWS, {}, audit_log.buffered_rows
+
+
+REGISTRY.register_collector(_collect_audit_metrics)
+
+
+def _reset_audit_log_after_fork() -> None:
+    PredictionAuditLog._instance_lock = threading.Lock()
+    if PredictionAuditLog._instance is not None:
+        PredictionAuditLog._instance._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_audit_log_after_fork)
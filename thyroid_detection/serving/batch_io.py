@@ -0,0 +1,209 @@
+import io
+import json
+from typing import Dict, Iterator, Mapping, Optional, Union
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from thyroid_detection.constants import BATCH_PREDICTION_STREAM_CHUNK_SIZE
+
+CSV_MEDIA_TYPES = ("text/csv", "application/csv")
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+NPY_MEDIA_TYPE = "application/x-npy"
+NPZ_MEDIA_TYPE = "application/x-npz"
+# Columnar formats, answered in the same format unless the Accept header asks for another one
+BINARY_MEDIA_TYPES = (ARROW_STREAM_MEDIA_TYPE, NPY_MEDIA_TYPE, NPZ_MEDIA_TYPE)
+PREDICTION_FIELD = "prediction"
+ERRORS_FIELD = "errors"
+
+
+class UnsupportedBatchFormat(ValueError):
+    """
+    Raised for a batch media type that cannot be decoded or encoded here, e.g. Arrow without pyarrow
+    """
+
+
+def parse_batch_body(body: bytes, media_type: str) -> Union[list, DataFrame]:
+    """
+    Parse a batch request body, either a JSON array of records (optionally wrapped
+    as {"records": [...]}), a CSV document with a header row, or one of the binary
+    columnar formats of BINARY_MEDIA_TYPES
+    """
+    if media_type in CSV_MEDIA_TYPES:
+        return pd.read_csv(io.BytesIO(body))
+    if media_type == ARROW_STREAM_MEDIA_TYPE:
+        return read_arrow_stream(body)
+    if media_type == NPY_MEDIA_TYPE:
+        return read_npy(body)
+    if media_type == NPZ_MEDIA_TYPE:
+        return read_npz(body)
+
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = payload.get("records")
+    if not isinstance(payload, list):
+        raise ValueError("Expected a JSON array of records")
+    return payload
+
+
+def iter_ndjson_predictions(labels: np.ndarray,
+                            chunk_size: int = BATCH_PREDICTION_STREAM_CHUNK_SIZE,
+                            errors: Optional[Mapping[int, Mapping[str, str]]] = None) -> Iterator[str]:
+    """
+    Yield one NDJSON line per prediction, grouped into chunks so the body is sent
+    incrementally with chunked transfer encoding. Rows in errors, invalid input rows by
+    position, get a null prediction and their field errors
+    """
+    errors = errors or {}
+    encoded_labels = {}
+    for start in range(0, len(labels), chunk_size):
+        lines = []
+        for index, label in enumerate(labels[start:start + chunk_size], start):
+            row_errors = errors.get(index)
+            if row_errors is not None:
+                lines.append(f'{{"index": {index}, "prediction": null, "{ERRORS_FIELD}": {json.dumps(row_errors)}}}\n')
+                continue
+            encoded = encoded_labels.get(label)
+            if encoded is None:
+                encoded = encoded_labels[label] = json.dumps(label)
+            lines.append(f'{{"index": {index}, "prediction": {encoded}}}\n')
+        yield "".join(lines)
+
+
+def read_arrow_stream(body: bytes) -> DataFrame:
+    """
+    Decode an Arrow IPC stream; numeric columns without nulls are NumPy views of body
+    """
+    pa = import_pyarrow()
+    table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    return columnar_to_dataframe({name: table.column(name).to_numpy() for name in table.column_names})
+
+
+def read_npy(body: bytes) -> DataFrame:
+    """
+    Decode an .npy structured array with one field per column; the fields are NumPy views of body
+    """
+    stream = io.BytesIO(body)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, _, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, _, dtype = np.lib.format.read_array_header_2_0(stream)
+    if dtype.names is None or len(shape) != 1:
+        raise ValueError("Expected a one-dimensional structured array with one field per column")
+    if dtype.hasobject:
+        raise ValueError("Object fields are not allowed, use fixed-width strings for categorical columns")
+    array = np.frombuffer(body, dtype=dtype, count=shape[0], offset=stream.tell())
+    return columnar_to_dataframe({name: array[name] for name in dtype.names})
+
+
+def read_npz(body: bytes) -> DataFrame:
+    """
+    Decode an .npz archive holding one array per column
+    """
+    with np.load(io.BytesIO(body), allow_pickle=False) as archive:
+        return columnar_to_dataframe({name: archive[name] for name in archive.files})
+
+
+def columnar_to_dataframe(columns: Union[Dict[str, np.ndarray], np.ndarray, object]) -> DataFrame:
+    """
+    Wrap columns (a dict of arrays, a NumPy structured array or a pyarrow Table/RecordBatch)
+    in a DataFrame without copying numeric columns. Fixed-width string columns become object
+    columns with empty strings as missing values, and Arrow nulls become NaN, as in a CSV body.
+    """
+    if isinstance(columns, np.ndarray):
+        columns = {name: columns[name] for name in columns.dtype.names}
+    elif hasattr(columns, "column_names"):
+        columns = {name: columns.column(name).to_numpy(zero_copy_only=False) for name in columns.column_names}
+
+    decoded = {}
+    for name, column in columns.items():
+        column = np.asarray(column)
+        if column.dtype.kind in "SU":
+            if column.dtype.kind == "S":
+                column = np.char.decode(column, "utf-8")
+            missing = column == ""
+            column = column.astype(object)
+            column[missing] = np.nan
+        elif column.dtype.kind == "O":
+            column = column.copy()
+            column[pd.isna(column)] = np.nan
+        decoded[name] = column
+    return DataFrame(decoded, copy=False)
+
+
+def negotiate_batch_response(request_media_type: str, accept: Optional[str]) -> str:
+    """
+    Pick the media type of batch predictions: a binary or NDJSON type named in Accept, else
+    the binary type of the request, else NDJSON. Called before any model work, it raises
+    UnsupportedBatchFormat when the chosen type cannot be encoded (Arrow without pyarrow)
+    """
+    response_type = None
+    for accepted in (accept or "").split(","):
+        accepted = accepted.split(";")[0].strip()
+        if accepted in BINARY_MEDIA_TYPES or accepted == NDJSON_MEDIA_TYPE:
+            response_type = accepted
+            break
+    if response_type is None:
+        response_type = request_media_type if request_media_type in BINARY_MEDIA_TYPES else NDJSON_MEDIA_TYPE
+    if response_type == ARROW_STREAM_MEDIA_TYPE:
+        import_pyarrow()
+    return response_type
+
+
+def encode_batch_predictions(labels: np.ndarray, media_type: str,
+                             errors: Optional[Mapping[int, Mapping[str, str]]] = None) -> bytes:
+    """
+    Encode prediction labels, row i being the prediction of input row i, as an Arrow IPC stream
+    with a prediction column, an .npy string array, or an .npz archive with a prediction array.
+    Rows in errors, invalid input rows by position, have an empty label (null in Arrow); Arrow
+    and .npz bodies of batches with invalid rows also carry their field errors as JSON strings
+    in an errors column
+    """
+    labels = np.asarray(labels, dtype=object)
+    if errors:
+        labels = labels.copy()
+        labels[list(errors)] = ""
+    labels = labels.astype(str)
+    error_column = None
+    if errors:
+        error_column = np.full(len(labels), "", dtype=object)
+        for index, row_errors in errors.items():
+            error_column[index] = json.dumps(row_errors)
+
+    if media_type == ARROW_STREAM_MEDIA_TYPE:
+        pa = import_pyarrow()
+        columns = {PREDICTION_FIELD: pa.array(labels, type=pa.string())}
+        if error_column is not None:
+            invalid = error_column != ""
+            columns[PREDICTION_FIELD] = pa.array(labels, type=pa.string(), mask=invalid)
+            columns[ERRORS_FIELD] = pa.array(error_column, type=pa.string(), mask=~invalid)
+        table = pa.table(columns)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    buffer = io.BytesIO()
+    if media_type == NPY_MEDIA_TYPE:
+        np.save(buffer, labels, allow_pickle=False)
+    elif media_type == NPZ_MEDIA_TYPE:
+        arrays = {PREDICTION_FIELD: labels}
+        if error_column is not None:
+            arrays[ERRORS_FIELD] = error_column.astype(str)
+        np.savez(buffer, **arrays)
+    else:
+        raise UnsupportedBatchFormat(f"Cannot encode predictions as {media_type}")
+    return buffer.getvalue()
+
+
+def import_pyarrow():
+    # pyarrow is optional and only imported for Arrow payloads
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc  # noqa: F401
+    except ImportError as e:
+        raise UnsupportedBatchFormat(f"{ARROW_STREAM_MEDIA_TYPE} payloads need pyarrow installed") from e
+    return pa
@@ -0,0 +1,384 @@
+"""
+Streaming feature drift monitoring.
+
+Every prediction request updates constant-memory sketches of its input rows: a log-bucket
+quantile sketch per numerical feature and capped category counts per categorical feature.
+The same sketches are built on the training data when the model is trained and stored with
+the model as its feature reference, so the live inputs are compared bin for bin with the
+data the preprocessing pipeline was fitted on, using the population stability index (PSI):
+
+    PSI = sum((live - reference) * ln(live / reference))    over the bins of a feature
+
+A PSI under 0.1 is usually read as no shift, 0.1-0.2 as a moderate shift and over 0.2 as drift.
+"""
+import math
+import sys
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pandas import DataFrame
+
+from thyroid_detection.constants import DRIFT_MIN_ROWS, DRIFT_PSI_THRESHOLD, DRIFT_SKETCH_RELATIVE_ACCURACY
+from thyroid_detection.exception import ThyroidException
+
+FEATURE_REFERENCE_FORMAT_VERSION: int = 1
+
+# Smallest and largest values told apart by the quantile sketches; values at or below
+# SKETCH_MIN_VALUE (zero and negatives) share the first bucket, values above SKETCH_MAX_VALUE the last
+SKETCH_MIN_VALUE: float = 1e-3
+SKETCH_MAX_VALUE: float = 1e6
+
+# Categories counted per categorical feature, later new categories are counted as OTHER_CATEGORY
+MAX_CATEGORIES: int = 32
+OTHER_CATEGORY = "__other__"
+
+# Requests with fewer rows are converted to one object array instead of one array per feature type
+SMALL_BATCH_ROWS: int = 64
+
+REFERENCE_QUANTILES: Sequence[float] = (0.05, 0.25, 0.5, 0.75, 0.95)
+REFERENCE_BINS: int = 10
+
+# Floor of the bin fractions in the PSI so that empty bins do not make it infinite
+PSI_EPSILON: float = 1e-4
+
+STATUS_OK = "ok"
+STATUS_DRIFT = "drift"
+STATUS_INSUFFICIENT_DATA = "insufficient_data"
+STATUS_NO_REFERENCE = "no_reference"
+
+
+class QuantileSketch:
+    """
+    Fixed array of counts over logarithmic value buckets: bucket i holds the values in
+    (min_value * gamma^(i-1), min_value * gamma^i], so any quantile is known within the relative
+    accuracy, in constant memory however many values were added. Counts of two sketches with the
+    same accuracy add up bucket for bucket. Not thread safe, FeatureDriftMonitor locks around it.
+    """
+
+    def __init__(self, relative_accuracy: float = DRIFT_SKETCH_RELATIVE_ACCURACY,
+                 min_value: float = SKETCH_MIN_VALUE, max_value: float = SKETCH_MAX_VALUE):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.n_buckets = int(math.ceil(math.log(max_value / min_value) / self._log_gamma)) + 2
+        self.counts = np.zeros(self.n_buckets, dtype=np.int64)
+        self.missing = 0
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def bucket_indexes(self, values: np.ndarray) -> np.ndarray:
+        """
+        Bucket of every value; NaN values are not bucketed and must be removed first
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            indexes = np.ceil(np.log(np.maximum(values, self.min_value) / self.min_value) / self._log_gamma)
+        return np.clip(indexes, 0, self.n_buckets - 1).astype(np.int64)
+
+    def bucket_counts(self, values: np.ndarray) -> np.ndarray:
+        """
+        Counts per bucket of values, without adding them to the sketch
+        """
+        return np.bincount(self.bucket_indexes(values), minlength=self.n_buckets)
+
+    def add_counts(self, counts: np.ndarray, missing: int = 0) -> None:
+        self.counts += counts
+        self.missing += missing
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        present = values[~np.isnan(values)]
+        self.add_counts(self.bucket_counts(present), missing=len(values) - len(present))
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = self.count
+        if total == 0:
+            return None
+        index = int(np.searchsorted(np.cumsum(self.counts), q * (total - 1), side="right"))
+        return self.bucket_value(min(index, self.n_buckets - 1))
+
+    def bucket_value(self, index: int) -> float:
+        # Middle of the bucket in relative terms, within relative_accuracy of every value in it
+        if index == 0:
+            return self.min_value
+        return self.min_value * 2.0 * self.gamma ** index / (self.gamma + 1.0)
+
+    def bin_fractions(self, bin_edges: Sequence[float]) -> List[float]:
+        """
+        Fractions of the present values in the bins (-inf, e0], (e0, e1], ..., (e_last, inf)
+        at the resolution of the buckets, e.g. the reference bins of a feature
+        """
+        total = self.count
+        if total == 0:
+            return [0.0] * (len(bin_edges) + 1)
+        cumulative = np.cumsum(self.counts)
+        at_edges = cumulative[self.bucket_indexes(np.asarray(bin_edges, dtype=np.float64))]
+        counts = np.diff(np.concatenate(([0], at_edges, [total])))
+        return (counts / total).tolist()
+
+    def missing_fraction(self) -> float:
+        total = self.count + self.missing
+        return self.missing / total if total else 0.0
+
+
+class FrequencySketch:
+    """
+    Counts of the first max_categories categories of a feature, later new categories are counted
+    together as OTHER_CATEGORY so memory stays constant whatever the inputs
+    """
+
+    def __init__(self, max_categories: int = MAX_CATEGORIES):
+        self.max_categories = max_categories
+        self.counts: Dict[str, int] = {}
+        self.missing = 0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts.values())
+
+    def add_counts(self, counts: Counter) -> None:
+        for value, count in counts.items():
+            if value is None or value != value:
+                self.missing += count
+                continue
+            value = str(value)
+            if value not in self.counts and len(self.counts) >= self.max_categories:
+                value = OTHER_CATEGORY
+            self.counts[value] = self.counts.get(value, 0) + count
+
+    def update(self, values: Iterable[object]) -> None:
+        self.add_counts(Counter(values))
+
+    def fractions(self, categories: Sequence[str]) -> List[float]:
+        """
+        Fractions of the present values in each of categories plus one bin for all other categories
+        """
+        total = self.count
+        if total == 0:
+            return [0.0] * (len(categories) + 1)
+        counts = [self.counts.get(category, 0) for category in categories]
+        return [count / total for count in counts] + [(total - sum(counts)) / total]
+
+    def missing_fraction(self) -> float:
+        total = self.count + self.missing
+        return self.missing / total if total else 0.0
+
+
+def population_stability_index(reference: Sequence[float], live: Sequence[float]) -> float:
+    reference = np.maximum(np.asarray(reference, dtype=np.float64), PSI_EPSILON)
+    live = np.maximum(np.asarray(live, dtype=np.float64), PSI_EPSILON)
+    return float(np.sum((live - reference) * np.log(live / reference)))
+
+
+def build_feature_reference(dataframe: DataFrame, numerical_features: Sequence[str],
+                            categorical_features: Sequence[str]) -> dict:
+    """
+    Summarise the training inputs for drift monitoring: decile bins, quantiles and missing share
+    of every numerical feature, category shares and missing share of every categorical feature.
+    The result holds plain Python values only, so it can be written to YAML or JSON.
+    """
+    try:
+        numerical = {}
+        for feature in numerical_features:
+            values = dataframe[feature].to_numpy(dtype=np.float64, na_value=np.nan)
+            sketch = QuantileSketch()
+            sketch.update(values)
+            present = values[~np.isnan(values)]
+            bin_edges = []
+            if len(present):
+                bin_edges = np.unique(np.quantile(present, np.linspace(0, 1, REFERENCE_BINS + 1)[1:-1])).tolist()
+            numerical[feature] = {
+                "bin_edges": bin_edges,
+                "bin_fractions": sketch.bin_fractions(bin_edges),
+                "quantiles": {_quantile_name(q): sketch.quantile(q) for q in REFERENCE_QUANTILES},
+                "missing_fraction": sketch.missing_fraction(),
+            }
+
+        categorical = {}
+        for feature in categorical_features:
+            sketch = FrequencySketch()
+            sketch.update(dataframe[feature].tolist())
+            total = sketch.count
+            categorical[feature] = {
+                "fractions": {value: count / total for value, count in sorted(sketch.counts.items())},
+                "missing_fraction": sketch.missing_fraction(),
+            }
+
+        return {
+            "format_version": FEATURE_REFERENCE_FORMAT_VERSION,
+            "rows": len(dataframe),
+            "relative_accuracy": DRIFT_SKETCH_RELATIVE_ACCURACY,
+            "numerical": numerical,
+            "categorical": categorical,
+        }
+    except Exception as e:
+        raise ThyroidException(e, sys) from e
+
+
+class FeatureDriftMonitor:
+    """
+    Class Name :   FeatureDriftMonitor
+    Description :   Keeps a QuantileSketch per numerical feature and a FrequencySketch per
+                    categorical feature of all the rows predicted by this process. A batch is
+                    reduced to per-bucket and per-category counts outside the lock, so the
+                    lock is only held to add a fixed-size array and a few counters: updates
+                    cost O(1) per row and concurrent requests do not serialise on the sketching.
+                    report() compares the sketches with the feature reference stored with the model.
+
+    Output      :   Drift report with the PSI of every feature, PSI gauges in /metrics
+    On Failure  :   Write an exception log and then raise an exception
+    """
+
+    def __init__(self, numerical_features: Sequence[str], categorical_features: Sequence[str],
+                 psi_threshold: float = DRIFT_PSI_THRESHOLD, min_rows: int = DRIFT_MIN_ROWS,
+                 relative_accuracy: float = DRIFT_SKETCH_RELATIVE_ACCURACY):
+        """
+        :param numerical_features: features summarised by quantile sketches
+        :param categorical_features: features summarised by category counts
+        :param psi_threshold: PSI from which a feature is reported as drifted
+        :param min_rows: rows to observe before drift is reported
+        :param relative_accuracy: relative error of the quantiles of the numerical features
+        """
+        self.numerical_features = list(numerical_features)
+        self.categorical_features = list(categorical_features)
+        self.psi_threshold = psi_threshold
+        self.min_rows = min_rows
+        self.rows = 0
+        self.numerical = {feature: QuantileSketch(relative_accuracy) for feature in self.numerical_features}
+        self.categorical = {feature: FrequencySketch() for feature in self.categorical_features}
+        self._bucketer = QuantileSketch(relative_accuracy)
+        self._bucket_offsets = np.arange(len(self.numerical_features)) * self._bucketer.n_buckets
+        self._positions: Optional[tuple] = None
+        self._lock = threading.Lock()
+
+    def update(self, dataframe: DataFrame) -> None:
+        """
+        Add the input rows of one prediction request to the sketches
+        """
+        try:
+            if len(dataframe) == 0:
+                return
+            values, category_values = self._feature_arrays(dataframe)
+            missing = np.isnan(values)
+            missing_counts = missing.sum(axis=0).tolist()
+            # One bincount for all numerical features, each offset into its own range of buckets
+            indexes = self._bucketer.bucket_indexes(np.where(missing, 0.0, values)) + self._bucket_offsets
+            bucket_counts = np.bincount(indexes[~missing], minlength=self._bucket_offsets[-1] + self._bucketer.n_buckets)
+            bucket_counts = bucket_counts.reshape(len(self.numerical_features), self._bucketer.n_buckets)
+            category_counts = [Counter(category_values[:, column].tolist())
+                               for column in range(len(self.categorical_features))]
+
+            with self._lock:
+                self.rows += len(dataframe)
+                for sketch, counts, missing_count in zip(self.numerical.values(), bucket_counts, missing_counts):
+                    sketch.add_counts(counts, missing=missing_count)
+                for sketch, counts in zip(self.categorical.values(), category_counts):
+                    sketch.add_counts(counts)
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def _feature_arrays(self, dataframe: DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        if len(dataframe) < SMALL_BATCH_ROWS:
+            # One conversion of the whole frame is cheaper than a column selection per feature type
+            numerical_positions, categorical_positions = self._column_positions(dataframe.columns)
+            values = dataframe.to_numpy()
+            return values[:, numerical_positions].astype(np.float64), values[:, categorical_positions]
+        return (dataframe[self.numerical_features].to_numpy(dtype=np.float64, na_value=np.nan),
+                dataframe[self.categorical_features].to_numpy(dtype=object))
+
+    def _column_positions(self, columns) -> Tuple[np.ndarray, np.ndarray]:
+        # Requests share one column layout, so the positions are looked up once per layout change
+        cached = self._positions
+        if cached is None or not cached[0].equals(columns):
+            cached = self._positions = (columns, columns.get_indexer(self.numerical_features),
+                                        columns.get_indexer(self.categorical_features))
+        return cached[1], cached[2]
+
+    def feature_psi(self, reference: dict) -> Dict[str, float]:
+        """
+        PSI of every feature of reference, over its bins plus one bin for missing values;
+        empty until rows have been observed
+        """
+        psi = {}
+        with self._lock:
+            for feature, feature_reference in reference.get("numerical", {}).items():
+                sketch = self.numerical.get(feature)
+                if sketch is not None and self.rows:
+                    psi[feature] = population_stability_index(
+                        _with_missing(feature_reference["bin_fractions"], feature_reference["missing_fraction"]),
+                        _with_missing(sketch.bin_fractions(feature_reference["bin_edges"]),
+                                      sketch.missing_fraction()))
+            for feature, feature_reference in reference.get("categorical", {}).items():
+                sketch = self.categorical.get(feature)
+                if sketch is not None and self.rows:
+                    categories = sorted(feature_reference["fractions"])
+                    reference_fractions = [feature_reference["fractions"][category] for category in categories]
+                    psi[feature] = population_stability_index(
+                        _with_missing(reference_fractions + [0.0], feature_reference["missing_fraction"]),
+                        _with_missing(sketch.fractions(categories), sketch.missing_fraction()))
+        return psi
+
+    def report(self, reference: Optional[dict]) -> dict:
+        """
+        Compare the sketches with reference, the feature reference of the served model
+        """
+        try:
+            with self._lock:
+                rows = self.rows
+                features = {}
+                for feature, sketch in self.numerical.items():
+                    features[feature] = {
+                        "type": "numerical",
+                        "quantiles": {_quantile_name(q): sketch.quantile(q) for q in REFERENCE_QUANTILES},
+                        "missing_fraction": sketch.missing_fraction(),
+                    }
+                for feature, sketch in self.categorical.items():
+                    total = sketch.count
+                    features[feature] = {
+                        "type": "categorical",
+                        "fractions": {value: count / total for value, count in sorted(sketch.counts.items())},
+                        "missing_fraction": sketch.missing_fraction(),
+                    }
+
+            report = {"rows": rows, "min_rows": self.min_rows, "psi_threshold": self.psi_threshold,
+                      "reference_rows": None, "drifted_features": [], "features": features}
+            if not reference:
+                report["status"] = STATUS_NO_REFERENCE
+                return report
+
+            report["reference_rows"] = reference.get("rows")
+            feature_psi = self.feature_psi(reference)
+            for kind in ("numerical", "categorical"):
+                for feature, feature_reference in reference.get(kind, {}).items():
+                    if feature not in features:
+                        continue
+                    feature_report = features[feature]
+                    psi = feature_psi.get(feature)
+                    feature_report["psi"] = psi
+                    feature_report["drifted"] = psi is not None and rows >= self.min_rows and psi >= self.psi_threshold
+                    if feature_report["drifted"]:
+                        report["drifted_features"].append(feature)
+                    for key in ("quantiles", "fractions", "missing_fraction"):
+                        if key in feature_reference:
+                            feature_report[f"reference_{key}"] = feature_reference[key]
+
+            if rows < self.min_rows:
+                report["status"] = STATUS_INSUFFICIENT_DATA
+            else:
+                report["status"] = STATUS_DRIFT if report["drifted_features"] else STATUS_OK
+            return report
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+
+def _with_missing(fractions: Sequence[float], missing_fraction: float) -> List[float]:
+    # Bin fractions are over the present values, rescale them to all rows and add the missing bin
+    return [fraction * (1.0 - missing_fraction) for fraction in fractions] + [missing_fraction]
+
+
+def _quantile_name(q: float) -> str:
+    return f"p{round(q * 100):02d}"
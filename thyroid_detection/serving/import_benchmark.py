@@ -0,0 +1,73 @@
+"""
+Cold import benchmark of the serving path.
+
+Each module is imported in a fresh interpreter with -X importtime, the per-module
+cumulative times are reported, and the run fails when the fastest cold import is
+over the budget or pulls in a dependency that should only load on first use.
+
+    python -m thyroid_detection.serving.import_benchmark --budget-ms 500
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+SERVING_MODULES: List[str] = [
+    "thyroid_detection.pipline.prediction_pipeline",
+    "thyroid_detection.serving.warmup",
+]
+# Loaded on first model download/unpickling, never by importing the serving path
+DEFERRED_MODULES: List[str] = ["sklearn", "scipy", "boto3", "botocore", "mypy_boto3_s3", "dill", "yaml", "pyarrow"]
+IMPORT_TIME_BUDGET_MS: float = 500.0
+IMPORT_TIME_RUNS: int = 5
+
+
+def measure_import(module: str) -> Tuple[float, Dict[str, float], List[str]]:
+    """
+    Import module in a fresh interpreter
+    :return: total import time in ms, cumulative ms per imported module, deferred modules that got imported
+    """
+    probe = (f"import sys; import {module}; "
+             f"print(','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", probe],
+                            capture_output=True, text=True, check=True, cwd=os.getcwd())
+
+    cumulative: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        cumulative[name.strip()] = int(cumulative_us) / 1000.0
+    loaded_deferred = [name for name in result.stdout.strip().split(",") if name]
+    return cumulative.get(module, 0.0), cumulative, loaded_deferred
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure cold import time of the serving path")
+    parser.add_argument('modules', nargs='*', default=SERVING_MODULES)
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_TIME_BUDGET_MS)
+    parser.add_argument('--runs', type=int, default=IMPORT_TIME_RUNS)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        runs = [measure_import(module) for _ in range(args.runs)]
+        total, cumulative, loaded_deferred = min(runs, key=lambda run: run[0])
+
+        print(f"{module}: {total:.1f} ms (best of {args.runs}, budget {args.budget_ms:.0f} ms)")
+        for name, milliseconds in sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+            print(f"    {milliseconds:9.1f} ms  {name}")
+
+        if total > args.budget_ms:
+            print(f"FAIL: {module} imports in {total:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+            failed = True
+        if loaded_deferred:
+            print(f"FAIL: {module} eagerly imports {', '.join(loaded_deferred)}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""
+In-process serving metrics rendered in the Prometheus text exposition format.
+
+Histograms and gauges are plain Python counters behind one lock each, cheap enough
+to stay on in production. Every worker process keeps and serves its own metrics.
+
+    with stage_timer("transform"):
+        ...
+"""
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+STAGE_DURATION = "thyroid_stage_duration_seconds"
+REQUEST_DURATION = "thyroid_request_duration_seconds"
+REQUESTS_IN_FLIGHT = "thyroid_requests_in_flight"
+MODEL_LOAD_DURATION = "thyroid_model_load_seconds"
+MODEL_LOADS = "thyroid_model_loads_total"
+MODEL_INFO = "thyroid_model_info"
+WARMUP_DURATION = "thyroid_warmup_seconds"
+ADMISSION_SHED = "thyroid_admission_shed_total"
+ADMISSION_QUEUE_WAIT = "thyroid_admission_queue_wait_seconds"
+ADMISSION_IN_FLIGHT = "thyroid_admission_in_flight"
+ADMISSION_QUEUE_DEPTH = "thyroid_admission_queue_depth"
+MODEL_TIER_REQUESTS = "thyroid_model_tier_predictions_total"
+FALLBACK_ACTIVE = "thyroid_fallback_active"
+MODEL_POOL_MODELS = "thyroid_model_pool_models"
+MODEL_POOL_BYTES = "thyroid_model_pool_bytes"
+MODEL_POOL_EVICTIONS = "thyroid_model_pool_evictions_total"
+AUDIT_BUFFERED_ROWS = "thyroid_audit_buffered_rows"
+AUDIT_ROWS = "thyroid_audit_rows_total"
+DRIFT_ROWS = "thyroid_drift_rows"
+DRIFT_PSI = "thyroid_feature_drift_psi"
+STREAM_ROWS = "thyroid_stream_scored_rows_total"
+STREAM_LAG = "thyroid_stream_lag_seconds"
+STREAM_LAST_SCORED = "thyroid_stream_last_scored_timestamp_seconds"
+
+# PredictionCache.stats() key -> metric name
+CACHE_STAT_METRICS: Dict[str, str] = {
+    "size": "thyroid_prediction_cache_size",
+    "max_size": "thyroid_prediction_cache_max_size",
+    "hits": "thyroid_prediction_cache_hits_total",
+    "misses": "thyroid_prediction_cache_misses_total",
+    "evictions": "thyroid_prediction_cache_evictions_total",
+    "expirations": "thyroid_prediction_cache_expirations_total",
+    "invalidations": "thyroid_prediction_cache_invalidations_total",
+}
+
+METRIC_HELP: Dict[str, Tuple[str, str]] = {
+    STAGE_DURATION: ("histogram", "Time spent in each step of a prediction"),
+    REQUEST_DURATION: ("histogram", "Time spent handling a request, per endpoint"),
+    REQUESTS_IN_FLIGHT: ("gauge", "Requests currently being handled, per endpoint"),
+    MODEL_LOAD_DURATION: ("gauge", "Duration of the last model download and unpickling"),
+    MODEL_LOADS: ("counter", "Number of model loads, including hot reloads"),
+    MODEL_INFO: ("gauge", "Always 1, labelled with the ETag of the loaded model"),
+    WARMUP_DURATION: ("gauge", "Duration of the startup model prefetch and warm-up predictions"),
+    ADMISSION_SHED: ("counter", "Prediction requests refused with 503, per reason"),
+    ADMISSION_QUEUE_WAIT: ("histogram", "Time admitted prediction requests waited for an execution slot"),
+    ADMISSION_IN_FLIGHT: ("gauge", "Prediction requests holding an execution slot"),
+    ADMISSION_QUEUE_DEPTH: ("gauge", "Admitted prediction requests waiting for an execution slot"),
+    MODEL_TIER_REQUESTS: ("counter", "Predictions served, per model tier"),
+    FALLBACK_ACTIVE: ("gauge", "1 while predictions are routed to the fallback model"),
+    MODEL_POOL_MODELS: ("gauge", "Pinned model versions loaded in the model pool"),
+    MODEL_POOL_BYTES: ("gauge", "Estimated resident size of the pinned model versions in the model pool"),
+    MODEL_POOL_EVICTIONS: ("counter", "Pinned model versions dropped from the model pool by its memory budget"),
+    AUDIT_BUFFERED_ROWS: ("gauge", "Prediction audit rows buffered or being written to MongoDB"),
+    AUDIT_ROWS: ("counter", "Prediction audit rows written, per destination (mongodb or spill file)"),
+    DRIFT_ROWS: ("gauge", "Input rows summarised by the feature drift sketches of this process"),
+    DRIFT_PSI: ("gauge", "Population stability index of the live inputs against the training inputs, per feature"),
+    STREAM_ROWS: ("counter", "Inserted documents scored by the stream prediction worker, per mode"),
+    STREAM_LAG: ("gauge", "Time from the insert of the last scored document to the write of its prediction"),
+    STREAM_LAST_SCORED: ("gauge", "Unix time of the last prediction batch written by the stream prediction worker"),
+    CACHE_STAT_METRICS["size"]: ("gauge", "Entries in the prediction cache"),
+    CACHE_STAT_METRICS["max_size"]: ("gauge", "Capacity of the prediction cache"),
+    CACHE_STAT_METRICS["hits"]: ("counter", "Prediction cache hits"),
+    CACHE_STAT_METRICS["misses"]: ("counter", "Prediction cache misses"),
+    CACHE_STAT_METRICS["evictions"]: ("counter", "Prediction cache entries evicted by the size bound"),
+    CACHE_STAT_METRICS["expirations"]: ("counter", "Prediction cache entries dropped by the TTL"),
+    CACHE_STAT_METRICS["invalidations"]: ("counter", "Prediction cache flushes on model version change"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+# A collector returns (metric name, labels, value) samples gathered at scrape time
+Collector = Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram; counts are stored per bucket and made cumulative when rendered
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+    def _reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _RequestTracker:
+    __slots__ = ("registry", "labels", "histogram", "start")
+
+    def __init__(self, registry: "MetricsRegistry", labels: Labels):
+        self.registry = registry
+        self.labels = labels
+        self.histogram = registry.histogram(REQUEST_DURATION, labels)
+
+    def __enter__(self) -> "_RequestTracker":
+        self.registry.add_to_gauge(REQUESTS_IN_FLIGHT, 1, self.labels)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.histogram.observe(time.perf_counter() - self.start)
+        self.registry.add_to_gauge(REQUESTS_IN_FLIGHT, -1, self.labels)
+
+
+class MetricsRegistry:
+    """
+    Class Name :   MetricsRegistry
+    Description :   Holds the histograms, gauges and counters of this process and the
+                    collectors called at scrape time for values owned by other objects
+                    (prediction cache counters, loaded model version)
+
+    Output      :   Prometheus text exposition of all metrics
+    """
+
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._values: Dict[Tuple[str, Labels], float] = {}
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, labels: Labels = ()) -> Histogram:
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        return histogram
+
+    def timer(self, name: str, labels: Labels = ()) -> _Timer:
+        return _Timer(self.histogram(name, labels))
+
+    def track_request(self, endpoint: str) -> _RequestTracker:
+        return _RequestTracker(self, (("endpoint", endpoint),))
+
+    def set_gauge(self, name: str, value: float, labels: Labels = ()) -> None:
+        with self._lock:
+            self._values[(name, labels)] = value
+
+    def add_to_gauge(self, name: str, amount: float, labels: Labels = ()) -> None:
+        with self._lock:
+            self._values[(name, labels)] = self._values.get((name, labels), 0) + amount
+
+    def inc_counter(self, name: str, labels: Labels = ()) -> None:
+        self.add_to_gauge(name, 1, labels)
+
+    def register_collector(self, collector: Collector) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            values = sorted(self._values.items())
+            collectors = list(self._collectors)
+
+        samples: Dict[str, List[str]] = {}
+        for (name, labels), histogram in histograms:
+            counts, total = histogram.snapshot()
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+        for (name, labels), value in values:
+            samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for collector in collectors:
+            for name, labels, value in collector():
+                samples.setdefault(name, []).append(
+                    f"{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}")
+
+        output = []
+        for name, lines in samples.items():
+            metric_type, description = METRIC_HELP.get(name, ("untyped", name))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(lines)
+        return "\n".join(output) + "\n"
+
+    def _reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        for histogram in self._histograms.values():
+            histogram._reset_after_fork()
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels) + "}"
+
+
+def _escape_label_value(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY = MetricsRegistry()
+
+
+def stage_timer(stage: str, registry: Optional[MetricsRegistry] = None) -> _Timer:
+    """
+    Context manager recording the duration of one prediction step under thyroid_stage_duration_seconds
+    """
+    return (registry or REGISTRY).timer(STAGE_DURATION, (("stage", stage),))
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    """
+    Serve render_metrics() at /metrics from a daemon thread, for worker processes without a web app
+    :return: the running ThreadingHTTPServer, shutdown() stops it
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_metrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+os.register_at_fork(after_in_child=REGISTRY._reset_after_fork)
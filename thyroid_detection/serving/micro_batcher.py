@@ -0,0 +1,115 @@
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+
+
+class PredictionCoalescer:
+    """
+    Class Name :   PredictionCoalescer
+    Description :   Gathers prediction requests arriving within a short window into one
+                    stacked DataFrame so preprocessing and model predict run once per batch.
+
+                    The window is adaptive: rows already queued are always taken without
+                    waiting, and the dispatcher only holds a batch open for max_wait_ms when
+                    the previous batch had more than one caller, so a lone request is not delayed.
+
+    Output      :   Each caller receives the predictions for its own rows
+    On Failure  :   A failing batch is retried request by request so one bad input
+                    only fails its own caller
+    """
+
+    def __init__(self, predict_fn: Callable[[DataFrame], np.ndarray],
+                 max_batch_size: int = 64, max_wait_ms: float = 2.0):
+        """
+        :param predict_fn: function predicting a stacked DataFrame, e.g. thyroidModel.predict
+        :param max_batch_size: maximum number of rows dispatched in one predict call
+        :param max_wait_ms: maximum time a batch is held open for more rows
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[DataFrame, Future]]" = queue.Queue()
+        self._last_batch_requests = 1
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="prediction-coalescer", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, dataframe: DataFrame) -> np.ndarray:
+        """
+        Queue dataframe for the next batch and block until its predictions are ready
+        """
+        future: Future = Future()
+        self._queue.put((dataframe, future))
+        return future.result()
+
+    def queue_depth(self) -> int:
+        """
+        Number of requests waiting for the next batch
+        """
+        return self._queue.qsize()
+
+    def _gather(self) -> List[Tuple[DataFrame, Future]]:
+        batch = [self._queue.get()]
+        rows = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait_seconds
+        hold_open = self._last_batch_requests > 1
+
+        while rows < self.max_batch_size:
+            try:
+                if hold_open:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            rows += len(item[0])
+
+        self._last_batch_requests = len(batch)
+        return batch
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            batch = self._gather()
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                logging.error(f"Prediction coalescer failed to dispatch a batch: {e}")
+
+    def _run_batch(self, batch: List[Tuple[DataFrame, Future]]) -> None:
+        if len(batch) == 1:
+            self._run_single(*batch[0])
+            return
+
+        try:
+            stacked = pd.concat([dataframe for dataframe, _ in batch], ignore_index=True)
+            result = np.asarray(self.predict_fn(stacked))
+        except Exception:
+            logging.info(f"Batched prediction of {len(batch)} requests failed, retrying them one by one")
+            for dataframe, future in batch:
+                self._run_single(dataframe, future)
+            return
+
+        start = 0
+        for dataframe, future in batch:
+            stop = start + len(dataframe)
+            future.set_result(result[start:stop])
+            start = stop
+
+    def _run_single(self, dataframe: DataFrame, future: Future) -> None:
+        try:
+            future.set_result(np.asarray(self.predict_fn(dataframe)))
+        except Exception as e:
+            future.set_exception(e if isinstance(e, ThyroidException) else ThyroidException(e, sys))
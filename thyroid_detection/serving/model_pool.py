@@ -0,0 +1,256 @@
+import os
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from thyroid_detection.constants import (MODEL_POOL_MAX_BYTES, MODEL_POOL_MAX_BYTES_ENV_KEY,
+                                         MODEL_POOL_MISSING_VERSION_MAX_ENTRIES,
+                                         MODEL_POOL_MISSING_VERSION_TTL_SECONDS)
+from thyroid_detection.entity.estimator import thyroidModel
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+from thyroid_detection.serving.metrics import (MODEL_LOAD_DURATION, MODEL_LOADS, MODEL_POOL_BYTES,
+                                               MODEL_POOL_EVICTIONS, MODEL_POOL_MODELS, REGISTRY)
+
+# S3 error codes of a version that does not exist; HEAD errors have no body, so a malformed
+# version id only comes back as a bare 400
+MISSING_VERSION_ERROR_CODES = {"NoSuchVersion", "NoSuchKey", "InvalidArgument", "404", "400"}
+
+PoolKey = Tuple[str, str, str]
+
+
+class ModelVersionNotFound(Exception):
+    """
+    Raised when a request names a model version that does not exist in the bucket
+    """
+
+
+class _PoolEntry(NamedTuple):
+    model: thyroidModel
+    nbytes: int
+    etag: str
+
+
+class ModelPool:
+    """
+    Class Name :   ModelPool
+    Description :   Process-wide pool of pinned model versions keyed by (bucket, key, S3 version id),
+                    used to serve the rollback and candidate versions next to the current model of
+                    ModelHolder. Each version is downloaded once (concurrent requests for a cold
+                    version wait on one download), its resident size is estimated from the arrays
+                    it holds, and least recently used versions are dropped once the pool is over
+                    max_bytes. Pinned versions never change, so they are not checked for updates.
+                    Versions found missing are remembered for missing_ttl seconds and refused
+                    without asking S3 again.
+
+    Output      :   Loaded model of the requested version, pool size and evictions in /metrics
+    On Failure  :   ModelVersionNotFound for unknown versions, otherwise write an exception log
+                    and then raise an exception
+    """
+
+    _instance: Optional["ModelPool"] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_bytes: int = MODEL_POOL_MAX_BYTES,
+                 missing_ttl: float = MODEL_POOL_MISSING_VERSION_TTL_SECONDS,
+                 max_missing: int = MODEL_POOL_MISSING_VERSION_MAX_ENTRIES):
+        """
+        :param max_bytes: total estimated size of the pooled models before least recently used ones are dropped
+        :param missing_ttl: seconds a version found missing is refused without asking S3, 0 disables
+        :param max_missing: number of missing versions remembered, the oldest are forgotten first
+        """
+        self.max_bytes = max_bytes
+        self.missing_ttl = missing_ttl
+        self.max_missing = max_missing
+        self.total_bytes = 0
+        self._entries: "OrderedDict[PoolKey, _PoolEntry]" = OrderedDict()
+        # Missing version key -> time until which it is refused
+        self._missing: "OrderedDict[PoolKey, float]" = OrderedDict()
+        self._load_locks: Dict[PoolKey, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls, max_bytes: Optional[int] = None) -> "ModelPool":
+        """
+        Return the process-wide pool, sized from the MODEL_POOL_MAX_BYTES environment variable by default
+        """
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    if max_bytes is None:
+                        max_bytes = int(os.getenv(MODEL_POOL_MAX_BYTES_ENV_KEY, MODEL_POOL_MAX_BYTES))
+                    cls._instance = cls(max_bytes=max_bytes)
+        return cls._instance
+
+    def get_model(self, bucket_name: str, model_path: str, version_id: str) -> thyroidModel:
+        """
+        Return the model stored at bucket_name/model_path in S3 object version version_id
+        """
+        key = (bucket_name, model_path, version_id)
+        try:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry.model
+                if self._missing.get(key, 0.0) > time.monotonic():
+                    raise ModelVersionNotFound(f"Model version {version_id} of {bucket_name}/{model_path} "
+                                               f"does not exist")
+                load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+            with load_lock:
+                with self._lock:
+                    entry = self._entries.get(key)
+                if entry is None:
+                    try:
+                        entry = self._load(key)
+                    except BaseException:
+                        with self._lock:
+                            self._release_load_lock(key, load_lock)
+                        raise
+                    # The entry is published and the load lock released in one critical section,
+                    # so a request arriving in between cannot start a second download
+                    with self._lock:
+                        replaced = self._entries.pop(key, None)
+                        if replaced is not None:
+                            self.total_bytes -= replaced.nbytes
+                        self._entries[key] = entry
+                        self.total_bytes += entry.nbytes
+                        self._release_load_lock(key, load_lock)
+                        self._evict(keep=key)
+            return entry.model
+        except ModelVersionNotFound:
+            raise
+        except Exception as e:
+            if _is_missing_version(e):
+                self._remember_missing(key)
+                raise ModelVersionNotFound(f"Model version {version_id} of {bucket_name}/{model_path} "
+                                           f"does not exist") from e
+            raise ThyroidException(e, sys) from e
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"models": len(self._entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes}
+
+    def _load(self, key: PoolKey) -> _PoolEntry:
+        from thyroid_detection.entity.s3_estimator import thyroidEstimator
+
+        bucket_name, model_path, version_id = key
+        logging.info(f"Loading model {model_path} version {version_id} from bucket {bucket_name} into the pool")
+        start = time.perf_counter()
+        estimator = thyroidEstimator(bucket_name=bucket_name, model_path=model_path, version_id=version_id)
+        etag = estimator.get_model_etag()
+        model = estimator.load_model(etag=etag)
+        nbytes = estimate_model_size(model)
+        labels = (("model_path", model_path),)
+        REGISTRY.set_gauge(MODEL_LOAD_DURATION, time.perf_counter() - start, labels)
+        REGISTRY.inc_counter(MODEL_LOADS, labels)
+        logging.info(f"Pooled model {model_path} version {version_id} ({nbytes} bytes)")
+        return _PoolEntry(model=model, nbytes=nbytes, etag=etag)
+
+    def _remember_missing(self, key: PoolKey) -> None:
+        if self.missing_ttl <= 0:
+            return
+        with self._lock:
+            self._missing.pop(key, None)
+            self._missing[key] = time.monotonic() + self.missing_ttl
+            while len(self._missing) > self.max_missing:
+                self._missing.popitem(last=False)
+
+    def _release_load_lock(self, key: PoolKey, load_lock: threading.Lock) -> None:
+        # Called with the lock held
+        if self._load_locks.get(key) is load_lock:
+            del self._load_locks[key]
+
+    def _evict(self, keep: PoolKey) -> None:
+        # Called with the lock held; requests still using an evicted model keep their reference
+        for key in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                return
+            if key == keep:
+                continue
+            entry = self._entries.pop(key)
+            self.total_bytes -= entry.nbytes
+            REGISTRY.inc_counter(MODEL_POOL_EVICTIONS)
+            logging.info(f"Evicted model {key[1]} version {key[2]} ({entry.nbytes} bytes) from the pool")
+        if self.total_bytes > self.max_bytes:
+            logging.info(f"Model {keep[1]} version {keep[2]} alone exceeds the pool budget of {self.max_bytes} bytes")
+
+    def _reset_after_fork(self) -> None:
+        # The loaded models are kept and shared copy-on-write with the parent
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+
+def estimate_model_size(model: object) -> int:
+    """
+    Estimate the resident size of a model in bytes: the NumPy arrays it holds, including those
+    behind __getstate__ of extension types such as sklearn trees, plus the shallow size of
+    every other object reachable from it
+    """
+    # Objects are kept referenced by id so that temporaries (e.g. __getstate__ results) are not reused
+    seen = {}
+    stack = [model]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen[id(obj)] = obj
+        if isinstance(obj, np.ndarray):
+            total += obj.nbytes
+            if obj.dtype.hasobject:
+                stack.extend(obj.ravel().tolist())
+            continue
+        total += sys.getsizeof(obj)
+        if isinstance(obj, (str, bytes, int, float, bool, type(None), type, types.ModuleType, types.FunctionType)):
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            stack.append(vars(obj))
+        elif hasattr(obj, "__getstate__"):
+            try:
+                state = obj.__getstate__()
+            except Exception:
+                continue
+            if state is not None and state is not obj:
+                stack.append(state)
+    return total
+
+
+def _is_missing_version(error: BaseException) -> bool:
+    while error is not None:
+        response = getattr(error, "response", None)
+        if isinstance(response, dict) and response.get("Error", {}).get("Code") in MISSING_VERSION_ERROR_CODES:
+            return True
+        error = error.__cause__
+    return False
+
+
+def _collect_pool_metrics():
+    pool = ModelPool._instance
+    if pool is not None:
+        stats = pool.stats()
+        yield MODEL_POOL_MODELS, {}, stats["models"]
+        yield MODEL_POOL_BYTES, {}, stats["bytes"]
+
+
+REGISTRY.register_collector(_collect_pool_metrics)
+
+
+def _reset_pool_after_fork() -> None:
+    ModelPool._instance_lock = threading.Lock()
+    if ModelPool._instance is not None:
+        ModelPool._instance._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional, Sequence
+
+from thyroid_detection.constants import (FALLBACK_LATENCY_WINDOW, FALLBACK_MIN_HOLD_SECONDS,
+                                         FALLBACK_P95_MS_THRESHOLD, FALLBACK_QUEUE_DEPTH_THRESHOLD,
+                                         FALLBACK_RETRY_INTERVAL_SECONDS)
+from thyroid_detection.logger import logging
+from thyroid_detection.serving.metrics import MODEL_TIER_REQUESTS, REGISTRY
+
+PRIMARY_TIER = "primary"
+FALLBACK_TIER = "fallback"
+
+# Latency samples needed before the p95 is trusted to switch tiers
+MIN_LATENCY_SAMPLES: int = 20
+
+QueueDepthSource = Callable[[], int]
+
+# Queue depths of the serving layer (e.g. the admission queue), read by every selector
+_queue_depth_sources: List[QueueDepthSource] = []
+
+
+def register_queue_depth_source(source: QueueDepthSource) -> None:
+    """
+    Add a callable returning a number of queued requests to the overload signals of all tier selectors
+    """
+    _queue_depth_sources.append(source)
+
+
+class ModelTierSelector:
+    """
+    Class Name :   ModelTierSelector
+    Description :   Chooses between the primary model and the cheap fallback model for each
+                    prediction. The fallback tier is entered when the queued requests reach
+                    queue_depth_threshold or the p95 of recent prediction latencies reaches
+                    p95_ms_threshold (of single-row predictions), and left once both are back under half their threshold
+                    and the fallback has been active for min_hold_seconds, so the tier does
+                    not flap around a threshold. The latency window is cleared on every
+                    switch so each decision is made on the latency of the current tier.
+
+    Output      :   PRIMARY_TIER or FALLBACK_TIER, tier counts and the active tier in /metrics
+    On Failure  :   A fallback that cannot be loaded is skipped for retry_interval seconds
+    """
+
+    def __init__(self, queue_depth_threshold: int = FALLBACK_QUEUE_DEPTH_THRESHOLD,
+                 p95_ms_threshold: float = FALLBACK_P95_MS_THRESHOLD,
+                 window: int = FALLBACK_LATENCY_WINDOW, min_hold_seconds: float = FALLBACK_MIN_HOLD_SECONDS,
+                 retry_interval: float = FALLBACK_RETRY_INTERVAL_SECONDS,
+                 queue_depth_sources: Sequence[QueueDepthSource] = ()):
+        """
+        :param queue_depth_threshold: queued requests at which the fallback is used, 0 disables the signal
+        :param p95_ms_threshold: p95 prediction latency at which the fallback is used, 0 disables the signal
+        :param window: number of recent prediction latencies the p95 is computed on
+        :param min_hold_seconds: minimum time spent on the fallback before going back to the primary
+        :param retry_interval: seconds the fallback is skipped after it failed to load or predict
+        :param queue_depth_sources: queue depths specific to this model, read along with the registered ones
+        """
+        self.queue_depth_threshold = queue_depth_threshold
+        self.p95_ms_threshold = p95_ms_threshold
+        self.min_hold_seconds = min_hold_seconds
+        self.retry_interval = retry_interval
+        self.queue_depth_sources = list(queue_depth_sources)
+        self._latencies = deque(maxlen=window)
+        self._fallback_since: Optional[float] = None
+        self._fallback_unavailable_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def fallback_active(self) -> bool:
+        return self._fallback_since is not None
+
+    def queue_depth(self) -> int:
+        return sum(source() for source in self.queue_depth_sources + _queue_depth_sources)
+
+    def p95_ms(self) -> Optional[float]:
+        """
+        p95 of the recent prediction latencies in ms, None until MIN_LATENCY_SAMPLES are recorded
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        return latencies[int(0.95 * (len(latencies) - 1))] * 1000.0
+
+    def select(self) -> str:
+        queue_depth = self.queue_depth()
+        p95_ms = self.p95_ms()
+        now = time.monotonic()
+        with self._lock:
+            if self._fallback_since is None:
+                if now >= self._fallback_unavailable_until and self._is_overloaded(queue_depth, p95_ms, 1.0):
+                    self._switch(now, queue_depth, p95_ms)
+            elif (now - self._fallback_since >= self.min_hold_seconds
+                  and not self._is_overloaded(queue_depth, p95_ms, 0.5)):
+                self._switch(None, queue_depth, p95_ms)
+            return PRIMARY_TIER if self._fallback_since is None else FALLBACK_TIER
+
+    def record(self, tier: str, seconds: float, rows: int = 1) -> None:
+        """
+        Record one prediction of rows rows served by tier. Only single-row (coalesced)
+        latencies enter the p95 window: a batch takes time in proportion to its size, not to load
+        """
+        if rows == 1:
+            with self._lock:
+                self._latencies.append(seconds)
+        REGISTRY.inc_counter(MODEL_TIER_REQUESTS, (("tier", tier),))
+
+    def fallback_failed(self) -> None:
+        """
+        Go back to the primary and skip the fallback for retry_interval seconds
+        """
+        with self._lock:
+            self._fallback_unavailable_until = time.monotonic() + self.retry_interval
+            if self._fallback_since is not None:
+                self._switch(None, None, None)
+
+    def _is_overloaded(self, queue_depth: int, p95_ms: Optional[float], scale: float) -> bool:
+        if self.queue_depth_threshold > 0 and queue_depth >= self.queue_depth_threshold * scale:
+            return True
+        return self.p95_ms_threshold > 0 and p95_ms is not None and p95_ms >= self.p95_ms_threshold * scale
+
+    def _switch(self, fallback_since: Optional[float], queue_depth: Optional[int], p95_ms: Optional[float]) -> None:
+        # Called with the lock held
+        self._fallback_since = fallback_since
+        self._latencies.clear()
+        tier = PRIMARY_TIER if fallback_since is None else FALLBACK_TIER
+        logging.info(f"Switched to the {tier} model tier (queue depth {queue_depth}, p95 {p95_ms} ms)")
+
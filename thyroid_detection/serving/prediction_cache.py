@@ -0,0 +1,121 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional
+
+from pandas import DataFrame
+
+
+class PredictionCache:
+    """
+    Class Name :   PredictionCache
+    Description :   Bounded LRU cache of prediction labels with a per-entry TTL.
+
+                    Keys are a canonical hash of the input features, with numerical features
+                    rounded to a configurable number of decimals so that equivalent lab panels
+                    share an entry. Entries belong to one model version: the whole cache is
+                    dropped as soon as a lookup or insert is made for a different version.
+
+    Output      :   Cached labels and hit/miss/eviction counters
+    """
+
+    def __init__(self, feature_names: List[str], numerical_features: List[str], max_size: int = 10000,
+                 ttl_seconds: float = 300.0, rounding: Optional[Dict[str, int]] = None):
+        """
+        :param feature_names: features making up the key, in canonical order
+        :param numerical_features: features keyed by their float value, the others by their string value
+        :param max_size: maximum number of entries before least recently used ones are evicted
+        :param ttl_seconds: lifetime of an entry
+        :param rounding: decimals kept per numerical feature, features not listed are not rounded
+        """
+        self.feature_names = list(feature_names)
+        self.numerical_features = set(numerical_features)
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.rounding = dict(rounding or {})
+        # Key -> (expiry time, label)
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._model_version: Optional[Hashable] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def make_key(self, values: Iterable[object]) -> bytes:
+        """
+        Canonical key of one row of feature values, given in feature_names order
+        """
+        parts = []
+        for name, value in zip(self.feature_names, values):
+            if name in self.numerical_features:
+                try:
+                    number = float(value)
+                except (TypeError, ValueError):
+                    parts.append(str(value))
+                    continue
+                if math.isnan(number):
+                    parts.append("nan")
+                    continue
+                if name in self.rounding:
+                    number = round(number, self.rounding[name])
+                parts.append(repr(number + 0.0))
+            else:
+                parts.append(str(value))
+        return hashlib.blake2b("\x1f".join(parts).encode(), digest_size=16).digest()
+
+    def make_keys(self, dataframe: DataFrame) -> List[bytes]:
+        rows = dataframe[self.feature_names].itertuples(index=False, name=None)
+        return [self.make_key(row) for row in rows]
+
+    def get(self, key: bytes, model_version: Hashable) -> Optional[object]:
+        with self._lock:
+            self._check_version(model_version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: bytes, value: object, model_version: Hashable) -> None:
+        with self._lock:
+            self._check_version(model_version)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _check_version(self, model_version: Hashable) -> None:
+        if model_version != self._model_version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._model_version = model_version
@@ -0,0 +1,168 @@
+"""
+Pre-fork launcher for the ASGI app.
+
+The master process imports the app and loads the model once, then forks the
+workers, which share the model's NumPy arrays copy-on-write instead of each
+downloading and unpickling a private copy from S3.
+
+    python -m thyroid_detection.serving.prefork --workers 4
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Set
+
+import uvicorn
+from uvicorn.importer import import_from_string
+
+from thyroid_detection.constants import (APP_HOST, APP_PORT, APP_WORKERS, APP_HOST_ENV_KEY, APP_PORT_ENV_KEY,
+                                         APP_WORKERS_ENV_KEY)
+from thyroid_detection.entity.config_entity import ThyroidPredictorConfig
+from thyroid_detection.entity.s3_estimator import ModelHolder
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+
+WORKER_RESPAWN_DELAY_SECONDS: float = 1.0
+
+
+class PreforkServer:
+    """
+    Class Name :   PreforkServer
+    Description :   Binds the listening socket and loads the model in the master process,
+                    forks the uvicorn workers and respawns any worker that dies
+
+    On Failure  :   Write an exception log and then raise an exception
+    """
+
+    def __init__(self, app: str, host: str, port: int, workers: int,
+                 predictor_config: ThyroidPredictorConfig = ThyroidPredictorConfig()):
+        """
+        :param app: import string of the ASGI app, e.g. "asgi_app:app"
+        :param host: interface to bind
+        :param port: port to bind
+        :param workers: number of worker processes
+        :param predictor_config: configuration of the model to preload
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.predictor_config = predictor_config
+        self.worker_pids: Set[int] = set()
+        self._stopping = False
+        self._sock = None
+        self._asgi_app = None
+
+    def preload(self) -> None:
+        """
+        Import the app and load the model into the master before any worker is forked
+        """
+        try:
+            self._asgi_app = import_from_string(self.app)
+            model_holder = ModelHolder.get_instance(
+                bucket_name=self.predictor_config.model_bucket_name,
+                model_path=self.predictor_config.model_file_path,
+                refresh_interval=self.predictor_config.model_reload_interval_seconds,
+            )
+            model_holder.preload()
+            logging.info(f"Preloaded model {model_holder.model_path} version {model_holder.version} in master")
+
+            if self.predictor_config.fallback_enabled:
+                fallback_holder = ModelHolder.get_instance(
+                    bucket_name=self.predictor_config.model_bucket_name,
+                    model_path=self.predictor_config.fallback_model_file_path,
+                    refresh_interval=self.predictor_config.model_reload_interval_seconds,
+                )
+                try:
+                    fallback_holder.preload()
+                    logging.info(f"Preloaded fallback model version {fallback_holder.version} in master")
+                except Exception as e:
+                    logging.error(f"Fallback model preload failed, workers will load it on demand: {e}")
+
+            # Move everything allocated so far out of the collector's reach, so that
+            # garbage collections in the workers do not write to (and copy) the shared pages
+            gc.collect()
+            gc.freeze()
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def bind(self) -> None:
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self._sock.set_inheritable(True)
+
+    def spawn_worker(self) -> int:
+        pid = os.fork()
+        if pid != 0:
+            self.worker_pids.add(pid)
+            return pid
+
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            config = uvicorn.Config(self._asgi_app, host=self.host, port=self.port)
+            uvicorn.Server(config).run(sockets=[self._sock])
+        except Exception as e:
+            logging.error(f"Worker {os.getpid()} crashed: {e}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def stop(self, signum=None, frame=None) -> None:
+        self._stopping = True
+        for pid in list(self.worker_pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.worker_pids.discard(pid)
+
+    def run(self) -> None:
+        """
+        Preload, fork the workers and supervise them until SIGTERM/SIGINT
+        """
+        try:
+            self.preload()
+            self.bind()
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+            for _ in range(self.workers):
+                self.spawn_worker()
+            logging.info(f"Started {self.workers} workers on {self.host}:{self.port}: {sorted(self.worker_pids)}")
+
+            while self.worker_pids:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                self.worker_pids.discard(pid)
+                if not self._stopping:
+                    logging.error(f"Worker {pid} exited with status {status}, respawning")
+                    time.sleep(WORKER_RESPAWN_DELAY_SECONDS)
+                    self.spawn_worker()
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+        finally:
+            if self._sock is not None:
+                self._sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve thyroid predictions from pre-forked uvicorn workers")
+    parser.add_argument('--app', default='asgi_app:app')
+    parser.add_argument('--host', default=os.getenv(APP_HOST_ENV_KEY, APP_HOST))
+    parser.add_argument('--port', type=int, default=int(os.getenv(APP_PORT_ENV_KEY, APP_PORT)))
+    parser.add_argument('--workers', type=int, default=int(os.getenv(APP_WORKERS_ENV_KEY, APP_WORKERS)))
+    args = parser.parse_args()
+
+    PreforkServer(app=args.app, host=args.host, port=args.port, workers=args.workers).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+On-demand sampling profiler for live serving processes.
+
+A profile samples the Python stack of every thread of the process at a fixed interval from
+sys._current_frames() and aggregates them as collapsed stacks, one line per distinct stack:
+
+    thread;outer_function (path.py:12);inner_function (path.py:40) 57
+
+which flamegraph.pl, speedscope or inferno render directly. Nothing is instrumented, so the
+only cost is one stack walk per thread per interval while a profile runs, and none otherwise.
+With memory=True the profile also traces allocations with tracemalloc for its duration and
+reports the source lines whose allocated memory grew the most.
+
+    curl -H "Authorization: Bearer $DEBUG_PROFILE_TOKEN" "localhost:8080/debug/profile?seconds=30&format=collapsed" \\
+        | flamegraph.pl > profile.svg
+"""
+import hmac
+import math
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Mapping, NamedTuple, Optional
+
+from thyroid_detection.constants import (DEBUG_PROFILE_DEFAULT_SECONDS, DEBUG_PROFILE_INTERVAL_MS,
+                                         DEBUG_PROFILE_MAX_INTERVAL_MS, DEBUG_PROFILE_MAX_SECONDS,
+                                         DEBUG_PROFILE_TOKEN_ENV_KEY, DEBUG_PROFILE_TOP_ALLOCATIONS)
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+
+COLLAPSED_FORMAT = "collapsed"
+JSON_FORMAT = "json"
+
+# Smallest sampling interval, below it the stack walks themselves dominate the profile
+MIN_INTERVAL_MS: float = 1.0
+# Frames kept per allocation traceback when the profile starts tracemalloc itself
+TRACEMALLOC_FRAMES: int = 1
+
+# Installed packages and the standard library are shown by their import path
+_LIBRARY_PATH = re.compile(r".*[/\\](site|dist)-packages[/\\]|.*[/\\]lib[/\\]python\d+\.\d+[/\\]")
+_THREAD_NUMBER = re.compile(r"[-_ ]?\d+")
+
+# One profile at a time per process, concurrent ones would sample each other
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """
+    Raised when a profile is requested while another one is running in the process
+    """
+
+
+class ProfileRequest(NamedTuple):
+    seconds: float = DEBUG_PROFILE_DEFAULT_SECONDS
+    interval_ms: float = DEBUG_PROFILE_INTERVAL_MS
+    memory: bool = False
+    top: int = DEBUG_PROFILE_TOP_ALLOCATIONS
+    format: str = JSON_FORMAT
+
+    @classmethod
+    def from_query(cls, query: Mapping[str, str]) -> "ProfileRequest":
+        """
+        Read the profile parameters from the query string of /debug/profile
+        :raises ValueError: on a parameter out of range
+        """
+        # float() accepts "nan" and "inf", which no range check rejects and which never end the sampling loop
+        seconds = float(query.get("seconds", DEBUG_PROFILE_DEFAULT_SECONDS))
+        if not math.isfinite(seconds) or not 0 < seconds <= DEBUG_PROFILE_MAX_SECONDS:
+            raise ValueError(f"seconds must be in (0, {DEBUG_PROFILE_MAX_SECONDS}]")
+        interval_ms = float(query.get("interval_ms", DEBUG_PROFILE_INTERVAL_MS))
+        if not math.isfinite(interval_ms) or not MIN_INTERVAL_MS <= interval_ms <= DEBUG_PROFILE_MAX_INTERVAL_MS:
+            raise ValueError(f"interval_ms must be in [{MIN_INTERVAL_MS}, {DEBUG_PROFILE_MAX_INTERVAL_MS}]")
+        top = int(query.get("top", DEBUG_PROFILE_TOP_ALLOCATIONS))
+        if top < 1:
+            raise ValueError("top must be at least 1")
+        profile_format = query.get("format", JSON_FORMAT)
+        if profile_format not in (JSON_FORMAT, COLLAPSED_FORMAT):
+            raise ValueError(f"format must be {JSON_FORMAT} or {COLLAPSED_FORMAT}")
+        memory = query.get("memory", "0").lower() in ("1", "true", "yes")
+        return cls(seconds=seconds, interval_ms=interval_ms, memory=memory, top=top, format=profile_format)
+
+
+def profiling_enabled() -> bool:
+    """
+    The profile endpoint is only served when a token is configured
+    """
+    return bool(os.getenv(DEBUG_PROFILE_TOKEN_ENV_KEY))
+
+
+def is_authorized(authorization: Optional[str]) -> bool:
+    """
+    Check an Authorization header against the "Bearer <DEBUG_PROFILE_TOKEN>" of the process
+    """
+    token = os.getenv(DEBUG_PROFILE_TOKEN_ENV_KEY)
+    if not token or not authorization:
+        return False
+    scheme, _, credentials = authorization.partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(credentials.strip().encode(), token.encode())
+
+
+def run_profile(profile_request: ProfileRequest) -> dict:
+    """
+    Sample all the threads of the process, except the calling one, for profile_request.seconds
+    :return: dict with the collapsed stacks, sample counts and, with memory, the top allocation growth
+    :raises ProfilerBusy: when another profile is running
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running in this process")
+    try:
+        logging.info(f"Profiling the process for {profile_request.seconds}s "
+                     f"every {profile_request.interval_ms} ms (memory: {profile_request.memory})")
+        started_tracing = False
+        start_snapshot = None
+        if profile_request.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                started_tracing = True
+            start_snapshot = tracemalloc.take_snapshot()
+
+        try:
+            stacks, samples, elapsed = _sample_stacks(profile_request.seconds, profile_request.interval_ms / 1000.0)
+            result = {
+                "seconds": round(elapsed, 3),
+                "interval_ms": profile_request.interval_ms,
+                "samples": samples,
+                "collapsed": format_collapsed(stacks),
+            }
+            if profile_request.memory:
+                result["memory"] = _allocation_growth(start_snapshot, tracemalloc.take_snapshot(), profile_request.top)
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+        return result
+    except Exception as e:
+        raise ThyroidException(e, sys) from e
+    finally:
+        _profile_lock.release()
+
+
+def format_collapsed(stacks: Mapping[str, int]) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
+
+
+def _sample_stacks(seconds: float, interval: float):
+    own_thread = threading.get_ident()
+    stacks: Counter = Counter()
+    labels: Dict[object, str] = {}
+    samples = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    next_sample = start
+    while True:
+        thread_names = {thread.ident: _THREAD_NUMBER.sub("", thread.name) for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, "thread"))
+            stacks[";".join(reversed(stack))] += 1
+        samples += 1
+
+        # Sleep to the next tick of a fixed schedule so the stack walks do not stretch the interval
+        next_sample += interval
+        now = time.perf_counter()
+        if next_sample >= deadline:
+            break
+        if next_sample > now:
+            time.sleep(next_sample - now)
+    return stacks, samples, time.perf_counter() - start
+
+
+def _frame_label(code) -> str:
+    # ";" separates the frames of a collapsed stack
+    path = _short_path(code.co_filename)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _short_path(filename: str) -> str:
+    path = _LIBRARY_PATH.sub("", filename)
+    if os.path.isabs(path) and path.startswith(os.getcwd()):
+        path = os.path.relpath(path)
+    return path
+
+
+def _allocation_growth(start: tracemalloc.Snapshot, end: tracemalloc.Snapshot, top: int) -> dict:
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    start, end = start.filter_traces(ignore), end.filter_traces(ignore)
+    allocations: List[dict] = []
+    for stat in end.compare_to(start, "lineno")[:top]:
+        frame = stat.traceback[0]
+        allocations.append({
+            "location": f"{_short_path(frame.filename)}:{frame.lineno}",
+            "size_bytes": stat.size,
+            "size_diff_bytes": stat.size_diff,
+            "count": stat.count,
+            "count_diff": stat.count_diff,
+        })
+    current, peak = tracemalloc.get_traced_memory()
+    return {"traced_bytes": current, "peak_traced_bytes": peak, "top_allocations": allocations}
+
+
+def _reset_profiler_after_fork() -> None:
+    # A profile running in the parent when it forked is not running in the child
+    global _profile_lock
+    _profile_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_profiler_after_fork)
@@ -0,0 +1,285 @@
+"""
+Validation of the prediction inputs against the input_validation section of config/schema.yaml.
+
+The rules are compiled once into per-field checks. A batch is checked a whole column at a time
+with NumPy/pandas masks, and an error report is built only for the rows that fail, so a few
+malformed rows in a large batch cost neither an exception each nor the rest of the batch:
+
+    validator = InputValidator.from_schema()
+    batch = validator.validate_batch(records)
+    labels = batch.expand(classifier.predict_labels(batch.valid_rows()))  # None for invalid rows
+"""
+import functools
+import math
+import sys
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from thyroid_detection.constants import SCHEMA_FILE_PATH
+from thyroid_detection.exception import ThyroidException
+
+SCHEMA_VALIDATION_KEY = "input_validation"
+
+# Field name -> error message, for one row
+RowErrors = Dict[str, str]
+
+
+class InputValidationError(ValueError):
+    """
+    Raised when a request as a whole cannot be validated (e.g. a batch without a required column),
+    or when a single record has invalid fields
+    """
+
+    def __init__(self, message: str, errors: Optional[RowErrors] = None):
+        super().__init__(message)
+        self.errors = errors or {}
+
+
+class NumericalRule(NamedTuple):
+    name: str
+    integer: bool
+    minimum: Optional[float]
+    maximum: Optional[float]
+    nullable: bool
+
+    def check_value(self, value: object) -> Tuple[float, Optional[str]]:
+        if _is_blank(value):
+            return math.nan, None if self.nullable else "is required"
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return math.nan, "must be a number"
+        return number, self._value_error(number)
+
+    def check_column(self, column: pd.Series) -> Tuple[Optional[np.ndarray], Dict[str, np.ndarray]]:
+        if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+            # Already numeric, e.g. a binary columnar body: checked in place, never converted
+            converted = None
+            values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+            missing = np.isnan(values)
+            not_number = np.zeros(len(values), dtype=bool)
+        else:
+            converted = values = pd.to_numeric(column, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+            missing = _missing_mask(column, np.isnan(values))
+            not_number = np.isnan(values) & ~missing
+
+        errors = {"must be a number": not_number}
+        if not self.nullable:
+            errors["is required"] = missing
+        infinite = np.isinf(values)
+        errors["must be a finite number"] = infinite
+        if self.integer:
+            with np.errstate(invalid="ignore"):
+                errors["must be an integer"] = ~missing & ~infinite & (values != np.floor(values))
+        errors[self._range_message()] = self._out_of_range(values) & ~infinite
+        return converted, errors
+
+    def _value_error(self, number: float) -> Optional[str]:
+        if math.isnan(number):
+            return None if self.nullable else "is required"
+        if math.isinf(number):
+            return "must be a finite number"
+        if self.integer and number != math.floor(number):
+            return "must be an integer"
+        if (self.minimum is not None and number < self.minimum) or (self.maximum is not None and number > self.maximum):
+            return self._range_message()
+        return None
+
+    def _out_of_range(self, values: np.ndarray) -> np.ndarray:
+        out_of_range = np.zeros(len(values), dtype=bool)
+        if self.minimum is not None:
+            out_of_range |= values < self.minimum
+        if self.maximum is not None:
+            out_of_range |= values > self.maximum
+        return out_of_range
+
+    def _range_message(self) -> str:
+        if self.minimum is not None and self.maximum is not None:
+            return f"must be between {self.minimum:g} and {self.maximum:g}"
+        if self.minimum is not None:
+            return f"must be at least {self.minimum:g}"
+        return f"must be at most {self.maximum:g}"
+
+
+class CategoricalRule(NamedTuple):
+    name: str
+    values: Tuple[str, ...]
+    nullable: bool
+
+    def check_value(self, value: object) -> Tuple[object, Optional[str]]:
+        if _is_blank(value):
+            return math.nan, None if self.nullable else "is required"
+        if value not in self.values:
+            return math.nan, self._values_message()
+        return value, None
+
+    def check_column(self, column: pd.Series) -> Tuple[Optional[np.ndarray], Dict[str, np.ndarray]]:
+        unknown = ~column.isin(self.values).to_numpy()
+        missing = _missing_mask(column, unknown)
+        invalid = unknown & ~missing
+        converted = None
+        if missing.any():
+            # Blank strings and other nulls become NaN, imputed by the preprocessing pipeline
+            converted = column.to_numpy(dtype=object, copy=True)
+            converted[missing] = np.nan
+        errors = {self._values_message(): invalid}
+        if not self.nullable:
+            errors["is required"] = missing
+        return converted, errors
+
+    def _values_message(self) -> str:
+        return f"must be one of {', '.join(self.values)}"
+
+
+class BatchValidation(NamedTuple):
+    """
+    Validated batch: dataframe has every row with typed input columns (fields of invalid rows
+    are NaN), errors maps the position of every invalid row to its field errors
+    """
+    dataframe: DataFrame
+    errors: Dict[int, RowErrors]
+
+    @property
+    def invalid_count(self) -> int:
+        return len(self.errors)
+
+    def valid_mask(self) -> np.ndarray:
+        mask = np.ones(len(self.dataframe), dtype=bool)
+        mask[list(self.errors)] = False
+        return mask
+
+    def valid_rows(self) -> DataFrame:
+        """
+        The rows to predict; the whole dataframe, without a copy, when every row is valid
+        """
+        if not self.errors:
+            return self.dataframe
+        return self.dataframe[self.valid_mask()]
+
+    def expand(self, labels: np.ndarray) -> np.ndarray:
+        """
+        Spread the labels predicted for valid_rows() over all the rows, None for the invalid ones
+        """
+        if not self.errors:
+            return labels
+        expanded = np.full(len(self.dataframe), None, dtype=object)
+        expanded[self.valid_mask()] = labels
+        return expanded
+
+
+class InputValidator:
+    """
+    Class Name :   InputValidator
+    Description :   Checks the types, allowed categorical values and numeric ranges of the
+                    prediction inputs with rules compiled from config/schema.yaml. Single
+                    records are checked field by field in plain Python. Batches are checked
+                    one column at a time, and errors are only materialised for failing rows.
+
+    Output      :   Typed inputs and per-field errors
+    On Failure  :   InputValidationError for unusable requests, ThyroidException for a bad schema
+    """
+
+    def __init__(self, numerical: Sequence[NumericalRule], categorical: Sequence[CategoricalRule]):
+        self.numerical = list(numerical)
+        self.categorical = list(categorical)
+        self.rules = {rule.name: rule for rule in self.numerical + self.categorical}
+        self.columns = [rule.name for rule in self.numerical + self.categorical]
+
+    @classmethod
+    def from_schema(cls, schema_file_path: str = SCHEMA_FILE_PATH) -> "InputValidator":
+        # Imported here, main_utils pulls in yaml and dill which the serving path loads lazily
+        from thyroid_detection.utils.main_utils import read_yaml_file
+
+        try:
+            config = read_yaml_file(schema_file_path)[SCHEMA_VALIDATION_KEY]
+            numerical = [
+                NumericalRule(name=name, integer=spec.get("type", "float") == "integer",
+                              minimum=None if spec.get("min") is None else float(spec["min"]),
+                              maximum=None if spec.get("max") is None else float(spec["max"]),
+                              nullable=bool(spec.get("nullable", True)))
+                for name, spec in config.get("numerical", {}).items()
+            ]
+            categorical = [
+                CategoricalRule(name=name, values=tuple(str(value) for value in spec["values"]),
+                                nullable=bool(spec.get("nullable", False)))
+                for name, spec in config.get("categorical", {}).items()
+            ]
+            return cls(numerical=numerical, categorical=categorical)
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def validate_record(self, data: Mapping[str, object]) -> Dict[str, object]:
+        """
+        Check one record (form or JSON fields)
+        :return: the typed fields, missing values as NaN
+        :raises InputValidationError: with the errors of every invalid field
+        """
+        values, errors = {}, {}
+        for name, rule in self.rules.items():
+            value, error = rule.check_value(data.get(name))
+            if error is not None:
+                errors[name] = error
+            values[name] = value
+        if errors:
+            raise InputValidationError("Invalid input", errors)
+        for rule in self.numerical:
+            if rule.integer and not math.isnan(values[rule.name]):
+                values[rule.name] = int(values[rule.name])
+        return values
+
+    def validate_batch(self, records: Union[list, DataFrame], columns: Optional[List[str]] = None) -> BatchValidation:
+        """
+        Check every row of a batch (list of dicts or parsed DataFrame) column by column
+        :param columns: column order of the returned dataframe, the schema order by default
+        :raises InputValidationError: when required columns are absent
+        """
+        dataframe = records if isinstance(records, DataFrame) else DataFrame.from_records(records)
+        columns = columns or self.columns
+        missing_columns = [column for column in columns if column not in dataframe.columns]
+        if missing_columns:
+            raise InputValidationError(f"Missing columns in batch input: {missing_columns}")
+
+        try:
+            validated = dataframe if list(dataframe.columns) == columns else dataframe[columns]
+            copied = False
+            errors: Dict[int, RowErrors] = {}
+            for name in columns:
+                converted, error_masks = self.rules[name].check_column(validated[name])
+                for message, mask in error_masks.items():
+                    for position in np.flatnonzero(mask).tolist():
+                        errors.setdefault(position, {}).setdefault(name, message)
+                if converted is not None:
+                    # Shallow copy: only the converted columns are replaced, the others keep their arrays
+                    if not copied:
+                        validated, copied = validated.copy(deep=False), True
+                    validated[name] = converted
+            return BatchValidation(dataframe=validated, errors=dict(sorted(errors.items())))
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+
+@functools.lru_cache(maxsize=None)
+def get_input_validator(schema_file_path: str = SCHEMA_FILE_PATH) -> InputValidator:
+    """
+    The validator of schema_file_path, compiled on first use and shared by the process
+    """
+    return InputValidator.from_schema(schema_file_path)
+
+
+def _is_blank(value: object) -> bool:
+    if isinstance(value, str):
+        return not value.strip()
+    return value is None or value is pd.NA or value is pd.NaT or (isinstance(value, (float, np.floating)) and value != value)
+
+
+def _missing_mask(column: pd.Series, candidates: np.ndarray) -> np.ndarray:
+    # Only the candidate positions, the values that failed the vectorized type check, can be
+    # nulls or blank strings, so only they are looked at one by one
+    missing = np.zeros(len(column), dtype=bool)
+    positions = np.flatnonzero(candidates)
+    if len(positions):
+        missing[positions] = [_is_blank(value) for value in column.to_numpy()[positions]]
+    return missing
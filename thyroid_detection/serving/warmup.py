@@ -0,0 +1,163 @@
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from pandas import DataFrame
+
+from thyroid_detection.constants import WARMUP_BATCH_SIZE, WARMUP_RETRY_INTERVAL_SECONDS, WARMUP_ROUNDS
+from thyroid_detection.entity.config_entity import ThyroidPredictorConfig
+from thyroid_detection.entity.estimator import thyroidModel
+from thyroid_detection.exception import ThyroidException
+from thyroid_detection.logger import logging
+from thyroid_detection.pipline.prediction_pipeline import (THYROID_INPUT_COLUMNS, THYROID_NUMERICAL_COLUMNS,
+                                                           ThyroidClassifier)
+from thyroid_detection.serving.metrics import REGISTRY, WARMUP_DURATION
+
+# Categories used for synthetic rows when the model has no compiled encoder to read them from
+DEFAULT_WARMUP_CATEGORIES: Dict[str, List[str]] = {"sex": ["F", "M"]}
+DEFAULT_WARMUP_FLAGS: List[str] = ["f", "t"]
+
+
+def build_warmup_frame(model: thyroidModel, n_rows: int) -> DataFrame:
+    """
+    Build n_rows synthetic inputs with the prediction input columns. Numerical values are
+    spread around the fitted medians and categorical values cycle through the fitted
+    categories; the first row has missing numerical values so imputation runs too.
+    """
+    encoder = model.get_compiled_encoder()
+    rng = np.random.default_rng(0)
+    columns = {}
+    for column in THYROID_INPUT_COLUMNS:
+        if column in THYROID_NUMERICAL_COLUMNS:
+            median = 1.0
+            if encoder is not None and column in encoder.numerical_features:
+                median = float(encoder.medians[encoder.numerical_features.index(column)])
+            values = median * rng.uniform(0.5, 2.0, n_rows)
+            values[0] = np.nan
+        else:
+            categories = DEFAULT_WARMUP_CATEGORIES.get(column, DEFAULT_WARMUP_FLAGS)
+            if encoder is not None and column in encoder.categorical_features:
+                feature_index = encoder.categorical_features.index(column)
+                categories = [category for index, category in
+                              zip(encoder.onehot_feature_index, encoder.onehot_categories)
+                              if index == feature_index] or categories
+            values = [categories[row % len(categories)] for row in range(n_rows)]
+        columns[column] = values
+    return DataFrame(columns, columns=THYROID_INPUT_COLUMNS)
+
+
+class ModelWarmup:
+    """
+    Class Name :   ModelWarmup
+    Description :   Prefetches the model at server start (through thyroidEstimator.load_model)
+                    and runs synthetic warm-up predictions in a background thread, retrying
+                    until the model can be loaded. Backs the /healthz and /readyz probes.
+
+    Output      :   is_ready turns True once the model is loaded and warmed
+    On Failure  :   The error is logged and kept in status(), and the load is retried
+    """
+
+    def __init__(self, predictor_config: ThyroidPredictorConfig = ThyroidPredictorConfig(),
+                 rounds: int = WARMUP_ROUNDS, batch_size: int = WARMUP_BATCH_SIZE,
+                 retry_interval: float = WARMUP_RETRY_INTERVAL_SECONDS):
+        """
+        :param predictor_config: configuration of the model to prefetch
+        :param rounds: number of warm-up passes over the synthetic inputs
+        :param batch_size: number of synthetic rows predicted in one batch
+        :param retry_interval: seconds to wait before retrying a failed load
+        """
+        self.predictor_config = predictor_config
+        self.rounds = rounds
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.classifier: Optional[ThyroidClassifier] = None
+        self.warmup_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._ready = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set() and self.classifier is not None and self.classifier.model_holder.is_loaded
+
+    def start(self) -> None:
+        """
+        Start prefetching and warming up in a daemon thread, so that /healthz answers meanwhile
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="model-warmup", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.warm_up()
+                return
+            except Exception as e:
+                self.last_error = str(e)
+                logging.error(f"Model warm-up failed, retrying in {self.retry_interval}s: {e}")
+                self._stop_event.wait(self.retry_interval)
+
+    def warm_up(self) -> None:
+        """
+        Load the model and run the single row, batch and record prediction paths on synthetic inputs
+        """
+        try:
+            start = time.perf_counter()
+            self.classifier = ThyroidClassifier(self.predictor_config)
+            model = self.classifier.model_holder.get_model()
+
+            dataframe = build_warmup_frame(model, self.batch_size)
+            records = dataframe.to_dict(orient="records")
+            for _ in range(self.rounds):
+                model.predict(dataframe.iloc[:1])
+                model.predict(dataframe)
+                model.predict_records(records[:1])
+                model.predict_records(records)
+            self.classifier.map_predictions(model.predict(dataframe))
+            self.warm_up_fallback(dataframe)
+
+            self.warmup_seconds = time.perf_counter() - start
+            self.last_error = None
+            REGISTRY.set_gauge(WARMUP_DURATION, self.warmup_seconds)
+            self._ready.set()
+            logging.info(f"Model version {self.classifier.model_holder.version} "
+                         f"prefetched and warmed up in {self.warmup_seconds:.3f}s")
+        except Exception as e:
+            raise ThyroidException(e, sys) from e
+
+    def warm_up_fallback(self, dataframe: DataFrame) -> None:
+        """
+        Prefetch the fallback model so that overload does not wait on its download; the server
+        is ready without it and the classifier serves the primary while it cannot be loaded
+        """
+        fallback_holder = self.classifier.fallback_holder
+        if fallback_holder is None:
+            return
+        try:
+            fallback_model = fallback_holder.get_model()
+            for _ in range(self.rounds):
+                fallback_model.predict(dataframe.iloc[:1])
+                fallback_model.predict(dataframe)
+            logging.info(f"Fallback model version {fallback_holder.version} prefetched")
+        except Exception as e:
+            logging.error(f"Fallback model prefetch failed: {e}")
+            self.classifier.tier_selector.fallback_failed()
+
+    def status(self) -> dict:
+        model_holder = None if self.classifier is None else self.classifier.model_holder
+        fallback_holder = None if self.classifier is None else self.classifier.fallback_holder
+        return {
+            "ready": self.is_ready,
+            "model_loaded": model_holder is not None and model_holder.is_loaded,
+            "model_version": None if model_holder is None else model_holder.version,
+            "fallback_model_version": None if fallback_holder is None else fallback_holder.version,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.last_error,
+        }